@@ -4,7 +4,7 @@ from typing import Optional, Dict, Any
 from langchain_core.messages import SystemMessage, HumanMessage, AIMessage
 from langchain_openai import ChatOpenAI
 import os
-from langchain_google_genai import ChatGoogleGenerativeAI
+from llm import get_gemini_llm
 import os
 from prompt_cache import normalize_prefix
 
@@ -55,11 +55,7 @@ async def SimpleLLm(state: GraphState) -> GraphState:
             from llm import get_llm
             chat=get_llm(llm_model, 0.6)  
         else:
-            chat= ChatGoogleGenerativeAI(
-                model="gemini-2.5-flash-lite",
-                temperature=0.7,
-                api_key=google_api_key,
-            )
+            chat = get_gemini_llm(0.7)
         
         formatted_history = []
         if summary:
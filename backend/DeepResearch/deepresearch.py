@@ -237,7 +237,6 @@ async def synthesize_report(
         sources=sources_text
     )
 
-    llm = ChatOpenAI(model=llm_model, temperature=0.3)
     response = await llm1.ainvoke([HumanMessage(content=synthesis_prompt)])
     
     final_report = response.content
@@ -4,11 +4,10 @@ from langchain_openai import ChatOpenAI
 from langchain_core.messages import HumanMessage
 from llm import get_reasoning_llm, get_llm
 from DeepResearch.prompt_loader import PROMPTS
-from langchain_google_genai import ChatGoogleGenerativeAI
+from llm import get_gemini_llm
 from dotenv import load_dotenv
 load_dotenv()
 import os
-google_api_key=os.getenv("GOOGLE_API_KEY", "")
 llm1 = get_reasoning_llm()
 
 async def synthesize_report_node(state: GraphState) -> GraphState:
@@ -92,11 +91,7 @@ async def synthesize_report_node(state: GraphState) -> GraphState:
     )
 
     # Stream the LLM response
-    llm2 = ChatGoogleGenerativeAI(
-        model="gemini-2.5-flash-lite",
-        temperature=0.3,
-        google_api_key=google_api_key,
-    )
+    llm2 = get_gemini_llm(0.3)
     
     async for chunk in llm2.astream([HumanMessage(content=synthesis_prompt)]):
         if hasattr(chunk, 'content') and chunk.content:
@@ -7,9 +7,11 @@ import os
 import json
 import asyncio
 from typing import List
-from langchain_google_genai import ChatGoogleGenerativeAI
 import os
-from prompt_cache import normalize_prefix
+from prompt_cache import normalize_prefix, response_cache
+from Orchestrator.router import tiered_router, looks_multi_intent
+from Orchestrator.parallel_steps import plan_groups, PARALLEL_ROUTES
+from answer_cache import is_self_contained
 
 def load_base_prompt() -> str:
     path = os.path.join(os.path.dirname(__file__), "orchestrator.md")
@@ -18,7 +20,7 @@ def load_base_prompt() -> str:
             return f.read()
     except FileNotFoundError:
         return "You are a Retrieval-Augmented Generation (RAG) assistant. Answer using only the provided context."
-from llm import get_llm
+from llm import get_llm, get_gemini_llm, DEFAULT_GEMINI_MODEL
 prompt_template = load_base_prompt()
 # === Prompt caching setup for Orchestrator ===
 CORE_PREFIX_PATH = os.path.join(os.path.dirname(__file__), "..", "prompts", "core_prefix.md")
@@ -57,63 +59,18 @@ def _format_last_turns(messages, k=3):
         tail.append(f"{speaker}: {content}")
     return "\n".join(tail)
 
-async def summarizer(state, keep_last=2):
-    """
-    Summarizes older parts of the conversation and keeps only
-    the last `keep_last` user–assistant turns (each max 300 words).
-    """
-    msgs = state.get("messages") or []
-    if len(msgs) <= keep_last:
-        return
-
-    older = msgs[:-keep_last]
-    recent = msgs[-keep_last:]
-
-    print(f"session summary caleed-----------------------------------//////")
-    def truncate_text(text: str, word_limit: int = 300):
-        words = text.split()
-        return " ".join(words[:word_limit]) + ("..." if len(words) > word_limit else "")
-
-    for m in recent:
-        if "content" in m and isinstance(m["content"], str):
-            m["content"] = truncate_text(m["content"])
-
-    
-    old_text = []
-    for m in older:
-        role = (m.get("type") or m.get("role") or "").lower()
-        content = m.get("content") or ""
-        if not content:
-            continue
-        speaker = "User" if role in ("human", "user") else "Assistant"
-        old_text.append(f"{speaker}: {content}")
-    full_old_text = "\n".join(old_text)[:8000]  
-    
-    system_prompt = (
-        "You are a summarization agent. Summarize the following chat history into <300 words, "
-        "preserving key intents, facts, and unresolved items. Output only plain text."
-    )
-    user_prompt = f"Summarize this conversation:\n\n{full_old_text}"
-
+def _is_json(text: str) -> bool:
     try:
-        from langchain_google_genai import ChatGoogleGenerativeAI
-        google_api_key = os.getenv("GOOGLE_API_KEY", "")
-        llm = ChatGoogleGenerativeAI(model="gemini-2.5-flash-lite", temperature=0.3, api_key=google_api_key)
-        result = await llm.ainvoke([
-            SystemMessage(content=system_prompt),
-            HumanMessage(content=user_prompt)
-        ])
-        summary = (result.content or "").strip()
-    except Exception as e:
-        summary = "Summary of earlier conversation: user and assistant discussed multiple related topics."
+        json.loads(text.strip())
+        return True
+    except Exception:
+        return False
 
-    
-    ctx = state.get("context") or {}
-    sess = ctx.get("session") or {}
-    sess["summary"] = summary
-    ctx["session"] = sess
-    state["context"] = ctx
-    state["messages"] = recent
+
+def _has_json_object(text: str) -> bool:
+    import re
+    match = re.search(r"\{[\s\S]*\}", text)
+    return _is_json(match.group(0).replace("{{", "{").replace("}}", "}")) if match else _is_json(text)
 
 
 async def is_folloup(user_query: str,
@@ -152,13 +109,11 @@ async def is_folloup(user_query: str,
         f"NEW user message: {user_query}\n"
         "Return JSON only."
     ) 
-    google_api_key = os.getenv("GOOGLE_API_KEY", "")
-    llm= ChatGoogleGenerativeAI(
-                model="gemini-2.5-flash-lite",
-                temperature=0.3,
-                api_key=google_api_key,
-            )
-    result=await llm.ainvoke([SystemMessage(sys), HumanMessage(usr)])  
+    llm = get_gemini_llm(0.3)
+    result = await response_cache.ainvoke(
+        "followup_judge", f"{DEFAULT_GEMINI_MODEL}@0.3", llm,
+        [SystemMessage(sys), HumanMessage(usr)], validate=_is_json
+    )
     text=result.content.strip()
     try:
         obj = json.loads(text)
@@ -216,14 +171,11 @@ async def analyze_query(
         messages = [system_msg, HumanMessage(content=dynamic_context)]
 
 
-        google_api_key = os.getenv("GOOGLE_API_KEY", "")
-        chat = ChatGoogleGenerativeAI(
-            model="gemini-2.5-flash-lite",
-            temperature=0.3,
-            api_key=google_api_key,
-        )
+        chat = get_gemini_llm(0.3)
 
-        response = await chat.ainvoke(messages)
+        response = await response_cache.ainvoke(
+            "router", f"{DEFAULT_GEMINI_MODEL}@0.3", chat, messages, validate=_has_json_object
+        )
         content = (response.content or "").strip()
         print(f"[Analyzer Raw Output] {content}")
 
@@ -247,8 +199,7 @@ def _get_last_output(state: GraphState) -> dict | None:
     return state.get("intermediate_results", [])[-1] if state.get("intermediate_results") else None
 
 
-async def rewrite_query(state: GraphState) -> str:
-    REWRITE_CORE_PREFIX = """
+REWRITE_CORE_PREFIX = """
 You are a query rewriting expert inside an AI Orchestrator.
 Your job is to take the user goal, current plan step, and limited context,
 and produce a concise, self-contained rewritten query for the next node.
@@ -259,12 +210,43 @@ Follow these permanent rules:
 - Maintain factual and logical continuity.
 """
 
-    STATIC_SYS_REWRITE = normalize_prefix([CORE_PREFIX, REWRITE_CORE_PREFIX])
+STATIC_SYS_REWRITE = normalize_prefix([CORE_PREFIX, REWRITE_CORE_PREFIX])
+
+
+def _has_history(state: GraphState) -> bool:
+    summary = (state.get("context") or {}).get("session", {}).get("summary", "")
+    return bool(summary or state.get("messages"))
+
+
+def _step_uses_resolved_query(step: str) -> bool:
+    # SimpleLLM answers the raw user query, so a rewrite for it would be thrown away
+    return normalize_route(step) != "SimpleLLM"
+
+
+def needs_rewrite(state: GraphState, plan: List[str]) -> bool:
+    """
+    Whether the first step of `plan` needs an LLM rewrite of the user query.
+    Single-step plans only need one when the query leans on earlier turns;
+    RAG and deep research always take the raw query. Multi-step plans get a
+    query tailored to each step.
+    """
+    if len(plan) > 1:
+        return _step_uses_resolved_query(plan[0])
+    step = plan[0] if plan else ""
+    if normalize_route(step) in ("RAG", "deepResearch") or not _step_uses_resolved_query(step):
+        return False
+    return _has_history(state) and not is_self_contained(state.get("user_query", ""))
+
 
+def _rewrite_prompt(state: GraphState, step_index: Optional[int] = None) -> str:
+    """
+    Rewrite prompt for plan step `step_index` (default: the current task),
+    built from the state as it is now so it can be sent while a node runs.
+    """
     user_query = state.get("user_query", "")
-    current_task = state.get("current_task", "")
     plan = state.get("tasks", [])
-    idx = state.get("task_index", 0)
+    idx = state.get("task_index", 0) if step_index is None else step_index
+    current_task = state.get("current_task", "") if step_index is None else plan[step_index]
     intermediate_results = state.get("intermediate_results", [])
 
 
@@ -316,19 +298,17 @@ Guidelines:
 - If it's a continuation of a multi-node flow, refine using only the previous node’s output.
 - Output ONLY the rewritten query. No explanation or formatting.
 """
+    return prompt
+
 
+async def _ask_rewrite(prompt: str, user_query: str) -> str:
     try:
-        google_api_key = os.getenv("GOOGLE_API_KEY", "")
-        llm = ChatGoogleGenerativeAI(
-            model="gemini-2.5-flash-lite",
-            temperature=0.3,
-            api_key=google_api_key,
-        )
+        llm = get_gemini_llm(0.3)
 
         system_msg = SystemMessage(content=STATIC_SYS_REWRITE)
         human_msg = HumanMessage(content=prompt)
         print("🚀 Sending rewrite prompt to LLM with cached prefix...")
-        result = await llm.ainvoke([system_msg, human_msg])
+        result = await response_cache.ainvoke("query_rewrite", f"{DEFAULT_GEMINI_MODEL}@0.3", llm, [system_msg, human_msg])
 
         rewritten = (result.content or "").strip()
         words = rewritten.split()
@@ -347,6 +327,79 @@ Guidelines:
         print("⚠️ Falling back to original user query.\n")
         return user_query
 
+
+async def rewrite_query(state: GraphState, step_index: Optional[int] = None) -> str:
+    return await _ask_rewrite(_rewrite_prompt(state, step_index), state.get("user_query", ""))
+
+
+def _needs_previous_output(state: GraphState, idx: int) -> bool:
+    """
+    Whether plan step `idx` needs the output of step `idx - 1`, going by the
+    analyzer's depends_on. Unannotated steps are treated as plan_groups
+    treats them: independent only when both are parallel-safe sources.
+    """
+    plan = state.get("tasks") or []
+    route, previous = normalize_route(plan[idx]), normalize_route(plan[idx - 1])
+    deps = {normalize_route(k): {normalize_route(d) for d in (v or [])} for k, v in (state.get("task_dependencies") or {}).items()}
+    if route in deps:
+        return previous in deps[route]
+    return not (route in PARALLEL_ROUTES and previous in PARALLEL_ROUTES)
+
+
+def _prefetch_next_rewrite(state: GraphState):
+    """
+    Start the rewrite for the step after the one being dispatched, so it is
+    computed while the current node streams. Only done when that step does
+    not need the current step's output; otherwise it is rewritten once the
+    current step has finished.
+    """
+    _cancel_pending_rewrite(state)
+    idx = state.get("task_index", 0)
+    plan = state.get("tasks") or []
+    if idx + 1 < len(plan) and _step_uses_resolved_query(plan[idx + 1]) and not _needs_previous_output(state, idx + 1):
+        prompt = _rewrite_prompt(state, idx + 1)
+        state["_pending_rewrite"] = asyncio.create_task(_ask_rewrite(prompt, state.get("user_query", "")))
+
+
+async def _dispatch_group(state: GraphState, start: int, first_query: Optional[str] = None) -> Optional[str]:
+    """
+    If the plan step at `start` opens a group of independent steps, rewrite
+    the query of every step in the group concurrently and route to the
+    ParallelSteps node; task_index then points at the group's last step.
+    Returns None when the step runs on its own.
+    """
+    group = next((g for g in state.get("task_groups") or [] if g[0] == start), None)
+    if not group or len(group) < 2:
+        return None
+    plan = state["tasks"]
+    pending = state.get("_pending_rewrite")
+    state["_pending_rewrite"] = None
+
+    async def query_for(i: int) -> str:
+        if i == start and first_query is not None:
+            return first_query
+        if i == start and pending is not None:
+            return await pending
+        return await rewrite_query(state, i)
+
+    if pending is not None and first_query is not None:
+        pending.cancel()
+    queries = await asyncio.gather(*(query_for(i) for i in group))
+    state["resolved_queries"] = [{"index": i, "task": plan[i], "query": q} for i, q in zip(group, queries)]
+    state["task_index"] = group[-1]
+    state["current_task"] = plan[group[-1]]
+    state["resolved_query"] = queries[0]
+    _prefetch_next_rewrite(state)
+    print(f"[Orchestrator] Steps {[plan[i] for i in group]} are independent → running in parallel")
+    return "ParallelSteps"
+
+
+def _cancel_pending_rewrite(state: GraphState):
+    pending = state.get("_pending_rewrite")
+    if pending is not None and not pending.done():
+        pending.cancel()
+    state["_pending_rewrite"] = None
+
     
 def normalize_route(name: str) -> str:
     if not name:
@@ -363,7 +416,6 @@ def normalize_route(name: str) -> str:
     }
     return mapping.get(key, name)
 async def orchestrator(state: GraphState) -> GraphState:
-    # await summarizer(state, keep_last=2)
     user_query = state.get("user_query", "")
     docs = state.get("doc", [])
     llm_model = state.get("llm_model", "gpt-4o")
@@ -421,19 +473,29 @@ async def orchestrator(state: GraphState) -> GraphState:
         last_route = sess.get("last_route")
         session_summary = sess.get("summary", "")
         recent_messages_text = _format_last_turns_for_prompt(messages, k=2)
-        
-        analyze_task = analyze_query(
-            user_message=user_query,
-            prompt_template=prompt_template,
-            llm=llm_model,
-            recent_messages_text=recent_messages_text,
-            session_summary=session_summary,
-            last_route=last_route,
-        )
-        
-        tentative_rewrite_task = rewrite_query(state)
-        
-        result, tentative_rewrite = await asyncio.gather(analyze_task, tentative_rewrite_task)
+
+        # Rules and the local classifier first; the LLM analyzer only when neither is confident
+        result = tiered_router.route(state, last_route)
+        tentative_rewrite = None
+        if result:
+            print(f"[Orchestrator] Routed by {result['tier']} tier → {result['execution_order']} ({result['reasoning']})")
+        else:
+            analyze_task = analyze_query(
+                user_message=user_query,
+                prompt_template=prompt_template,
+                llm=llm_model,
+                recent_messages_text=recent_messages_text,
+                session_summary=session_summary,
+                last_route=last_route,
+            )
+
+            # Rewrite speculatively alongside the analyzer only when the plan is likely to need it
+            if looks_multi_intent(user_query) or (_has_history(state) and not is_self_contained(user_query)):
+                tentative_rewrite_task = rewrite_query(state)
+                result, tentative_rewrite = await asyncio.gather(analyze_task, tentative_rewrite_task)
+            else:
+                result = await analyze_task
+            tiered_router.record_llm(ok=result is not None)
 
 
 
@@ -465,14 +527,21 @@ async def orchestrator(state: GraphState) -> GraphState:
         state["tasks"] = plan
         state["task_index"] = 0 
         state["current_task"] = plan[0]
+        depends_on = (result or {}).get("depends_on")
+        state["task_dependencies"] = depends_on if isinstance(depends_on, dict) else {}
+        state["task_groups"] = plan_groups(plan, state["task_dependencies"], normalize_route)
         route =normalize_route(plan[0]) 
         
-                
-        if len(plan)==1 and plan[0]=="rag":
-                state["resolved_query"] = user_query
+        parallel_route = await _dispatch_group(state, 0, first_query=tentative_rewrite)
+        if parallel_route:
+            route = parallel_route
+        elif needs_rewrite(state, plan):
+            # Use the tentative rewrite from parallel execution when one was started
+            state["resolved_query"] = tentative_rewrite if tentative_rewrite is not None else await rewrite_query(state)
+            _prefetch_next_rewrite(state)
         else:
-               # Use the tentative rewrite from parallel execution
-               state["resolved_query"] = tentative_rewrite
+            state["resolved_query"] = user_query
+            _prefetch_next_rewrite(state)
        
         state["route"] = route
         ctx = state.get("context") or {}
@@ -493,13 +562,25 @@ async def orchestrator(state: GraphState) -> GraphState:
             state["response"] = None
 
         idx = state.get("task_index", 0)
-        if idx + 1 < len(state["tasks"]):
+        parallel_route = await _dispatch_group(state, idx + 1) if idx + 1 < len(state["tasks"]) else None
+        if parallel_route:
+            route = parallel_route
+        elif idx + 1 < len(state["tasks"]):
             state["task_index"] = idx + 1
             next_task = state["tasks"][state["task_index"]]
             state["current_task"] = next_task
             route = normalize_route(next_task)
-            clean_query = await rewrite_query(state)
+            # Prefetched while the previous step ran
+            pending = state.get("_pending_rewrite")
+            state["_pending_rewrite"] = None
+            if not _step_uses_resolved_query(next_task):
+                clean_query = user_query
+            elif pending is not None:
+                clean_query = await pending
+            else:
+                clean_query = await rewrite_query(state)
             state["resolved_query"] = clean_query
+            _prefetch_next_rewrite(state)
 
         else: 
             if len(state["tasks"]) > 1:
@@ -530,8 +611,9 @@ async def orchestrator(state: GraphState) -> GraphState:
     if state.get('response'):
         ctx["session"] = sess
         state["context"] = ctx
+    # The conversation summary is updated in the background once the response is delivered
     if state.get("route") == "END":
-        await summarizer(state, keep_last=2)
+        _cancel_pending_rewrite(state)
     print(f"Orchestrator routing to: {route}")
     print(f"Orchestrator output state keys: {list(state.keys())}")
     print(f"Route set in state: {state.get('route')}")
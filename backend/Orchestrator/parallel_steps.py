@@ -0,0 +1,167 @@
+# parallel_steps.py
+import asyncio
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+from graph_type import GraphState
+
+# Routes that only read the user goal and the session, never an earlier step's output,
+# and can therefore run side by side
+PARALLEL_ROUTES = {"WebSearch", "RAG"}
+
+# Keys every branch sets for itself; they are merged explicitly, not copied back
+_BRANCH_KEYS = {"current_task", "task_index", "resolved_query", "response", "intermediate_results", "_chunk_callback",
+                "messages", "context"}
+
+NodeFn = Callable[[GraphState], Awaitable[GraphState]]
+
+
+def plan_groups(plan: List[str], depends_on: Optional[Dict[str, List[str]]], normalize: Callable[[str], str]) -> List[List[int]]:
+    """
+    Split a plan into consecutive groups of step indices that may run together.
+
+    `depends_on` maps a step to the steps whose output it needs (as returned
+    by the analyzer). A step joins the current group when it and every step
+    already in the group are parallel-safe routes and it depends on none of
+    them. Without annotations, parallel-safe steps are independent sources.
+    Groups keep plan order, so a sequential run is the one-step-per-group case.
+    """
+    deps = {normalize(k): {normalize(d) for d in (v or [])} for k, v in (depends_on or {}).items()}
+    groups: List[List[int]] = []
+    for i, step in enumerate(plan):
+        route = normalize(step)
+        current = groups[-1] if groups else None
+        if (
+            current is not None
+            and route in PARALLEL_ROUTES
+            and all(normalize(plan[j]) in PARALLEL_ROUTES for j in current)
+            and not deps.get(route, set()) & {normalize(plan[j]) for j in current}
+            and route not in {normalize(plan[j]) for j in current}
+        ):
+            current.append(i)
+        else:
+            groups.append([i])
+    return groups
+
+
+def _copy_context(context: Dict[str, Any]) -> Dict[str, Any]:
+    # Two levels deep: nodes replace or update entries of context["session"], never document contents
+    return {k: dict(v) if isinstance(v, dict) else v for k, v in context.items()}
+
+
+def _merge_context(target: Dict[str, Any], original: Dict[str, Any], branch: Dict[str, Any]):
+    """Apply what one branch changed in its copy of the context onto `target`."""
+    for key, value in branch.items():
+        before = original.get(key)
+        if isinstance(value, dict) and isinstance(before, dict) and isinstance(target.get(key), dict):
+            for k, v in value.items():
+                if v is not before.get(k):
+                    target[key][k] = v
+            for k in before.keys() - value.keys():
+                target[key].pop(k, None)
+        elif value is not before:
+            target[key] = value
+    for key in original.keys() - branch.keys():
+        target.pop(key, None)
+
+
+class _OrderedStreams:
+    """
+    Interleaves the chunk streams of concurrent branches in plan order: the
+    earliest unfinished branch streams live, later ones are buffered and
+    flushed as soon as every branch before them has finished.
+    """
+
+    def __init__(self, callback: Optional[Callable[[str], Awaitable[None]]], count: int):
+        self._callback = callback
+        self._buffers: List[List[str]] = [[] for _ in range(count)]
+        self._done = [False] * count
+        self._live = 0
+        self._lock = asyncio.Lock()
+
+    def writer(self, index: int) -> Callable[[str], Awaitable[None]]:
+        async def write(chunk: str):
+            if self._callback is None:
+                return
+            async with self._lock:
+                if index == self._live:
+                    await self._callback(chunk)
+                else:
+                    self._buffers[index].append(chunk)
+        return write
+
+    async def finish(self, index: int):
+        async with self._lock:
+            self._done[index] = True
+            while self._live < len(self._done) and self._done[self._live]:
+                self._live += 1
+                if self._live < len(self._done):
+                    await self._flush(self._live)
+
+    async def _flush(self, index: int):
+        buffered, self._buffers[index] = self._buffers[index], []
+        if self._callback is not None and buffered:
+            await self._callback("".join(buffered))
+
+
+async def run_parallel_steps(state: GraphState, nodes: Dict[str, NodeFn], normalize: Callable[[str], str]) -> GraphState:
+    """
+    Graph node running the plan steps listed in state["resolved_queries"]
+    concurrently, each on its own copy of the state with its own rewritten
+    query. Output is streamed in plan order, and intermediate_results and
+    other state changes are merged in plan order, exactly as if the steps
+    had run one after another.
+    """
+    steps = state.get("resolved_queries") or []
+    streams = _OrderedStreams(state.get("_chunk_callback"), len(steps))
+    base_results = list(state.get("intermediate_results") or [])
+    base_messages = list(state.get("messages") or [])
+    base_context = _copy_context(state.get("context") or {})
+    original = dict(state)
+
+    async def run_branch(position: int, step: Dict[str, Any]) -> GraphState:
+        branch = dict(state)
+        branch.update({
+            "current_task": step["task"],
+            "task_index": step["index"],
+            "resolved_query": step["query"],
+            "response": None,
+            "intermediate_results": list(base_results),
+            "messages": list(base_messages),
+            "context": _copy_context(base_context),
+            "_chunk_callback": streams.writer(position),
+        })
+        try:
+            return await nodes[normalize(step["task"])](branch)
+        finally:
+            await streams.finish(position)
+
+    print(f"[Parallel] Running {[s['task'] for s in steps]} concurrently")
+    outcomes = await asyncio.gather(*(run_branch(i, s) for i, s in enumerate(steps)), return_exceptions=True)
+
+    results = list(base_results)
+    # Merged into the original containers, which may be shared with the caller (state["messages"] is the session's)
+    messages = state["messages"] if isinstance(state.get("messages"), list) else list(base_messages)
+    context = state["context"] if isinstance(state.get("context"), dict) else {}
+    for step, outcome in zip(steps, outcomes):
+        if isinstance(outcome, BaseException):
+            # Same outcome as the sequential graph: the first failing step fails the run
+            raise outcome
+        for key, value in outcome.items():
+            if key not in _BRANCH_KEYS and value is not original.get(key):
+                state[key] = value
+        # Each branch's own copies of the shared containers, applied in plan order
+        messages.extend((outcome.get("messages") or [])[len(base_messages):])
+        _merge_context(context, base_context, outcome.get("context") or {})
+        # What the node recorded itself, then the entry the orchestrator records after each step
+        results.extend((outcome.get("intermediate_results") or [])[len(base_results):])
+        if outcome.get("response"):
+            results.append({
+                "node": step["task"],
+                "query": step["query"],
+                "output": outcome["response"]
+            })
+    state["intermediate_results"] = results
+    state["messages"] = messages
+    state["context"] = context
+    state["response"] = None
+    return state
@@ -0,0 +1,224 @@
+# router.py
+import os
+import re
+import math
+from collections import Counter
+from typing import Any, Dict, List, Optional, Tuple
+
+# Set to false to send every first turn to the LLM analyzer
+ROUTER_FAST_PATH = os.getenv("ROUTER_FAST_PATH", "true").lower() == "true"
+# The local classifier's route is used only when it is this similar to its centroid ...
+ROUTER_CLASSIFIER_THRESHOLD = float(os.getenv("ROUTER_CLASSIFIER_THRESHOLD", "0.45"))
+# ... and this much closer to it than to the runner-up
+ROUTER_CLASSIFIER_MARGIN = float(os.getenv("ROUTER_CLASSIFIER_MARGIN", "0.15"))
+
+_TOKEN_RE = re.compile(r"[a-z0-9']+")
+
+_SMALL_TALK_RE = re.compile(
+    r"^\s*(hi|hii+|hello|hey|hey there|yo|good (morning|afternoon|evening|night)|"
+    r"thanks?|thank you( so much| very much)?|thx|ty|ok(ay)?|cool|great|nice|awesome|got it|"
+    r"bye|goodbye|see you|see ya|how are you( doing)?|what'?s up|sup|who are you|what can you do)"
+    r"( there)?[\s!.?,:)]*$",
+    re.IGNORECASE,
+)
+_IMAGE_RE = re.compile(
+    r"\b(generate|create|draw|make|design|paint|render|sketch)\b.{0,40}\b(image|picture|photo|illustration|drawing|logo|poster|icon|art(work)?)\b",
+    re.IGNORECASE,
+)
+# Whole-message continuations of the previous answer; only these reuse the last route
+_CONTINUATION_RE = re.compile(
+    r"^\s*(and |so |ok(ay)?,? )?(tell me more|more( details| info(rmation)?)?|what else|anything else|go on|continue|elaborate|"
+    r"explain (it|that|this|them)( further| more| in more detail)?|(what|how) about (it|that|this|them)|"
+    r"(why|how)( is| was| does| did)? (it|that|this)|how so|(any |more |an |some )?examples?|give me (an |some |more )?examples?)"
+    r"( please)?[\s!.?,]*$",
+    re.IGNORECASE,
+)
+# Messages that may lean on earlier turns; the classifier cannot see those, so they go to the analyzer
+_FOLLOW_UP_RE = re.compile(
+    r"^\s*(tell me more|more|what else|and|also|explain (it|that|this|further)|elaborate|continue|go on|why|how|examples?)\b"
+    r"|\b(it|its|him|his|her|they|them|their|that|this|those|these)\b",
+    re.IGNORECASE,
+)
+# Several intents in one message usually need a multi-step plan, which only the analyzer produces
+_MULTI_INTENT_RE = re.compile(r"\b(and then|then|after that|compare|versus|vs|as well as|both)\b|;", re.IGNORECASE)
+
+# Labeled examples per route (from the routing rules in orchestrator.md); each route's centroid is their mean
+ROUTE_EXAMPLES: Dict[str, List[str]] = {
+    "WebSearch": [
+        "what is quantum computing",
+        "who is the ceo of openai",
+        "latest ai news today",
+        "current price of bitcoin",
+        "what happened in the election",
+        "who won the match yesterday",
+        "when did the event happen",
+        "where is the company headquartered",
+        "explain how large language models work",
+        "tell me about the new iphone release",
+        "trending technology news this week",
+        "what is the weather forecast",
+        "who is the prime minister of india",
+        "recent updates on the stock market",
+    ],
+    "RAG": [
+        "summarize the document",
+        "what does the file say about pricing",
+        "analyze this pdf",
+        "extract the key points from the uploaded document",
+        "what are the key findings in the report",
+        "explain section 2 of the document",
+        "according to the document what is the policy",
+        "review the attached file",
+        "find the clause about termination in the contract",
+        "what does the knowledge base say about refunds",
+    ],
+    "SimpleLLM": [
+        "hi how are you",
+        "thanks for the help",
+        "who are you",
+        "what can you do",
+        "what do you think about that",
+        "do you like music",
+        "write a short poem about the sea",
+        "rewrite this sentence to sound formal",
+        "translate hello into french",
+        "summarize this text for me",
+        "fix the grammar in this paragraph",
+        "write a python function that reverses a string",
+    ],
+}
+
+# Route name -> plan step name, as the analyzer's execution_order spells them
+_PLAN_STEP = {"WebSearch": "web_search", "RAG": "rag", "SimpleLLM": "simple_llm", "image": "image"}
+
+
+def looks_multi_intent(query: str) -> bool:
+    """Whether the query seems to ask for several things that need separate plan steps."""
+    return bool(_MULTI_INTENT_RE.search(query or ""))
+
+
+def _tokens(text: str) -> List[str]:
+    return _TOKEN_RE.findall(text.lower())
+
+
+def _vector(tokens: List[str]) -> Dict[str, float]:
+    # Unigrams plus bigrams, so "who is" and "the document" carry more weight than their words alone
+    features = Counter(tokens)
+    features.update(f"{a} {b}" for a, b in zip(tokens, tokens[1:]))
+    norm = math.sqrt(sum(v * v for v in features.values()))
+    return {k: v / norm for k, v in features.items()} if norm else {}
+
+
+def _centroid(vectors: List[Dict[str, float]]) -> Dict[str, float]:
+    total: Counter = Counter()
+    for v in vectors:
+        total.update(v)
+    norm = math.sqrt(sum(v * v for v in total.values()))
+    return {k: v / norm for k, v in total.items()} if norm else {}
+
+
+class TieredRouter:
+    """
+    Cheap routing tiers that run before the LLM analyzer.
+
+    1. Rules over request flags and session state: the deep-search toggle,
+       a document uploaded with this turn, small talk, explicit image
+       requests and bare continuations ("tell me more") of the last route.
+    2. A local nearest-centroid classifier over bag-of-words vectors of
+       labeled example queries, trusted only when its best route is both
+       similar enough and clearly ahead of the runner-up.
+
+    `route` returns None when neither tier is confident; the orchestrator
+    then asks the analyzer and records that with `record_llm`. Hits are
+    counted per tier.
+    """
+
+    def __init__(self, examples: Dict[str, List[str]] = None, threshold: float = ROUTER_CLASSIFIER_THRESHOLD,
+                 margin: float = ROUTER_CLASSIFIER_MARGIN, enabled: bool = ROUTER_FAST_PATH):
+        self.threshold = threshold
+        self.margin = margin
+        self.enabled = enabled
+        self._centroids = {
+            route: _centroid([_vector(_tokens(text)) for text in texts])
+            for route, texts in (examples or ROUTE_EXAMPLES).items()
+        }
+        self.hits: Dict[str, int] = {"rules": 0, "classifier": 0, "llm": 0}
+        self.llm_failures = 0
+
+    def classify(self, query: str) -> Tuple[Optional[str], float, float]:
+        """Closest route, its cosine similarity, and its lead over the runner-up."""
+        v = _vector(_tokens(query))
+        scores = sorted(
+            ((sum(w * centroid.get(k, 0.0) for k, w in v.items()), route) for route, centroid in self._centroids.items()),
+            reverse=True,
+        )
+        if not scores or not v:
+            return None, 0.0, 0.0
+        best, route = scores[0]
+        runner_up = scores[1][0] if len(scores) > 1 else 0.0
+        return route, best, best - runner_up
+
+    def _rules(self, state: Dict[str, Any], last_route: Optional[str]) -> Optional[Tuple[List[str], str]]:
+        query = state.get("user_query", "") or ""
+        has_docs = bool(state.get("doc") or state.get("active_docs") or state.get("new_uploaded_docs"))
+        if state.get("deep_search"):
+            return ["deepResearch"], "deep search toggle"
+        if _IMAGE_RE.search(query):
+            return ["image"], "explicit image request"
+        if state.get("uploaded_doc") and not _MULTI_INTENT_RE.search(query):
+            return ["rag"], "document uploaded with this turn"
+        if _SMALL_TALK_RE.match(query):
+            return ["simple_llm"], "small talk"
+        if _CONTINUATION_RE.match(query):
+            if last_route == "WebSearch":
+                return ["web_search"], "follow-up to web search"
+            if last_route == "RAG" and (has_docs or state.get("kb")):
+                return ["rag"], "follow-up to document discussion"
+        return None
+
+    def route(self, state: Dict[str, Any], last_route: Optional[str] = None) -> Optional[Dict[str, Any]]:
+        """A plan from the rule or classifier tier, or None when the LLM analyzer should decide."""
+        if not self.enabled:
+            return None
+        ruled = self._rules(state, last_route)
+        if ruled:
+            self.hits["rules"] += 1
+            plan, reason = ruled
+            return {"execution_order": plan, "tier": "rules", "reasoning": reason}
+
+        query = state.get("user_query", "") or ""
+        # Follow-ups and multi-intent messages depend on context the classifier cannot see
+        if _MULTI_INTENT_RE.search(query) or (last_route and _FOLLOW_UP_RE.search(query)):
+            return None
+        route, score, lead = self.classify(query)
+        if route is None or score < self.threshold or lead < self.margin:
+            return None
+        # Document questions only go to RAG when the session has something to retrieve from
+        if route == "RAG" and not (state.get("doc") or state.get("active_docs") or state.get("kb")):
+            return None
+        self.hits["classifier"] += 1
+        return {
+            "execution_order": [_PLAN_STEP[route]],
+            "tier": "classifier",
+            "reasoning": f"nearest centroid {route} (similarity {score:.2f}, lead {lead:.2f})",
+        }
+
+    def record_llm(self, ok: bool = True):
+        self.hits["llm"] += 1
+        if not ok:
+            self.llm_failures += 1
+
+    def stats(self) -> Dict[str, Any]:
+        total = sum(self.hits.values())
+        return {
+            "enabled": self.enabled,
+            "hits": dict(self.hits),
+            "fast_path_rate": round((total - self.hits["llm"]) / total, 4) if total else 0.0,
+            "llm_failures": self.llm_failures,
+            "threshold": self.threshold,
+            "margin": self.margin,
+        }
+
+
+# Global tiered router instance
+tiered_router = TieredRouter()
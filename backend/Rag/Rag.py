@@ -4,34 +4,68 @@ from typing import Optional, Dict, Any
 from langchain_core.messages import SystemMessage, HumanMessage
 from langchain_openai import ChatOpenAI, OpenAIEmbeddings
 from langchain_text_splitters import RecursiveCharacterTextSplitter
-from langchain_groq import ChatGroq
 import uuid  
-from typing import List, Optional, Dict, Any
+import asyncio
+import contextlib
+from typing import List, Optional, Dict, Any, AsyncIterable, Tuple
 import os
-from qdrant_client import QdrantClient, models
+from qdrant_client import AsyncQdrantClient, models
+import httpx
 from WebSearch.websearch import web_search
-from rank_bm25 import BM25Okapi
+from Rag.bm25_index import BM25Index
+from Rag.embedding_pipeline import run_embedding_pipeline
 import re
 from sklearn.feature_extraction.text import ENGLISH_STOP_WORDS
-from prompt_cache import normalize_prefix
+from prompt_cache import normalize_prefix, response_cache
+from embedding_store import embedding_store
+from query_embedding_cache import query_embedding_cache
+from answer_cache import answer_cache, answer_scope, is_self_contained
 
 QDRANT_URL = os.getenv("QDRANT_URL", ":memory:")
 QDRANT_API_KEY = os.getenv("QDRANT_API_KEY")
-from llm import get_llm
+QDRANT_PREFER_GRPC = os.getenv("QDRANT_PREFER_GRPC", "false").lower() == "true"
+QDRANT_GRPC_PORT = int(os.getenv("QDRANT_GRPC_PORT", "6334"))
+QDRANT_POOL_SIZE = int(os.getenv("QDRANT_POOL_SIZE", "100"))
+QDRANT_TIMEOUT = int(os.getenv("QDRANT_TIMEOUT", "30"))
+from llm import get_llm, get_chat_model
 
-try:
+def _create_qdrant_client() -> AsyncQdrantClient:
     if QDRANT_URL == ":memory:":
-        QDRANT_CLIENT = QdrantClient(":memory:")
-    else:
-        QDRANT_CLIENT = QdrantClient(url=QDRANT_URL, api_key=QDRANT_API_KEY)
-        # Test the connection
-        QDRANT_CLIENT.get_collections()
-        print(f"[RAG] Connected to remote Qdrant at {QDRANT_URL}")
-except Exception as e:
-    print(f"[RAG] Remote Qdrant failed, falling back to in-memory: {e}")
-    QDRANT_CLIENT = QdrantClient(":memory:")
+        return AsyncQdrantClient(":memory:")
+    return AsyncQdrantClient(
+        url=QDRANT_URL,
+        api_key=QDRANT_API_KEY,
+        prefer_grpc=QDRANT_PREFER_GRPC,
+        grpc_port=QDRANT_GRPC_PORT,
+        timeout=QDRANT_TIMEOUT,
+        # Keep-alive pool for REST; gRPC multiplexes over one channel
+        limits=httpx.Limits(max_connections=QDRANT_POOL_SIZE, max_keepalive_connections=QDRANT_POOL_SIZE),
+        grpc_options={"grpc.keepalive_time_ms": 30000},
+    )
+
+# Native async client: searches and upserts no longer occupy default executor threads
+QDRANT_CLIENT = _create_qdrant_client()
+# In-memory collections count against this process's memory budget
+QDRANT_IN_MEMORY = QDRANT_URL == ":memory:"
+
+async def init_qdrant():
+    """Check the remote Qdrant connection at startup, falling back to in-memory."""
+    global QDRANT_CLIENT, QDRANT_IN_MEMORY
+    if QDRANT_URL == ":memory:":
+        return
+    try:
+        await QDRANT_CLIENT.get_collections()
+        print(f"[RAG] Connected to remote Qdrant at {QDRANT_URL} (grpc={QDRANT_PREFER_GRPC}, pool={QDRANT_POOL_SIZE})")
+    except Exception as e:
+        print(f"[RAG] Remote Qdrant failed, falling back to in-memory: {e}")
+        QDRANT_CLIENT = AsyncQdrantClient(":memory:")
+        QDRANT_IN_MEMORY = True
+
+async def close_qdrant():
+    await QDRANT_CLIENT.close()
 
 VECTOR_SIZE = 1536
+EMBEDDING_MODEL_NAME = "text-embedding-3-small"
 import aiofiles
 prompt_path = os.path.join(os.path.dirname(__file__), "Rag.md")
 def load_base_prompt() -> str:
@@ -67,11 +101,15 @@ STATIC_SYS_RAG = normalize_prefix([CORE_PREFIX, RAG_RULES])
 BM25_INDICES = {}
 KB_EMBEDDING_CACHE = {}
 USER_DOC_EMBEDDING_CACHE = {}
+# Shared KB collections keyed by KB fingerprint; "sessions" is the reference set
+KB_COLLECTIONS = {}
+_KB_LOCKS = {}
 
 
 
 import hashlib
 import time
+from embedding_store import text_hash
 
 
 
@@ -79,9 +117,10 @@ def clear_kb_cache(collection_name: str = None):
     """Clear KB embedding cache for a specific collection or all collections"""
     global KB_EMBEDDING_CACHE
     if collection_name:
-        if collection_name in KB_EMBEDDING_CACHE:
-            del KB_EMBEDDING_CACHE[collection_name]
-            print(f"[RAG] Cleared KB cache for {collection_name}")
+        for session_id, cache_data in list(KB_EMBEDDING_CACHE.items()):
+            if cache_data.get("collection_name") == collection_name:
+                del KB_EMBEDDING_CACHE[session_id]
+        print(f"[RAG] Cleared KB cache for {collection_name}")
     else:
         KB_EMBEDDING_CACHE.clear()
         print("[RAG] Cleared all KB embedding cache")
@@ -102,39 +141,199 @@ def clear_user_doc_cache(session_id: str = None):
         BM25_INDICES.clear()
         print("[RAG] Cleared all user document caches (embeddings, BM25)")
 
-async def preprocess_kb_documents(kb_docs: List[dict], session_id: str, is_hybrid: bool = False):
+def _doc_text(doc) -> str:
+    if isinstance(doc, dict) and "content" in doc:
+        return doc["content"]
+    return str(doc)
+
+def _doc_hash(doc) -> str:
+    # Session-store documents carry their content hash, so their content need not be loaded
+    return getattr(doc, "content_hash", None) or text_hash(_doc_text(doc))
+
+def kb_fingerprint(kb_docs: List[dict], gpt_id: Optional[str] = None, is_hybrid: bool = False) -> str:
+    """
+    Identify a KB by its owning GPT and the content of its documents.
+    Document order and duplicates do not matter; identical content always maps to the same fingerprint.
+    """
+    digest = hashlib.sha256()
+    digest.update(f"{gpt_id or ''}|{'hybrid' if is_hybrid else 'vector'}".encode("utf-8"))
+    for doc_hash in sorted({_doc_hash(doc) for doc in kb_docs}):
+        digest.update(doc_hash.encode("utf-8"))
+    return digest.hexdigest()
+
+def _kb_lock(fingerprint: str) -> asyncio.Lock:
+    lock = _KB_LOCKS.get(fingerprint)
+    if lock is None:
+        lock = _KB_LOCKS[fingerprint] = asyncio.Lock()
+    return lock
+
+def _new_kb_collection_name() -> str:
+    # Unique per build: a collection updated in place keeps its name while its fingerprint changes
+    return f"kb_{uuid.uuid4().hex}"
+
+@contextlib.asynccontextmanager
+async def _kb_locks(*fingerprints: str):
+    """Hold the locks of several KB fingerprints, taken in sorted order so concurrent callers cannot deadlock"""
+    held = []
+    try:
+        for fingerprint in sorted(set(fingerprints)):
+            while True:
+                lock = _kb_lock(fingerprint)
+                await lock.acquire()
+                # The holder may have dropped the KB and its lock entry while we waited
+                if _KB_LOCKS.get(fingerprint) is lock:
+                    break
+                lock.release()
+            held.append(lock)
+        yield
+    finally:
+        for lock in reversed(held):
+            lock.release()
+
+async def release_kb_collection(session_id: str):
+    """
+    Detach a session from its shared KB collection.
+    The collection and its BM25 index are dropped once no session references it.
+    """
+    cache_data = KB_EMBEDDING_CACHE.pop(session_id, None)
+    if not cache_data:
+        return
+    fingerprint = cache_data["fingerprint"]
+    async with _kb_locks(fingerprint):
+        entry = KB_COLLECTIONS.get(fingerprint)
+        if not entry:
+            return
+        entry["sessions"].discard(session_id)
+        if entry["sessions"]:
+            print(f"[RAG] Session {session_id} released KB {entry['collection_name']} ({len(entry['sessions'])} sessions remain)")
+            return
+        del KB_COLLECTIONS[fingerprint]
+        answer_cache.invalidate(fingerprint)
+        collection_name = entry["collection_name"]
+        BM25_INDICES.pop(collection_name, None)
+        try:
+            await QDRANT_CLIENT.delete_collection(collection_name=collection_name)
+        except Exception as e:
+            print(f"[RAG] Warning: Failed to delete KB collection {collection_name}: {e}")
+        print(f"[RAG] Garbage-collected unused KB collection {collection_name}")
+        _KB_LOCKS.pop(fingerprint, None)
+
+async def preprocess_kb_documents(kb_docs: List[dict], session_id: str, is_hybrid: bool = False, gpt_id: Optional[str] = None):
     """
     Pre-process KB documents when custom GPT is loaded.
-    Generate embeddings once and cache for the session.
+    The KB is embedded once per fingerprint and its collection is shared
+    read-only by every session that loads the same GPT with the same documents.
+    If the session already has a KB for the same GPT, only the documents that
+    were added or removed are processed.
     """
     if not kb_docs:
         return
-    
-    collection_name = f"kb_{session_id}"
 
-    if session_id in KB_EMBEDDING_CACHE:
+    fingerprint = kb_fingerprint(kb_docs, gpt_id, is_hybrid)
+    current = KB_EMBEDDING_CACHE.get(session_id)
+    if current and current["fingerprint"] == fingerprint:
         print(f"[RAG] KB already processed for session {session_id}")
         return
-    
-    # print(f"[RAG] Pre-processing {len(kb_docs)} KB documents for session {session_id}")
 
-    kb_texts = []
-    for doc in kb_docs:
-        if isinstance(doc, dict) and "content" in doc:
-            kb_texts.append(doc["content"])
+    docs_by_hash = {_doc_hash(doc): doc for doc in kb_docs}
+    released = False
+
+    # The previous fingerprint is locked too: a sole owner re-keys its entry to the new one
+    locked_previous = current["fingerprint"] if current else None
+    async with _kb_locks(fingerprint, *([locked_previous] if locked_previous else [])):
+        current = KB_EMBEDDING_CACHE.get(session_id)
+        # Only a fingerprint held above may be moved; one attached meanwhile is released normally
+        previous = KB_COLLECTIONS.get(current["fingerprint"]) if current and current["fingerprint"] == locked_previous else None
+        can_delta = (
+            previous is not None
+            and previous["gpt_id"] == gpt_id
+            and previous["is_hybrid"] == is_hybrid
+        )
+        entry = KB_COLLECTIONS.get(fingerprint)
+        if entry is None and can_delta:
+            added = [_doc_text(docs_by_hash[h]) for h in docs_by_hash if h not in previous["doc_hashes"]]
+            removed = previous["doc_hashes"] - docs_by_hash.keys()
+            if previous["sessions"] == {session_id}:
+                # Sole owner: update the collection in place and re-key it; its name is not tied to a fingerprint
+                KB_COLLECTIONS.pop(current["fingerprint"], None)
+                answer_cache.invalidate(current["fingerprint"])
+                _KB_LOCKS.pop(current["fingerprint"], None)
+                collection_name = previous["collection_name"]
+                released = True
+                print(f"[RAG] Updating KB collection {collection_name} in place")
+            else:
+                # Shared with other sessions: copy vectors, never re-embed
+                collection_name = _new_kb_collection_name()
+                print(f"[RAG] Forking shared KB {previous['collection_name']} into {collection_name}")
+                await _copy_collection(previous["collection_name"], collection_name, removed)
+            await apply_document_delta(collection_name, added, removed, is_hybrid=is_hybrid)
+            entry = KB_COLLECTIONS[fingerprint] = {
+                "collection_name": collection_name,
+                "gpt_id": gpt_id,
+                "is_hybrid": is_hybrid,
+                "processed_at": asyncio.get_event_loop().time(),
+                "document_count": len(docs_by_hash),
+                "doc_hashes": set(docs_by_hash),
+                "sessions": set()
+            }
+        elif entry is None:
+            collection_name = _new_kb_collection_name()
+            await retreive_docs([_doc_text(doc) for doc in docs_by_hash.values()], collection_name, is_hybrid=is_hybrid, clear_existing=True, is_kb=True)
+            entry = KB_COLLECTIONS[fingerprint] = {
+                "collection_name": collection_name,
+                "gpt_id": gpt_id,
+                "is_hybrid": is_hybrid,
+                "processed_at": asyncio.get_event_loop().time(),
+                "document_count": len(docs_by_hash),
+                "doc_hashes": set(docs_by_hash),
+                "sessions": set()
+            }
+            print(f"[RAG] Built shared KB collection {collection_name} ({len(docs_by_hash)} documents)")
         else:
-            kb_texts.append(str(doc))
+            print(f"[RAG] Reusing shared KB collection {entry['collection_name']} ({len(entry['sessions'])} sessions)")
+        entry["sessions"].add(session_id)
+
+    if current and not released:
+        await release_kb_collection(session_id)
 
-    await retreive_docs(kb_texts, collection_name, is_hybrid=is_hybrid, clear_existing=False, is_kb=True)
-    
     KB_EMBEDDING_CACHE[session_id] = {
-        "collection_name": collection_name,
+        "collection_name": entry["collection_name"],
+        "fingerprint": fingerprint,
         "is_hybrid": is_hybrid,
-        "processed_at": asyncio.get_event_loop().time(),
-        "document_count": len(kb_texts)
+        "processed_at": entry["processed_at"],
+        "document_count": entry["document_count"]
     }
     
-    print(f"[RAG] Pre-processed and cached {len(kb_texts)} KB documents for session {session_id}")
+    print(f"[RAG] Attached session {session_id} to KB {entry['collection_name']}")
+
+async def _reset_user_doc_collection(session_id: str, collection_name: str):
+    """Drop a session's cached user-document index and its Qdrant collection"""
+    if session_id in USER_DOC_EMBEDDING_CACHE:
+        old_collection_name = USER_DOC_EMBEDDING_CACHE[session_id].get("collection_name")
+        print(f"🔥 [CACHE-DEBUG] Found old collection: {old_collection_name}")
+        
+        del USER_DOC_EMBEDDING_CACHE[session_id]
+        print(f"🔥 [CACHE-DEBUG] Cleared existing user doc cache for session {session_id}")
+        
+        if old_collection_name and old_collection_name in BM25_INDICES:
+            del BM25_INDICES[old_collection_name]
+            print(f"🔥 [CACHE-DEBUG] Cleared old BM25 index for {old_collection_name}")
+        else:
+            print(f"🔥 [CACHE-DEBUG] No old BM25 index found for {old_collection_name}")
+    else:
+        print(f"🔥 [CACHE-DEBUG] No existing cache found for session {session_id}")
+    
+    try:
+        collections_response = await QDRANT_CLIENT.get_collections()
+        collections = [c.name for c in collections_response.collections]
+        print(f"🔥 [CACHE-DEBUG] Current Qdrant collections: {collections}")
+        if collection_name in collections:
+            await QDRANT_CLIENT.delete_collection(collection_name=collection_name)
+            print(f"🔥 [CACHE-DEBUG] Deleted existing collection: {collection_name}")
+        else:
+            print(f"🔥 [CACHE-DEBUG] Collection {collection_name} not found in Qdrant")
+    except Exception as e:
+        print(f"🔥 [CACHE-DEBUG] Warning: Failed to clear existing collection {collection_name}: {e}")
 
 async def preprocess_user_documents(docs: List[dict], session_id: str, is_hybrid: bool = False, is_new_upload: bool = False):
     """
@@ -153,32 +352,7 @@ async def preprocess_user_documents(docs: List[dict], session_id: str, is_hybrid
     collection_name = f"user_docs_{session_id}"
 
     if is_new_upload:
-        if session_id in USER_DOC_EMBEDDING_CACHE:
-            old_collection_name = USER_DOC_EMBEDDING_CACHE[session_id].get("collection_name")
-            print(f"🔥 [CACHE-DEBUG] Found old collection: {old_collection_name}")
-            
-            del USER_DOC_EMBEDDING_CACHE[session_id]
-            print(f"🔥 [CACHE-DEBUG] Cleared existing user doc cache for session {session_id}")
-            
-            if old_collection_name and old_collection_name in BM25_INDICES:
-                del BM25_INDICES[old_collection_name]
-                print(f"🔥 [CACHE-DEBUG] Cleared old BM25 index for {old_collection_name}")
-            else:
-                print(f"🔥 [CACHE-DEBUG] No old BM25 index found for {old_collection_name}")
-        else:
-            print(f"🔥 [CACHE-DEBUG] No existing cache found for session {session_id}")
-    
-        try:
-            collections_response = await asyncio.to_thread(QDRANT_CLIENT.get_collections)
-            collections = [c.name for c in collections_response.collections]
-            print(f"🔥 [CACHE-DEBUG] Current Qdrant collections: {collections}")
-            if collection_name in collections:
-                await asyncio.to_thread(QDRANT_CLIENT.delete_collection, collection_name=collection_name)
-                print(f"🔥 [CACHE-DEBUG] Deleted existing collection: {collection_name}")
-            else:
-                print(f"🔥 [CACHE-DEBUG] Collection {collection_name} not found in Qdrant")
-        except Exception as e:
-            print(f"🔥 [CACHE-DEBUG] Warning: Failed to clear existing collection {collection_name}: {e}")
+        await _reset_user_doc_collection(session_id, collection_name)
     
     print(f"[RAG] Pre-processing {len(docs)} NEW user documents for session {session_id}")
 
@@ -200,6 +374,169 @@ async def preprocess_user_documents(docs: List[dict], session_id: str, is_hybrid
     
     print(f"[RAG] Pre-processed and cached {len(doc_texts)} NEW user documents for session {session_id}")
 
+async def begin_user_document_stream(session_id: str, is_hybrid: bool = False) -> Dict[str, Any]:
+    """
+    Start a streamed user-document upload. Documents are indexed into a fresh
+    collection that replaces the session's previous user documents only when
+    the upload is finished, so searches never see a half-built index.
+    Returns the upload handle for index_document_pages.
+    """
+    collection_name = f"user_docs_{session_id}_{uuid.uuid4().hex[:8]}"
+    await _ensure_collection(collection_name, clear_existing=True)
+    return {
+        "session_id": session_id,
+        "collection_name": collection_name,
+        "is_hybrid": is_hybrid,
+        "bm25": BM25Index() if is_hybrid else None,
+    }
+
+async def index_document_pages(upload: Dict[str, Any], pages: AsyncIterable[Tuple[int, str]]) -> str:
+    """
+    Chunk pages as they are parsed and feed them straight into the embedding
+    pipeline, so only a few pages' worth of chunks and vectors are in flight.
+    Chunks carry their page number. Returns the document's full text.
+    """
+    # The document hash is only known once every page is in, so index under a placeholder first
+    pending_key = f"pending-{uuid.uuid4()}"
+    page_texts = []
+
+    async def page_chunks():
+        async for page_number, text in pages:
+            page_texts.append(text)
+            for chunk in _TEXT_SPLITTER.create_documents([text], metadatas=[{"doc_hash": pending_key, "page": page_number}]):
+                yield chunk
+
+    name = upload["collection_name"]
+    pending_filter = models.Filter(must=[models.FieldCondition(key="doc_hash", match=models.MatchValue(value=pending_key))])
+    try:
+        chunk_count = await _embed_and_upsert(name, page_chunks(), upload["bm25"])
+    except BaseException:
+        # Don't leave a partially indexed document behind
+        await QDRANT_CLIENT.delete(collection_name=name, points_selector=models.FilterSelector(filter=pending_filter))
+        if upload["bm25"] is not None:
+            upload["bm25"].remove_keys([pending_key])
+        raise
+    content = "".join(page_texts)
+    if chunk_count:
+        doc_hash = text_hash(content)
+        await QDRANT_CLIENT.set_payload(
+            collection_name=name,
+            payload={"doc_hash": doc_hash},
+            points=pending_filter
+        )
+        if upload["bm25"] is not None:
+            upload["bm25"].rekey(pending_key, doc_hash)
+    print(f"[RAG] Streamed {len(page_texts)} pages ({chunk_count} chunks) into {name}")
+    return content
+
+async def finish_user_document_stream(upload: Dict[str, Any], document_count: int):
+    """Publish a streamed upload's index so RAG searches use it, and drop the one it replaces"""
+    previous = USER_DOC_EMBEDDING_CACHE.get(upload["session_id"], {}).get("collection_name")
+    if upload["bm25"] is not None:
+        BM25_INDICES[upload["collection_name"]] = upload["bm25"]
+    USER_DOC_EMBEDDING_CACHE[upload["session_id"]] = {
+        "collection_name": upload["collection_name"],
+        "is_hybrid": upload["is_hybrid"],
+        "processed_at": asyncio.get_event_loop().time(),
+        "document_count": document_count
+    }
+    print(f"[RAG] Pre-processed and cached {document_count} streamed user documents for session {upload['session_id']}")
+    if previous and previous != upload["collection_name"]:
+        await _drop_collection(previous)
+
+async def abort_user_document_stream(upload: Dict[str, Any]):
+    """Discard a streamed upload that could not be finished"""
+    await _drop_collection(upload["collection_name"])
+
+async def _drop_collection(name: str):
+    BM25_INDICES.pop(name, None)
+    try:
+        await QDRANT_CLIENT.delete_collection(collection_name=name)
+    except Exception as e:
+        print(f"[RAG] Warning: Failed to delete collection {name}: {e}")
+
+async def release_session_indexes(session_id: str):
+    """Drop everything RAG holds for a session: its user-document collection and its KB attachment"""
+    cache_data = USER_DOC_EMBEDDING_CACHE.pop(session_id, None)
+    if cache_data:
+        await _drop_collection(cache_data["collection_name"])
+    await release_kb_collection(session_id)
+
+async def restore_session_indexes(session: Dict[str, Any], doc_types: List[str]):
+    """
+    Rebuild a session's indexes that are missing in this process (evicted while
+    idle, or built by another worker). Embeddings come from the embedding
+    store, so only the Qdrant/BM25 indexes are rebuilt.
+    """
+    session_id = session["session_id"]
+    gpt_config = session.get("gpt_config") or {}
+    is_hybrid = gpt_config.get("hybridRag", False)
+    if "user" in doc_types and session.get("uploaded_docs") and session_id not in USER_DOC_EMBEDDING_CACHE:
+        print(f"[RAG] Restoring user document index for session {session_id}")
+        await preprocess_user_documents(session["uploaded_docs"], session_id, is_hybrid=is_hybrid, is_new_upload=True)
+    if "kb" in doc_types and session.get("kb") and session_id not in KB_EMBEDDING_CACHE:
+        print(f"[RAG] Restoring KB index for session {session_id}")
+        await preprocess_kb_documents(session["kb"], session_id, is_hybrid=is_hybrid, gpt_id=gpt_config.get("gpt_id"))
+
+# Rough cost of one point in an in-memory collection: float32 vector plus chunk payload
+_POINT_BYTES = VECTOR_SIZE * 4 + 1024
+
+async def rag_memory_usage() -> Dict[str, Any]:
+    """
+    Counts and approximate bytes of the RAG caches held in this process, and
+    each session's share of them. A shared KB collection is split evenly
+    between the sessions attached to it. Qdrant points only count when the
+    collections live in this process (in-memory mode).
+    """
+    names = set(BM25_INDICES)
+    names.update(c["collection_name"] for c in USER_DOC_EMBEDDING_CACHE.values())
+    names.update(e["collection_name"] for e in KB_COLLECTIONS.values())
+    points = {}
+    if QDRANT_IN_MEMORY:
+        collections_response = await QDRANT_CLIENT.get_collections()
+        names.update(c.name for c in collections_response.collections)
+        for name in names:
+            try:
+                points[name] = (await QDRANT_CLIENT.count(collection_name=name, exact=True)).count
+            except Exception:
+                points[name] = 0
+    bm25_bytes = {name: index.nbytes() for name, index in list(BM25_INDICES.items())}
+    collection_bytes = {name: bm25_bytes.get(name, 0) + points.get(name, 0) * _POINT_BYTES for name in names}
+
+    sessions = {}
+    for session_id, cache_data in USER_DOC_EMBEDDING_CACHE.items():
+        sessions[session_id] = collection_bytes.get(cache_data["collection_name"], 0)
+    for session_id, cache_data in KB_EMBEDDING_CACHE.items():
+        entry = KB_COLLECTIONS.get(cache_data["fingerprint"])
+        sharers = max(1, len(entry["sessions"])) if entry else 1
+        sessions[session_id] = sessions.get(session_id, 0) + collection_bytes.get(cache_data["collection_name"], 0) // sharers
+
+    user_collections = {c["collection_name"] for c in USER_DOC_EMBEDDING_CACHE.values()}
+    kb_collections = {e["collection_name"] for e in KB_COLLECTIONS.values()}
+    caches = {
+        "user_doc_indexes": {
+            "count": len(USER_DOC_EMBEDDING_CACHE),
+            "bytes": sum(collection_bytes.get(n, 0) for n in user_collections),
+        },
+        "kb_indexes": {
+            "count": len(KB_COLLECTIONS),
+            "sessions": len(KB_EMBEDDING_CACHE),
+            "bytes": sum(collection_bytes.get(n, 0) for n in kb_collections),
+        },
+        "bm25_indices": {"count": len(bm25_bytes), "bytes": sum(bm25_bytes.values())},
+        "qdrant_collections": {
+            "in_memory": QDRANT_IN_MEMORY,
+            "count": len(points) if QDRANT_IN_MEMORY else None,
+            "points": sum(points.values()) if QDRANT_IN_MEMORY else None,
+            "bytes": sum(points.values()) * _POINT_BYTES,
+        },
+    }
+    return {
+        "caches": caches,
+        "sessions": sessions,
+        "total_bytes": caches["bm25_indices"]["bytes"] + caches["qdrant_collections"]["bytes"],
+    }
+
 async def send_status_update(state: GraphState, message: str, progress: int = None):
     """Send status update if callback is available"""
     if hasattr(state, '_status_callback') and state._status_callback:
@@ -212,63 +549,143 @@ async def send_status_update(state: GraphState, message: str, progress: int = No
                 "progress": progress
             }
         })
-async def retreive_docs(doc: List[str], name: str, is_hybrid: bool = False, clear_existing: bool = False, is_kb: bool = False, is_user_doc: bool = False):
-    EMBEDDING_MODEL = OpenAIEmbeddings(model="text-embedding-3-small")
-    text_splitter = RecursiveCharacterTextSplitter(chunk_size=800, chunk_overlap=100)
-    chunked_docs = text_splitter.create_documents(doc)
-
-    if is_kb and name in KB_EMBEDDING_CACHE:
-        print(f"[RAG] Using cached KB embeddings for {name}")
-        embeddings = KB_EMBEDDING_CACHE[name]["embeddings"]
-        chunked_docs = KB_EMBEDDING_CACHE[name]["chunked_docs"]
-    else:
-        embeddings = await EMBEDDING_MODEL.aembed_documents([doc.page_content for doc in chunked_docs])
-        
-        if is_kb:
-            KB_EMBEDDING_CACHE[name] = {
-                "embeddings": embeddings,
-                "chunked_docs": chunked_docs
-            }
-            print(f"[RAG] Cached KB embeddings for {name} ({len(embeddings)} chunks)")
-    
-    collections_response = await asyncio.to_thread(QDRANT_CLIENT.get_collections)
+_EMBEDDING_MODEL = None
+
+def get_embedding_model() -> OpenAIEmbeddings:
+    """Shared embeddings client, created on first use."""
+    global _EMBEDDING_MODEL
+    if _EMBEDDING_MODEL is None:
+        _EMBEDDING_MODEL = OpenAIEmbeddings(model=EMBEDDING_MODEL_NAME)
+    return _EMBEDDING_MODEL
+
+async def embed_query(query: str) -> List[float]:
+    """Query embedding shared by every retrieval path (cached and coalesced)."""
+    return await query_embedding_cache.aembed_query(get_embedding_model(), EMBEDDING_MODEL_NAME, query)
+
+_TEXT_SPLITTER = RecursiveCharacterTextSplitter(chunk_size=800, chunk_overlap=100)
+
+def _iter_chunks(doc: List[str]):
+    """Lazily split documents into chunks tagged with the content hash of their source document."""
+    for text in doc:
+        yield from _TEXT_SPLITTER.create_documents([text], metadatas=[{"doc_hash": text_hash(text)}])
+
+async def _embed_and_upsert(name: str, chunks, bm25_index: Optional[BM25Index] = None) -> int:
+    """
+    Run chunks through the batched embedding pipeline, upserting each batch to
+    Qdrant (and the BM25 index, if given) as soon as it is embedded.
+    Returns the number of chunks stored.
+    """
+    async def embed_batch(texts: List[str]) -> List[List[float]]:
+        # Persistent store keyed by (model, chunk hash): unchanged chunks are never re-embedded
+        return await embedding_store.aembed_documents(get_embedding_model(), EMBEDDING_MODEL_NAME, texts)
+
+    async def upsert_batch(batch, embeddings):
+        await QDRANT_CLIENT.upsert(
+            collection_name=name,
+            points=[
+                models.PointStruct(
+                    id=str(uuid.uuid4()),
+                    vector=embedding,
+                    payload={"text": doc.page_content, **doc.metadata}
+                )
+                for doc, embedding in zip(batch, embeddings)
+            ]
+        )
+        if bm25_index is not None:
+            await asyncio.to_thread(
+                bm25_index.add,
+                [doc.page_content for doc in batch],
+                [tokenize(doc.page_content) for doc in batch],
+                [doc.metadata.get("doc_hash") for doc in batch]
+            )
+
+    return await run_embedding_pipeline(chunks, lambda doc: doc.page_content, embed_batch, upsert_batch)
+
+async def _ensure_collection(name: str, clear_existing: bool = False):
+    collections_response = await QDRANT_CLIENT.get_collections()
     collections = [c.name for c in collections_response.collections]
     
     if clear_existing and name in collections:
         print(f"[RAG] Clearing existing collection: {name}")
-        await asyncio.to_thread(QDRANT_CLIENT.delete_collection, collection_name=name)
+        await QDRANT_CLIENT.delete_collection(collection_name=name)
         collections.remove(name)  # Remove from local list
     
     if name not in collections:
-        await asyncio.to_thread(
-            QDRANT_CLIENT.recreate_collection,
+        await QDRANT_CLIENT.create_collection(
             collection_name=name,
             vectors_config=models.VectorParams(size=VECTOR_SIZE, distance=models.Distance.COSINE),
         )
+        # Deltas delete points by source document
+        await QDRANT_CLIENT.create_payload_index(
+            collection_name=name,
+            field_name="doc_hash",
+            field_schema=models.PayloadSchemaType.KEYWORD,
+        )
 
-    await asyncio.to_thread(
-        QDRANT_CLIENT.upsert,
-        collection_name=name,
-        points=[
-            models.PointStruct(
-                id=str(uuid.uuid4()),
-                vector=embedding,
-                payload={"text": doc.page_content}
-            )
-            for doc, embedding in zip(chunked_docs, embeddings)
-        ]
-    )
+async def retreive_docs(doc: List[str], name: str, is_hybrid: bool = False, clear_existing: bool = False, is_kb: bool = False, is_user_doc: bool = False):
+    await _ensure_collection(name, clear_existing=clear_existing)
+
+    bm25_index = None
     if is_hybrid:
-        tokenized_docs = [tokenize(doc.page_content) for doc in chunked_docs]
-        bm25 = await asyncio.to_thread(BM25Okapi, tokenized_docs)
-        BM25_INDICES[name] = {
-            "bm25": bm25,
-            "docs": {str(i): doc.page_content for i, doc in enumerate(chunked_docs)},
-            "tokens": tokenized_docs
-        }
-        print(f"[RAG] Stored {len(chunked_docs)} chunks in {name} (Vector + BM25)")
+        # A replaced index is swapped in once ingestion finishes so searches keep using the old one meanwhile
+        bm25_index = BM25Index() if clear_existing else BM25_INDICES.get(name) or BM25Index()
+    chunk_count = await _embed_and_upsert(name, _iter_chunks(doc), bm25_index)
+
+    if is_hybrid:
+        BM25_INDICES[name] = bm25_index
+        print(f"[RAG] Stored {chunk_count} chunks in {name} (Vector + BM25)")
     else:
-        print(f"[RAG] Stored {len(chunked_docs)} chunks in {name} (Vector only)")
+        print(f"[RAG] Stored {chunk_count} chunks in {name} (Vector only)")
+
+async def apply_document_delta(name: str, added_docs: List[str], removed_hashes: set, is_hybrid: bool = False):
+    """
+    Bring an existing collection up to date by embedding and upserting only the
+    added documents and deleting the points of removed ones. The BM25 index is
+    updated in place, so unchanged chunks are never re-tokenized.
+    """
+    if removed_hashes:
+        await QDRANT_CLIENT.delete(
+            collection_name=name,
+            points_selector=models.FilterSelector(
+                filter=models.Filter(must=[
+                    models.FieldCondition(key="doc_hash", match=models.MatchAny(any=list(removed_hashes)))
+                ])
+            )
+        )
+
+    bm25_index = None
+    if is_hybrid:
+        bm25_index = BM25_INDICES.setdefault(name, BM25Index())
+        if removed_hashes:
+            await asyncio.to_thread(bm25_index.remove_keys, removed_hashes)
+    chunk_count = await _embed_and_upsert(name, _iter_chunks(added_docs), bm25_index)
+
+    print(f"[RAG] Delta applied to {name}: +{len(added_docs)} docs ({chunk_count} chunks), -{len(removed_hashes)} docs")
+
+async def _copy_collection(source: str, target: str, exclude_hashes: set):
+    """Clone a collection's points (vectors included) without calling the embedding API."""
+    await _ensure_collection(target, clear_existing=True)
+    offset = None
+    while True:
+        points, offset = await QDRANT_CLIENT.scroll(
+            collection_name=source,
+            limit=256,
+            offset=offset,
+            with_payload=True,
+            with_vectors=True
+        )
+        keep = [
+            models.PointStruct(id=p.id, vector=p.vector, payload=p.payload)
+            for p in points
+            if (p.payload or {}).get("doc_hash") not in exclude_hashes
+        ]
+        if keep:
+            await QDRANT_CLIENT.upsert(collection_name=target, points=keep)
+        if offset is None:
+            break
+    if source in BM25_INDICES:
+        BM25_INDICES[target] = await asyncio.to_thread(BM25_INDICES[source].clone, exclude_hashes)
+
 def tokenize(text: str):
     tokens = re.findall(r"\w+", text.lower())
     return [t for t in tokens if t not in ENGLISH_STOP_WORDS]
@@ -276,15 +693,13 @@ async def _search_collection(collection_name: str, query: str, limit: int) -> Li
     """
     Helper function to perform a semantic search on a Qdrant collection and return the text of the top results.
     """
-    EMBEDDING_MODEL = OpenAIEmbeddings(model="text-embedding-3-small")
-    query_embedding = await EMBEDDING_MODEL.aembed_query(query)
+    query_embedding = await embed_query(query)
     
-    search_results = await asyncio.to_thread(
-        QDRANT_CLIENT.search,
+    search_results = (await QDRANT_CLIENT.query_points(
         collection_name=collection_name,
-        query_vector=query_embedding,
+        query=query_embedding,
         limit=limit
-    )
+    )).points
     result = [result.payload["text"] for result in search_results]
     
     return result
@@ -317,9 +732,9 @@ async def _reciprocal_rank_fusion(rankings: List[List[str]], k: int = 60) -> Lis
     return [doc for doc, score in sorted_docs]
 import asyncio
 
-async def _bm25_scores(bm25, tokenized_query):
-    """Run BM25 scoring in a thread to avoid blocking the async loop."""
-    return await asyncio.to_thread(bm25.get_scores, tokenized_query)
+async def _bm25_scores(bm25: BM25Index, tokenized_query):
+    """Run sparse BM25 scoring in a thread to avoid blocking the async loop."""
+    return await asyncio.to_thread(bm25.scores, tokenized_query)
 
 async def _hybrid_search_rrf(collection_name: str, query: str, limit: int, k: int = 60) -> List[str]:
     """
@@ -345,39 +760,32 @@ async def _hybrid_search_rrf(collection_name: str, query: str, limit: int, k: in
     Returns:
         List of top documents based on RRF fusion
     """
-    EMBEDDING_MODEL = OpenAIEmbeddings(model="text-embedding-3-small")
-
-    query_embedding =await EMBEDDING_MODEL.aembed_query(query)
-    vector_results =await asyncio.to_thread(
-        QDRANT_CLIENT.search,
+    query_embedding = await embed_query(query)
+    vector_results = (await QDRANT_CLIENT.query_points(
         collection_name=collection_name,
-        query_vector=query_embedding,
+        query=query_embedding,
         limit=limit * 3
-    )
+    )).points
     vector_ranking = [result.payload["text"] for result in vector_results]
 
-    if collection_name not in BM25_INDICES:
+    bm25 = BM25_INDICES.get(collection_name)
+    if not bm25:
         print(f"[HYBRID-RRF] No BM25 index for {collection_name}, falling back to vector only")
         return vector_ranking[:limit]
     
-    bm25_data = BM25_INDICES[collection_name]
-    bm25 = bm25_data["bm25"]
-    docs = bm25_data["docs"]
-    
     tokenized_query = tokenize(query)
-    bm25_scores = await _bm25_scores(bm25, tokenized_query)
-    scored_docs = [(score, docs[str(idx)]) for idx, score in enumerate(bm25_scores)]
+    slots, bm25_scores = await _bm25_scores(bm25, tokenized_query)
 
-   
+    # Chunks without any query term score 0, so the mean is taken over the whole index
     if len(bm25_scores) > 0:
-        max_score = max(bm25_scores)
-        mean_score = sum(bm25_scores) / len(bm25_scores)
+        max_score = float(bm25_scores.max())
+        mean_score = float(bm25_scores.sum()) / len(bm25)
         bm25_threshold = max(max_score * 0.2, mean_score * 0.5, 0.1)
     else:
         bm25_threshold = 0.1
-    bm25_ranking = [doc for score, doc in scored_docs if score > bm25_threshold]
-
-    bm25_ranking = bm25_ranking[:limit * 3]
+    above = bm25_scores > bm25_threshold
+    top_slots, _ = BM25Index.top_k(slots[above], bm25_scores[above], limit * 3)
+    bm25_ranking = [bm25.text(slot) for slot in top_slots]
     
     fused_ranking = await _reciprocal_rank_fusion([vector_ranking[:limit*3], bm25_ranking[:limit*3]], k=k)
     top_results = fused_ranking[:limit]
@@ -394,28 +802,22 @@ async def _hybrid_search_intersection(collection_name: str, query: str, limit: i
     - Queries where you want strict agreement between semantic and keyword retrieval
     """
 
-    EMBEDDING_MODEL = OpenAIEmbeddings(model="text-embedding-3-small")
-    query_embedding =await EMBEDDING_MODEL.aembed_query(query)
-    vector_results =await asyncio.to_thread(
-        QDRANT_CLIENT.search,
+    query_embedding = await embed_query(query)
+    vector_results = (await QDRANT_CLIENT.query_points(
         collection_name=collection_name,
-        query_vector=query_embedding,
+        query=query_embedding,
         limit=limit * 5
-    )
+    )).points
     vector_docs = {result.payload["text"] for result in vector_results}
-    if collection_name not in BM25_INDICES:
+    bm25 = BM25_INDICES.get(collection_name)
+    if not bm25:
         print(f"[HYBRID-INTERSECTION] No BM25 index for {collection_name}, falling back to vector only")
         return list(vector_docs)[:limit]
 
-    bm25_data = BM25_INDICES[collection_name]
-    bm25 = bm25_data["bm25"]
-    docs = bm25_data["docs"]
-
     tokenized_query = tokenize(query)
-    bm25_scores = await _bm25_scores(bm25, tokenized_query)
-    bm25_ranked = [docs[str(idx)] for idx in sorted(
-        range(len(bm25_scores)), key=lambda x: bm25_scores[x], reverse=True
-    )[:limit * 5]]
+    slots, bm25_scores = await _bm25_scores(bm25, tokenized_query)
+    top_slots, _ = BM25Index.top_k(slots, bm25_scores, limit * 5)
+    bm25_ranked = [bm25.text(slot) for slot in top_slots]
     bm25_docs = set(bm25_ranked)
     common_docs = list(vector_docs.intersection(bm25_docs))
     if len(common_docs) < limit:
@@ -444,6 +846,15 @@ def create_combined_system_prompt(custom_prompt: str, base_prompt: str) -> str:
     
     return combined_prompt
 
+def _is_source_decision(content: str) -> bool:
+    import json
+    import re
+    content = re.sub(r'^```json\s*|\s*```$', '', content.strip())
+    try:
+        return "search_strategy" in json.loads(content)
+    except Exception:
+        return False
+
 async def intelligent_source_selection(
     user_query: str,
     has_user_docs: bool,
@@ -507,12 +918,11 @@ You **MUST** respond with a single, valid JSON object and nothing else.
     "reasoning": "Brief explanation of decision"
 }}
 """ 
-    llm = ChatGroq(
-        model="openai/gpt-oss-120b",  
-        temperature=0.4,
-        groq_api_key=os.getenv("GROQ_API_KEY")
+    llm = get_chat_model("groq", "openai/gpt-oss-120b", 0.4)
+    response = await response_cache.ainvoke(
+        "source_selection", "groq:openai/gpt-oss-120b@0.4", llm,
+        [HumanMessage(content=classification_prompt)], validate=_is_source_decision
     )
-    response = await llm.ainvoke([HumanMessage(content=classification_prompt)])
 
     
     try:
@@ -608,6 +1018,33 @@ async def Rag(state: GraphState) -> GraphState:
     await send_status_update(state, "🧠 Analyzing query and searching sources in parallel...", 10)
     has_user_docs = bool(docs)
     has_kb = bool(kb_docs)
+    chunk_callback = state.get("_chunk_callback")
+
+    # KB-only questions are answered from the semantic answer cache when a close enough one was asked before
+    cache_scope = None
+    kb_cache = KB_EMBEDDING_CACHE.get(state.get("session_id", "default"))
+    if has_kb and not has_user_docs and kb_cache and is_self_contained(user_query):
+        cache_scope = answer_scope(kb_cache["fingerprint"], custom_system_prompt, llm_model)
+        query_vector = await embed_query(user_query)
+        cached = answer_cache.lookup(cache_scope, query_vector)
+        if cached:
+            print(f"[RAG] Answer cache hit (similarity {cached['similarity']:.3f}) for: {cached['query']}")
+            await send_status_update(state, "⚡ Reusing a recent answer from the knowledge base...", 90)
+            if chunk_callback:
+                answer = cached["answer"]
+                for i in range(0, len(answer), 256):
+                    await chunk_callback(answer[i:i + 256])
+            state["response"] = cached["answer"]
+            state.setdefault("intermediate_results", []).append({
+                "node": "RAG",
+                "query": user_query,
+                "strategy": "kb_only",
+                "sources_used": {"user_docs": 0, "kb": 0, "answer_cache": True},
+                "output": state["response"]
+            })
+            await send_status_update(state, "✅ RAG processing completed", 100)
+            return state
+
     parallel_tasks = []
 
     intelligence_task = asyncio.create_task(
@@ -782,7 +1219,6 @@ async def Rag(state: GraphState) -> GraphState:
     await send_status_update(state, "🤖 Generating response from retrieved information...", 90)
    
     print(f"model named used in rag.....", llm_model)
-    chunk_callback = state.get("_chunk_callback")
     full_response = ""
     ai_response_dict = {"role": "assistant", "content": ""}
     async for chunk in llm.astream(final_messages):
@@ -796,6 +1232,9 @@ async def Rag(state: GraphState) -> GraphState:
     ai_response_dict["content"] = full_response
     # state["messages"] = state.get("messages", []) + [ai_response_dict]
     state["response"] = full_response
+    # Only answers grounded in the KB alone are reusable across sessions
+    if cache_scope and use_kb and not use_user_docs and kb_result and full_response.strip():
+        answer_cache.store(cache_scope, kb_cache["fingerprint"], user_query, query_vector, full_response)
     state.setdefault("intermediate_results", []).append({
         "node": "RAG",
         "query": user_query,
@@ -0,0 +1,200 @@
+# bm25_index.py
+import copy
+import math
+import threading
+from array import array
+from collections import Counter
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+# Compact postings once this fraction of them points at deleted chunks
+COMPACT_DEAD_RATIO = 0.3
+
+
+class BM25Index:
+    """
+    Sparse inverted-index BM25 (Okapi) that supports adding and deleting
+    chunks without a rebuild.
+
+    Each term maps to a postings pair of arrays (chunk slot, term frequency).
+    Queries only touch the postings of their own terms, so scoring cost is
+    proportional to the number of matching chunks rather than the KB size,
+    and top-k selection uses a partial sort.
+
+    Chunks are grouped under a key (the source document hash) so a whole
+    document can be removed at once. Deleted slots are tombstoned and the
+    postings are compacted lazily.
+    """
+
+    def __init__(self, k1: float = 1.5, b: float = 0.75):
+        self.k1 = k1
+        self.b = b
+        self._postings: Dict[str, Tuple[array, array]] = {}
+        self._df: Dict[str, int] = {}
+        self._texts: List[Optional[str]] = []
+        self._terms: List[Optional[Tuple[str, ...]]] = []
+        self._lengths = array("f")
+        self._alive = bytearray()
+        self._slots_by_key: Dict[str, List[int]] = {}
+        self._live = 0
+        self._total_length = 0.0
+        self._postings_count = 0
+        self._dead_postings = 0
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return self._live
+
+    def add(self, texts: List[str], tokens: List[List[str]], keys: Optional[List[str]] = None) -> List[int]:
+        """Index new chunks. Returns the slots assigned to them."""
+        keys = keys or [None] * len(texts)
+        slots = []
+        with self._lock:
+            for text, chunk_tokens, key in zip(texts, tokens, keys):
+                slot = len(self._texts)
+                counts = Counter(chunk_tokens)
+                for term, tf in counts.items():
+                    posting = self._postings.get(term)
+                    if posting is None:
+                        posting = self._postings[term] = (array("q"), array("f"))
+                    posting[0].append(slot)
+                    posting[1].append(tf)
+                    self._df[term] = self._df.get(term, 0) + 1
+                self._texts.append(text)
+                self._terms.append(tuple(counts))
+                self._lengths.append(len(chunk_tokens))
+                self._alive.append(1)
+                if key is not None:
+                    self._slots_by_key.setdefault(key, []).append(slot)
+                self._live += 1
+                self._total_length += len(chunk_tokens)
+                self._postings_count += len(counts)
+                slots.append(slot)
+        return slots
+
+    def remove_keys(self, keys: Iterable[str]) -> int:
+        """Delete every chunk indexed under the given keys. Returns the number of chunks removed."""
+        removed = 0
+        with self._lock:
+            for key in keys:
+                for slot in self._slots_by_key.pop(key, []):
+                    if not self._alive[slot]:
+                        continue
+                    self._alive[slot] = 0
+                    for term in self._terms[slot]:
+                        self._df[term] -= 1
+                        if self._df[term] == 0:
+                            # Every posting of this term is dead now; drop the list outright
+                            del self._df[term]
+                            dropped = len(self._postings.pop(term)[0])
+                            self._dead_postings -= dropped - 1
+                            self._postings_count -= dropped
+                        else:
+                            self._dead_postings += 1
+                    self._live -= 1
+                    self._total_length -= self._lengths[slot]
+                    self._texts[slot] = None
+                    self._terms[slot] = None
+                    removed += 1
+            if self._postings_count and self._dead_postings / self._postings_count > COMPACT_DEAD_RATIO:
+                self._compact_locked()
+        return removed
+
+    def rekey(self, old_key: str, new_key: str):
+        """Move every chunk indexed under `old_key` to `new_key`."""
+        with self._lock:
+            slots = self._slots_by_key.pop(old_key, [])
+            if slots:
+                self._slots_by_key.setdefault(new_key, []).extend(slots)
+
+    def _compact_locked(self):
+        alive = np.frombuffer(self._alive, dtype=np.uint8).astype(bool)
+        for term, (slots, tfs) in list(self._postings.items()):
+            slot_arr = np.frombuffer(slots, dtype=np.int64)
+            keep = alive[slot_arr]
+            if keep.all():
+                continue
+            new_slots = array("q", slot_arr[keep].tobytes())
+            new_tfs = array("f", np.frombuffer(tfs, dtype=np.float32)[keep].tobytes())
+            del slot_arr, keep
+            self._postings[term] = (new_slots, new_tfs)
+        self._postings_count -= self._dead_postings
+        self._dead_postings = 0
+
+    def __getstate__(self):
+        # Copies and pickles get a lock of their own; readers keep using this one meanwhile
+        state = self.__dict__.copy()
+        del state["_lock"]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+    def clone(self, exclude_keys: Iterable[str] = ()) -> "BM25Index":
+        """Copy the index, optionally without the chunks of some keys."""
+        with self._lock:
+            other = copy.deepcopy(self)
+        other.remove_keys(exclude_keys)
+        return other
+
+    def scores(self, tokens: List[str]) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Score only the chunks that contain at least one query term.
+        Returns (slots, scores), unordered.
+        """
+        with self._lock:
+            if not self._live or not tokens:
+                return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float64)
+            n = self._live
+            avgdl = self._total_length / n
+            alive = np.frombuffer(self._alive, dtype=np.uint8)
+            lengths = np.frombuffer(self._lengths, dtype=np.float32)
+            slot_parts = []
+            score_parts = []
+            for term, qtf in Counter(tokens).items():
+                posting = self._postings.get(term)
+                if posting is None:
+                    continue
+                slots = np.frombuffer(posting[0], dtype=np.int64)
+                tfs = np.frombuffer(posting[1], dtype=np.float32)
+                mask = alive[slots].astype(bool)
+                slots = slots[mask]
+                tfs = tfs[mask].astype(np.float64)
+                df = self._df[term]
+                idf = math.log((n - df + 0.5) / (df + 0.5) + 1.0)
+                norm = self.k1 * (1.0 - self.b + self.b * lengths[slots] / avgdl)
+                slot_parts.append(slots)
+                score_parts.append(qtf * idf * tfs * (self.k1 + 1.0) / (tfs + norm))
+            del alive, lengths
+        if not slot_parts:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float64)
+        all_slots = np.concatenate(slot_parts)
+        uniq, inverse = np.unique(all_slots, return_inverse=True)
+        return uniq, np.bincount(inverse, weights=np.concatenate(score_parts))
+
+    @staticmethod
+    def top_k(slots: np.ndarray, scores: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+        """Best k (slot, score) pairs in descending score order using a partial sort."""
+        if k <= 0 or not len(scores):
+            return slots[:0], scores[:0]
+        if k < len(scores):
+            part = np.argpartition(-scores, k - 1)[:k]
+            slots, scores = slots[part], scores[part]
+        order = np.argsort(-scores, kind="stable")
+        return slots[order], scores[order]
+
+    def search(self, tokens: List[str], k: int) -> List[Tuple[str, float]]:
+        """Top-k (text, score) pairs for a tokenized query."""
+        slots, scores = self.top_k(*self.scores(tokens), k)
+        return [(self._texts[s], float(sc)) for s, sc in zip(slots, scores)]
+
+    def text(self, slot: int) -> Optional[str]:
+        return self._texts[slot]
+
+    def nbytes(self) -> int:
+        """Approximate memory held by postings, lengths and chunk texts."""
+        postings = sum(s.itemsize * len(s) + t.itemsize * len(t) for s, t in self._postings.values())
+        texts = sum(len(t) for t in self._texts if t)
+        return postings + texts + self._lengths.itemsize * len(self._lengths) + len(self._alive)
@@ -0,0 +1,147 @@
+# embedding_pipeline.py
+import os
+import random
+import asyncio
+from typing import Any, AsyncIterable, Awaitable, Callable, Iterable, List, Optional, Union
+
+import openai
+
+# Token budget per embedding request (text-embedding-3-* accepts up to 8191 tokens per input and ~300k per request)
+EMBED_BATCH_TOKENS = int(os.getenv("EMBED_BATCH_TOKENS", "16000"))
+EMBED_BATCH_MAX_ITEMS = int(os.getenv("EMBED_BATCH_MAX_ITEMS", "256"))
+EMBED_CONCURRENCY = int(os.getenv("EMBED_CONCURRENCY", "4"))
+EMBED_MAX_RETRIES = int(os.getenv("EMBED_MAX_RETRIES", "6"))
+EMBED_BACKOFF_BASE = float(os.getenv("EMBED_BACKOFF_BASE", "1.0"))
+EMBED_BACKOFF_MAX = float(os.getenv("EMBED_BACKOFF_MAX", "30.0"))
+
+Chunks = Union[Iterable[Any], AsyncIterable[Any]]
+
+
+def estimate_tokens(text: str) -> int:
+    """Cheap token estimate (~4 characters per token for English text)."""
+    return max(1, len(text) // 4)
+
+
+async def token_batches(
+    items: Chunks,
+    text_of: Callable[[Any], str],
+    max_tokens: int = EMBED_BATCH_TOKENS,
+    max_items: int = EMBED_BATCH_MAX_ITEMS,
+):
+    """
+    Group chunks into batches of at most `max_tokens` estimated tokens and
+    `max_items` chunks. Accepts a plain or async iterable so chunks can be
+    produced lazily; only the batch being filled is held in memory.
+    """
+    batch: List[Any] = []
+    tokens = 0
+
+    async def _iterate():
+        if hasattr(items, "__aiter__"):
+            async for item in items:
+                yield item
+        else:
+            for item in items:
+                yield item
+
+    async for item in _iterate():
+        cost = estimate_tokens(text_of(item))
+        if batch and (tokens + cost > max_tokens or len(batch) >= max_items):
+            yield batch
+            batch, tokens = [], 0
+        batch.append(item)
+        tokens += cost
+    if batch:
+        yield batch
+
+
+def _retry_after(exc: Exception) -> Optional[float]:
+    response = getattr(exc, "response", None)
+    headers = getattr(response, "headers", None) or {}
+    try:
+        return float(headers.get("retry-after"))
+    except (TypeError, ValueError):
+        return None
+
+
+def _is_rate_limited(exc: Exception) -> bool:
+    if isinstance(exc, openai.RateLimitError):
+        return True
+    return getattr(exc, "status_code", None) == 429
+
+
+async def with_backoff(fn: Callable[[], Awaitable[Any]], max_retries: int = EMBED_MAX_RETRIES):
+    """Call `fn`, retrying on 429s with exponential backoff and full jitter (honours Retry-After)."""
+    attempt = 0
+    while True:
+        try:
+            return await fn()
+        except Exception as e:
+            if not _is_rate_limited(e) or attempt >= max_retries:
+                raise
+            delay = _retry_after(e)
+            if delay is None:
+                delay = random.uniform(0, min(EMBED_BACKOFF_MAX, EMBED_BACKOFF_BASE * (2 ** attempt)))
+            attempt += 1
+            print(f"[EmbeddingPipeline] Rate limited, retry {attempt}/{max_retries} in {delay:.2f}s")
+            await asyncio.sleep(delay)
+
+
+async def run_embedding_pipeline(
+    chunks: Chunks,
+    text_of: Callable[[Any], str],
+    embed_batch: Callable[[List[str]], Awaitable[List[List[float]]]],
+    on_batch: Callable[[List[Any], List[List[float]]], Awaitable[None]],
+    concurrency: int = EMBED_CONCURRENCY,
+    max_tokens: int = EMBED_BATCH_TOKENS,
+    max_items: int = EMBED_BATCH_MAX_ITEMS,
+) -> int:
+    """
+    Embed chunks in token-budgeted batches with at most `concurrency` batches
+    in flight, calling `on_batch(batch, vectors)` (e.g. a Qdrant upsert) as
+    each batch completes. New batches are only pulled from `chunks` when a
+    slot frees up, so memory is bounded by batch size, not document size.
+
+    Returns the number of chunks processed. The first failing batch cancels
+    the remaining ones and its exception is re-raised.
+    """
+    semaphore = asyncio.Semaphore(max(1, concurrency))
+    tasks = set()
+    total = 0
+    failure: List[BaseException] = []
+
+    async def _run(batch: List[Any]):
+        try:
+            texts = [text_of(item) for item in batch]
+            vectors = await with_backoff(lambda: embed_batch(texts))
+            await on_batch(batch, vectors)
+        except BaseException as e:
+            if not failure:
+                failure.append(e)
+            raise
+        finally:
+            semaphore.release()
+
+    try:
+        async for batch in token_batches(chunks, text_of, max_tokens, max_items):
+            await semaphore.acquire()
+            if failure:
+                semaphore.release()
+                break
+            total += len(batch)
+            task = asyncio.create_task(_run(batch))
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+            # The first failure is re-raised below; don't warn about unretrieved exceptions
+            task.add_done_callback(lambda t: t.cancelled() or t.exception())
+        if tasks:
+            await asyncio.gather(*tasks)
+    except BaseException:
+        for task in tasks:
+            task.cancel()
+        if tasks:
+            await asyncio.gather(*tasks, return_exceptions=True)
+        raise
+    if failure:
+        raise failure[0]
+    return total
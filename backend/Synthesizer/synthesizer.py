@@ -1,9 +1,8 @@
 from graph_type import GraphState
 from langchain_openai import ChatOpenAI
 from langchain_core.messages import SystemMessage, HumanMessage
-from langchain_google_genai import ChatGoogleGenerativeAI
+from llm import get_gemini_llm
 import os
-google_api_key=os.getenv("GOOGLE_API_KEY", "")
 SYNTHESIZER_PROMPT = """
 You are a final answer synthesizer. Your task is to assemble the results from a multi-step AI execution into a single, cohesive, and well-structured response for the user.
 
@@ -66,11 +65,7 @@ async def synthesize_final_answer(state: GraphState) -> GraphState:
         formatted_results=formatted_results
     )
     await send_status_update(state, "🤖 Generating final comprehensive answer...", 60)
-    llm=ChatGoogleGenerativeAI(
-                model="gemini-2.5-flash-lite",
-                temperature=0.3,
-                google_api_key=google_api_key,
-            )
+    llm = get_gemini_llm(0.3)
     final_answer = await llm.ainvoke([HumanMessage(content=prompt)])
     await send_status_update(state, "✅ Final answer synthesis completed", 100)
     print("--- FINAL ANSWER GENERATED ---")
@@ -7,9 +7,8 @@ from graph_type import GraphState
 from pathlib import Path
 from langchain_core.messages import SystemMessage, HumanMessage
 from dotenv import load_dotenv
-from langchain_google_genai import ChatGoogleGenerativeAI
+from llm import get_gemini_llm
 load_dotenv()
-google_api_key=os.getenv("GOOGLE_API_KEY", "")
 _tavily: Optional[AsyncTavilyClient] = None
 from prompt_cache import normalize_prefix
 
@@ -180,11 +179,7 @@ Now synthesize them into a clear, structured answer with:
     print(f"[WebSearch] Chunk callback type: {type(chunk_callback)}")
     full_response = ""
     if not is_web_search:
-        llm=ChatGoogleGenerativeAI(
-                model="gemini-2.5-flash-lite",
-                temperature=0.3,
-                google_api_key=google_api_key,
-            )
+        llm = get_gemini_llm(0.3)
         system_msg = SystemMessage(content=STATIC_SYS_WEBSEARCH_BASIC)
         human_msg = HumanMessage(content=user_prompt)
 
@@ -198,11 +193,7 @@ Now synthesize them into a clear, structured answer with:
                     await chunk_callback(chunk.content)
         
     else:    
-        llm=ChatGoogleGenerativeAI(
-                model="gemini-2.5-flash-lite",
-                temperature=0.3,
-                google_api_key=google_api_key,
-            )
+        llm = get_gemini_llm(0.3)
         system_msg = SystemMessage(content=STATIC_SYS_WEBSEARCH)
         human_msg = HumanMessage(content=user_prompt)
 
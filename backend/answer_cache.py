@@ -0,0 +1,148 @@
+# answer_cache.py
+import os
+import re
+import time
+import hashlib
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+
+ANSWER_CACHE_ENABLED = os.getenv("ANSWER_CACHE_ENABLED", "true").lower() == "true"
+# Cosine similarity a new query needs with a cached one to reuse its answer
+ANSWER_CACHE_THRESHOLD = float(os.getenv("ANSWER_CACHE_THRESHOLD", "0.95"))
+ANSWER_CACHE_TTL = float(os.getenv("ANSWER_CACHE_TTL", "86400"))
+# Answers kept per (KB, instructions, model) scope, and scopes kept overall
+ANSWER_CACHE_SCOPE_SIZE = int(os.getenv("ANSWER_CACHE_SCOPE_SIZE", "512"))
+ANSWER_CACHE_MAX_SCOPES = int(os.getenv("ANSWER_CACHE_MAX_SCOPES", "256"))
+
+# Queries that lean on the conversation ("tell me more about it") are never answered from the cache
+_FOLLOW_UP_RE = re.compile(
+    r"\b(it|its|this|that|these|those|he|him|his|she|her|they|them|their|"
+    r"more|else|further|above|previous|earlier|again|also|same)\b",
+    re.IGNORECASE,
+)
+
+
+def is_self_contained(query: str) -> bool:
+    """Heuristic: the query has enough words and no pronouns or continuation words."""
+    words = query.split()
+    return len(words) >= 3 and not _FOLLOW_UP_RE.search(query)
+
+
+def answer_scope(kb_fingerprint: str, instruction: str, model: str) -> str:
+    """Everything besides the query that changes a KB answer: the KB content, the GPT instructions and the model."""
+    instruction_hash = hashlib.sha256((instruction or "").strip().encode("utf-8")).hexdigest()[:16]
+    return f"{kb_fingerprint}:{instruction_hash}:{model}"
+
+
+class _Scope:
+    """Answers of one scope, with their unit-normalized query embeddings stacked for one matrix product per lookup."""
+
+    def __init__(self, kb_fingerprint: str):
+        self.kb_fingerprint = kb_fingerprint
+        self.vectors: Optional[np.ndarray] = None
+        self.entries: List[Tuple[float, str, str]] = []  # (expires_at, query, answer)
+
+    def prune(self, now: float, max_entries: int):
+        keep = [i for i, (expires_at, _, _) in enumerate(self.entries) if expires_at >= now]
+        keep = keep[-max_entries:]
+        if len(keep) != len(self.entries):
+            self.entries = [self.entries[i] for i in keep]
+            self.vectors = self.vectors[keep] if keep else None
+
+
+class SemanticAnswerCache:
+    """
+    Process-wide cache of RAG answers for questions asked against the same KB.
+
+    Answers are grouped by scope (KB fingerprint, GPT instruction hash,
+    model) and matched on the cosine similarity of the query embedding, so
+    a rephrased question still hits. Entries expire after the TTL and each
+    scope keeps its most recent answers; scopes are evicted LRU. When a KB
+    collection is rebuilt or dropped, every scope of its fingerprint is
+    invalidated.
+    """
+
+    def __init__(self, threshold: float = ANSWER_CACHE_THRESHOLD, ttl_seconds: float = ANSWER_CACHE_TTL,
+                 scope_size: int = ANSWER_CACHE_SCOPE_SIZE, max_scopes: int = ANSWER_CACHE_MAX_SCOPES,
+                 enabled: bool = ANSWER_CACHE_ENABLED):
+        self.threshold = threshold
+        self.ttl_seconds = ttl_seconds
+        self.scope_size = scope_size
+        self.max_scopes = max_scopes
+        self.enabled = enabled
+        self.hits = 0
+        self.misses = 0
+        self.stores = 0
+        self.invalidations = 0
+        self._scopes: "OrderedDict[str, _Scope]" = OrderedDict()
+
+    @staticmethod
+    def _normalize(vector: List[float]) -> Optional[np.ndarray]:
+        v = np.asarray(vector, dtype=np.float32)
+        norm = float(np.linalg.norm(v))
+        return v / norm if norm else None
+
+    def lookup(self, scope: str, query_vector: List[float]) -> Optional[Dict[str, Any]]:
+        """The cached answer closest to `query_vector` in `scope`, if it clears the threshold."""
+        if not self.enabled:
+            return None
+        entry = self._scopes.get(scope)
+        v = self._normalize(query_vector)
+        if entry is not None and v is not None:
+            entry.prune(time.monotonic(), self.scope_size)
+            if entry.vectors is not None:
+                scores = entry.vectors @ v
+                best = int(np.argmax(scores))
+                if scores[best] >= self.threshold:
+                    self._scopes.move_to_end(scope)
+                    self.hits += 1
+                    _, query, answer = entry.entries[best]
+                    return {"answer": answer, "query": query, "similarity": float(scores[best])}
+        self.misses += 1
+        return None
+
+    def store(self, scope: str, kb_fingerprint: str, query: str, query_vector: List[float], answer: str):
+        if not self.enabled or not answer.strip():
+            return
+        v = self._normalize(query_vector)
+        if v is None:
+            return
+        entry = self._scopes.get(scope)
+        if entry is None:
+            entry = self._scopes[scope] = _Scope(kb_fingerprint)
+        self._scopes.move_to_end(scope)
+        entry.entries.append((time.monotonic() + self.ttl_seconds, query, answer))
+        entry.vectors = v[None, :] if entry.vectors is None else np.vstack([entry.vectors, v])
+        entry.prune(time.monotonic(), self.scope_size)
+        self.stores += 1
+        while len(self._scopes) > self.max_scopes:
+            self._scopes.popitem(last=False)
+
+    def invalidate(self, kb_fingerprint: str):
+        """Drop every answer computed against the KB with this fingerprint."""
+        stale = [scope for scope, entry in self._scopes.items() if entry.kb_fingerprint == kb_fingerprint]
+        for scope in stale:
+            del self._scopes[scope]
+        if stale:
+            self.invalidations += 1
+            print(f"[AnswerCache] Invalidated {len(stale)} answer scopes of KB {kb_fingerprint[:12]}")
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            "enabled": self.enabled,
+            "scopes": len(self._scopes),
+            "entries": sum(len(entry.entries) for entry in self._scopes.values()),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            "stores": self.stores,
+            "invalidations": self.invalidations,
+            "threshold": self.threshold,
+        }
+
+
+# Global semantic answer cache instance
+answer_cache = SemanticAnswerCache()
@@ -0,0 +1,153 @@
+# chat_admission.py
+import os
+import math
+import time
+import asyncio
+from typing import Any, Dict, Optional
+
+# Graph executions running at once in this process, and requests allowed to wait for a slot
+CHAT_MAX_CONCURRENT = int(os.getenv("CHAT_MAX_CONCURRENT", "32"))
+CHAT_MAX_QUEUED = int(os.getenv("CHAT_MAX_QUEUED", "64"))
+# Longest a request waits for its session and a slot before being turned away
+CHAT_QUEUE_TIMEOUT = float(os.getenv("CHAT_QUEUE_TIMEOUT", "30"))
+# Requests of one session waiting behind the one that is running
+CHAT_SESSION_MAX_QUEUED = int(os.getenv("CHAT_SESSION_MAX_QUEUED", "2"))
+
+
+class Overloaded(Exception):
+    """Raised when a chat request cannot be admitted; carries a Retry-After hint in seconds."""
+
+    def __init__(self, reason: str, retry_after: int):
+        super().__init__(reason)
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+class ChatLease:
+    """A session turn plus a global execution slot. Release exactly once, when the response ends."""
+
+    def __init__(self, admission: "ChatAdmission", session_id: str):
+        self._admission = admission
+        self.session_id = session_id
+        self.started = time.monotonic()
+        self._released = False
+
+    def release(self):
+        if self._released:
+            return
+        self._released = True
+        self._admission._release(self)
+
+
+class ChatAdmission:
+    """
+    Admission control for chat graph executions.
+
+    - Requests of the same session run one at a time, in arrival order, so
+      they never mutate the session's messages concurrently.
+    - At most `max_concurrent` graphs run in the process; up to `max_queued`
+      further requests wait for a slot.
+    - When the queue is full, a session already has too many requests waiting,
+      or a slot does not free up within `queue_timeout`, the request is
+      rejected with Overloaded, whose retry_after is derived from recent run
+      times, instead of piling more load onto the model providers.
+    """
+
+    def __init__(self, max_concurrent: int = CHAT_MAX_CONCURRENT, max_queued: int = CHAT_MAX_QUEUED,
+                 queue_timeout: float = CHAT_QUEUE_TIMEOUT, session_max_queued: int = CHAT_SESSION_MAX_QUEUED):
+        self.max_concurrent = max_concurrent
+        self.max_queued = max_queued
+        self.queue_timeout = queue_timeout
+        self.session_max_queued = session_max_queued
+        self._slots: Optional[asyncio.Semaphore] = None
+        self._session_locks: Dict[str, asyncio.Lock] = {}
+        self._session_lock_users: Dict[str, int] = {}
+        self.running = 0
+        self.waiting = 0
+        self.admitted = 0
+        self.rejected = 0
+        # Exponentially weighted average run time, for Retry-After
+        self._avg_run_seconds = 10.0
+
+    def _semaphore(self) -> asyncio.Semaphore:
+        if self._slots is None:
+            self._slots = asyncio.Semaphore(self.max_concurrent)
+        return self._slots
+
+    def retry_after(self) -> int:
+        """Seconds until a slot is likely to be free for a new request."""
+        backlog = self.waiting + 1
+        return max(1, math.ceil(self._avg_run_seconds * backlog / max(1, self.max_concurrent)))
+
+    def _reject(self, reason: str):
+        self.rejected += 1
+        retry_after = self.retry_after()
+        print(f"[Admission] Rejected chat request ({reason}); retry after {retry_after}s")
+        raise Overloaded(reason, retry_after)
+
+    def _lock_for(self, session_id: str) -> asyncio.Lock:
+        lock = self._session_locks.setdefault(session_id, asyncio.Lock())
+        self._session_lock_users[session_id] = self._session_lock_users.get(session_id, 0) + 1
+        return lock
+
+    def _unref_lock(self, session_id: str):
+        self._session_lock_users[session_id] -= 1
+        if not self._session_lock_users[session_id]:
+            del self._session_lock_users[session_id]
+            del self._session_locks[session_id]
+
+    async def admit(self, session_id: str) -> ChatLease:
+        if self.running >= self.max_concurrent and self.waiting >= self.max_queued:
+            self._reject("queue full")
+        # One running plus session_max_queued waiting
+        if self._session_lock_users.get(session_id, 0) > self.session_max_queued:
+            self._reject("too many requests for this session")
+
+        lock = self._lock_for(session_id)
+        slots = self._semaphore()
+        self.waiting += 1
+        have_lock = have_slot = False
+        try:
+            async with asyncio.timeout(self.queue_timeout):
+                await lock.acquire()
+                have_lock = True
+                await slots.acquire()
+                have_slot = True
+        except TimeoutError:
+            pass
+        finally:
+            self.waiting -= 1
+            if not have_slot:
+                if have_lock:
+                    lock.release()
+                self._unref_lock(session_id)
+
+        if not have_slot:
+            self._reject("timed out waiting for a slot")
+        self.running += 1
+        self.admitted += 1
+        return ChatLease(self, session_id)
+
+    def _release(self, lease: ChatLease):
+        elapsed = time.monotonic() - lease.started
+        self._avg_run_seconds = 0.8 * self._avg_run_seconds + 0.2 * elapsed
+        self.running -= 1
+        self._semaphore().release()
+        self._session_locks[lease.session_id].release()
+        self._unref_lock(lease.session_id)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "running": self.running,
+            "waiting": self.waiting,
+            "max_concurrent": self.max_concurrent,
+            "max_queued": self.max_queued,
+            "admitted": self.admitted,
+            "rejected": self.rejected,
+            "avg_run_seconds": round(self._avg_run_seconds, 2),
+            "sessions": len(self._session_locks),
+        }
+
+
+# Global chat admission controller
+chat_admission = ChatAdmission()
@@ -0,0 +1,147 @@
+# conversation_summary.py
+import os
+import asyncio
+from typing import Any, Dict, List
+
+from langchain_core.messages import SystemMessage, HumanMessage
+
+from session_store import session_store
+from session_reaper import session_reaper
+
+# Unsummarized turns are folded into the summary once they reach this many (estimated) tokens
+SUMMARY_TOKEN_THRESHOLD = int(os.getenv("SUMMARY_TOKEN_THRESHOLD", "1000"))
+# The most recent messages are left out of the summary; nodes read them verbatim
+SUMMARY_KEEP_LAST = int(os.getenv("SUMMARY_KEEP_LAST", "2"))
+# Longest stretch of new turns sent in one summarization call
+SUMMARY_MAX_INPUT_CHARS = int(os.getenv("SUMMARY_MAX_INPUT_CHARS", "8000"))
+
+SUMMARY_SYSTEM_PROMPT = (
+    "You are a summarization agent. Update the running summary of a chat with the new turns, "
+    "in <300 words, preserving key intents, facts, and unresolved items. Output only plain text."
+)
+
+
+def estimate_tokens(text: str) -> int:
+    return len(text) // 4
+
+
+def _format_turns(messages: List[Dict[str, Any]]) -> str:
+    lines = []
+    for m in messages:
+        role = (m.get("type") or m.get("role") or "").lower()
+        content = m.get("content") or ""
+        if not content:
+            continue
+        speaker = "User" if role in ("human", "user") else "Assistant"
+        lines.append(f"{speaker}: {content}")
+    return "\n".join(lines)
+
+
+class ConversationSummarizer:
+    """
+    Incremental conversation summaries, computed in the background.
+
+    A session's "summary" covers its messages up to "summary_upto". After a
+    chat response is delivered, `schedule` checks whether the turns between
+    that point and the last SUMMARY_KEEP_LAST messages reach the token
+    threshold; if so, a background task folds only those turns into the
+    existing summary and persists the result. One task runs per session at a
+    time; a request made while it runs is picked up when it finishes.
+    """
+
+    def __init__(self, token_threshold: int = SUMMARY_TOKEN_THRESHOLD, keep_last: int = SUMMARY_KEEP_LAST,
+                 max_input_chars: int = SUMMARY_MAX_INPUT_CHARS):
+        self.token_threshold = token_threshold
+        self.keep_last = keep_last
+        self.max_input_chars = max_input_chars
+        self._tasks: Dict[str, asyncio.Task] = {}
+        self._rerun: set = set()
+        self.runs = 0
+        self.failures = 0
+        self.folded_messages = 0
+
+    def _pending(self, session: Dict[str, Any]) -> List[Dict[str, Any]]:
+        messages = session.get("messages") or []
+        upto = min(session.get("summary_upto") or 0, len(messages))
+        return messages[upto:max(upto, len(messages) - self.keep_last)]
+
+    def _due(self, session: Dict[str, Any]) -> bool:
+        return estimate_tokens(_format_turns(self._pending(session))) >= self.token_threshold
+
+    def schedule(self, session_id: str, session: Dict[str, Any]) -> bool:
+        """Start folding the session's new turns into its summary if enough have piled up."""
+        if session_id in self._tasks:
+            self._rerun.add(session_id)
+            return False
+        if not self._due(session):
+            return False
+        self._tasks[session_id] = asyncio.create_task(self._run(session_id))
+        return True
+
+    async def _fold(self, summary: str, turns: List[Dict[str, Any]]) -> str:
+        from llm import get_gemini_llm
+        new_text = _format_turns(turns)[-self.max_input_chars:]
+        user_prompt = (
+            f"Current summary:\n{summary or '(none)'}\n\n"
+            f"New turns:\n{new_text}\n\n"
+            "Return the updated summary."
+        )
+        result = await get_gemini_llm(0.3).ainvoke([
+            SystemMessage(content=SUMMARY_SYSTEM_PROMPT),
+            HumanMessage(content=user_prompt)
+        ])
+        return (result.content or "").strip()
+
+    async def _run(self, session_id: str):
+        try:
+            while True:
+                self._rerun.discard(session_id)
+                with session_reaper.hold(session_id):
+                    session = await asyncio.to_thread(session_store.load, session_id)
+                    if session is None or not self._due(session):
+                        return
+                    base_upto = session.get("summary_upto") or 0
+                    turns = self._pending(session)
+                    upto = min(base_upto, len(session["messages"])) + len(turns)
+                    self.runs += 1
+                    summary = await self._fold(session.get("summary", ""), turns)
+                    if not summary:
+                        return
+                    # Reload: the chat may have saved the session meanwhile
+                    session = await asyncio.to_thread(session_store.load, session_id)
+                    if session is None or (session.get("summary_upto") or 0) != base_upto:
+                        return
+                    session["summary"] = summary
+                    session["summary_upto"] = upto
+                    await asyncio.to_thread(session_store.save, session_id, session)
+                    self.folded_messages += len(turns)
+                    print(f"[Summary] Folded {len(turns)} messages into the summary of session {session_id}")
+                if session_id not in self._rerun:
+                    return
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            self.failures += 1
+            print(f"[Summary] Summarization failed for session {session_id}: {e}")
+        finally:
+            self._tasks.pop(session_id, None)
+            self._rerun.discard(session_id)
+
+    async def stop(self):
+        tasks = list(self._tasks.values())
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "running": len(self._tasks),
+            "runs": self.runs,
+            "failures": self.failures,
+            "folded_messages": self.folded_messages,
+            "token_threshold": self.token_threshold,
+        }
+
+
+# Global conversation summarizer instance
+conversation_summarizer = ConversationSummarizer()
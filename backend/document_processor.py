@@ -1,4 +1,11 @@
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Optional, AsyncIterator, Tuple, Union
+import os
+import time
+import asyncio
+import tempfile
+import multiprocessing
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
 import pypdf
 import docx
 import json
@@ -6,15 +13,59 @@ from io import BytesIO
 import uuid
 from fastapi import UploadFile
 from models import DocumentInfo
+from text_cache import text_cache
+
+EXTRACT_WORKERS = int(os.getenv("EXTRACT_WORKERS", str(os.cpu_count() or 2)))
+# Per-document extraction timeout in seconds
+EXTRACT_TIMEOUT = float(os.getenv("EXTRACT_TIMEOUT", "120"))
+# PDFs with at least this many pages are split into page ranges parsed in parallel
+PDF_PARALLEL_MIN_PAGES = int(os.getenv("PDF_PARALLEL_MIN_PAGES", "40"))
+# Pages per task when a large PDF is parsed in parallel
+PDF_PAGES_PER_TASK = int(os.getenv("PDF_PAGES_PER_TASK", "16"))
+# "spawn" avoids forking a process that already runs event-loop and client threads
+EXTRACT_START_METHOD = os.getenv("EXTRACT_START_METHOD", "spawn")
+
+# Parsing these is expensive enough to cache the result by file hash
+CACHED_KINDS = ("pdf", "docx")
+
+_EXTRACT_POOL: Optional[ProcessPoolExecutor] = None
+
+def get_extraction_pool() -> ProcessPoolExecutor:
+    """Shared process pool for CPU-bound document parsing, created on first use."""
+    global _EXTRACT_POOL
+    if _EXTRACT_POOL is None:
+        _EXTRACT_POOL = ProcessPoolExecutor(
+            max_workers=EXTRACT_WORKERS,
+            mp_context=multiprocessing.get_context(EXTRACT_START_METHOD)
+        )
+    return _EXTRACT_POOL
+
+def shutdown_extraction_pool():
+    global _EXTRACT_POOL
+    if _EXTRACT_POOL is not None:
+        _EXTRACT_POOL.shutdown(wait=False, cancel_futures=True)
+        _EXTRACT_POOL = None
+
+def _pdf_reader(source: Union[bytes, str]) -> pypdf.PdfReader:
+    return pypdf.PdfReader(source if isinstance(source, str) else BytesIO(source))
+
+def pdf_page_count(source: Union[bytes, str]) -> int:
+    return len(_pdf_reader(source).pages)
+
+def extract_pdf_pages(source: Union[bytes, str], start: int = 0, end: Optional[int] = None) -> List[str]:
+    """Text of pages [start, end) of a PDF given as bytes or a file path (runs in a pool worker)"""
+    pages = _pdf_reader(source).pages
+    end = len(pages) if end is None else min(end, len(pages))
+    return [(pages[i].extract_text() or "") for i in range(start, end)]
+
+def extract_docx_paragraphs(file_content: bytes) -> List[str]:
+    """Paragraph texts of a DOCX file (runs in a pool worker)"""
+    return [paragraph.text for paragraph in docx.Document(BytesIO(file_content)).paragraphs]
 
 def extract_text_from_pdf(file_content: bytes) -> str:
     """Extract text from PDF file"""
     try:
-        pdf_reader = pypdf.PdfReader(BytesIO(file_content))
-        text = ""
-        for page in pdf_reader.pages:
-            text += page.extract_text() + "\n"
-        return text
+        return "".join(page + "\n" for page in extract_pdf_pages(file_content))
     except Exception as e:
         print(f"Error reading PDF: {e}")
         return ""
@@ -22,11 +73,7 @@ def extract_text_from_pdf(file_content: bytes) -> str:
 def extract_text_from_docx(file_content: bytes) -> str:
     """Extract text from DOCX file"""
     try:
-        doc = docx.Document(BytesIO(file_content))
-        text = ""
-        for paragraph in doc.paragraphs:
-            text += paragraph.text + "\n"
-        return text
+        return "".join(paragraph + "\n" for paragraph in extract_docx_paragraphs(file_content))
     except Exception as e:
         print(f"Error reading DOCX: {e}")
         return ""
@@ -45,21 +92,143 @@ def extract_text_from_json(file_content: bytes) -> str:
         data = json.loads(file_content.decode('utf-8'))
         # Convert JSON to readable text format
         if isinstance(data, dict):
-            text = ""
-            for key, value in data.items():
-                text += f"{key}: {value}\n"
-            return text
+            return "".join(f"{key}: {value}\n" for key, value in data.items())
         elif isinstance(data, list):
-            text = ""
-            for i, item in enumerate(data):
-                text += f"Item {i+1}: {item}\n"
-            return text
+            return "".join(f"Item {i+1}: {item}\n" for i, item in enumerate(data))
         else:
             return str(data)
     except Exception as e:
         print(f"Error reading JSON: {e}")
         return ""
 
+def detect_file_kind(filename: str, file_type: str = "") -> str:
+    """Map a filename / MIME type to one of "pdf", "docx", "json" or "txt" (extension wins)"""
+    extension = filename.rsplit('.', 1)[-1].lower() if '.' in filename else ""
+    if extension in ("pdf", "docx", "json", "txt"):
+        return extension
+    if file_type == "application/pdf":
+        return "pdf"
+    if file_type == "application/vnd.openxmlformats-officedocument.wordprocessingml.document":
+        return "docx"
+    if file_type == "application/json":
+        return "json"
+    return "txt"
+
+class _ExtractionClock:
+    """Time spent waiting on extraction for one document (consumer time excluded)"""
+
+    def __init__(self, timeout: float):
+        self.timeout = timeout
+        self.spent = 0.0
+
+    async def wait(self, awaitable):
+        remaining = self.timeout - self.spent
+        if remaining <= 0:
+            raise asyncio.TimeoutError()
+        started = time.monotonic()
+        try:
+            return await asyncio.wait_for(awaitable, remaining)
+        finally:
+            self.spent += time.monotonic() - started
+
+async def _iter_pdf_pages(file_content: bytes, clock: _ExtractionClock) -> AsyncIterator[Tuple[int, str]]:
+    loop = asyncio.get_running_loop()
+    pool = get_extraction_pool()
+    page_count = await clock.wait(loop.run_in_executor(pool, pdf_page_count, file_content))
+    if page_count < PDF_PARALLEL_MIN_PAGES or EXTRACT_WORKERS < 2:
+        pages = await clock.wait(loop.run_in_executor(pool, extract_pdf_pages, file_content, 0, page_count))
+        for number, text in enumerate(pages, start=1):
+            yield number, text + "\n"
+        return
+
+    # Spool to disk so each page-range task gets a path rather than a copy of the file
+    fd, path = tempfile.mkstemp(suffix=".pdf")
+    with os.fdopen(fd, "wb") as f:
+        f.write(file_content)
+    ranges = [(start, min(start + PDF_PAGES_PER_TASK, page_count)) for start in range(0, page_count, PDF_PAGES_PER_TASK)]
+    pending = deque()
+    try:
+        # Keep one range per worker in flight and yield pages in document order
+        for start, end in ranges:
+            pending.append((start, loop.run_in_executor(pool, extract_pdf_pages, path, start, end)))
+            if len(pending) < EXTRACT_WORKERS:
+                continue
+            first, future = pending.popleft()
+            for offset, text in enumerate(await clock.wait(future)):
+                yield first + offset + 1, text + "\n"
+        while pending:
+            first, future = pending.popleft()
+            for offset, text in enumerate(await clock.wait(future)):
+                yield first + offset + 1, text + "\n"
+    finally:
+        # Drop ranges that have not started yet (timeout, failure or consumer gave up)
+        for _, future in pending:
+            future.cancel()
+        os.unlink(path)
+
+async def _iter_parsed_pages(file_content: bytes, filename: str, kind: str, timeout: float) -> AsyncIterator[Tuple[int, str]]:
+    clock = _ExtractionClock(timeout)
+    loop = asyncio.get_running_loop()
+    try:
+        if kind == "pdf":
+            async for page in _iter_pdf_pages(file_content, clock):
+                yield page
+            return
+        if kind == "docx":
+            paragraphs = await clock.wait(loop.run_in_executor(get_extraction_pool(), extract_docx_paragraphs, file_content))
+            text = "".join(paragraph + "\n" for paragraph in paragraphs)
+        elif kind == "json":
+            text = await clock.wait(asyncio.to_thread(extract_text_from_json, file_content))
+        else:
+            text = await clock.wait(asyncio.to_thread(extract_text_from_txt, file_content))
+        yield 1, text
+    except asyncio.TimeoutError:
+        print(f"[Document Processor] Extraction of {filename} timed out after {timeout}s")
+        raise
+
+async def iter_document_pages(file_content: bytes, filename: str, file_type: str = "", timeout: float = EXTRACT_TIMEOUT) -> AsyncIterator[Tuple[int, str]]:
+    """
+    Yield (page_number, text) as soon as each page is parsed, without blocking
+    the event loop; joining the texts gives the whole document. PDF pages are
+    parsed in page ranges across the shared process pool; DOCX, JSON and TXT
+    yield a single page. PDF and DOCX results are served from / saved to the
+    extracted-text cache by file content hash. Raises asyncio.TimeoutError
+    once more than `timeout` seconds were spent parsing.
+    """
+    kind = detect_file_kind(filename, file_type)
+    if kind not in CACHED_KINDS:
+        async for page in _iter_parsed_pages(file_content, filename, kind, timeout):
+            yield page
+        return
+
+    key = text_cache.key(file_content, kind)
+    cached = await text_cache.get(key)
+    if cached is not None:
+        print(f"[Document Processor] Extracted-text cache hit for {filename}")
+        for number, text in enumerate(cached, start=1):
+            yield number, text
+        return
+
+    pages = []
+    async for number, text in _iter_parsed_pages(file_content, filename, kind, timeout):
+        pages.append(text)
+        yield number, text
+    # Only complete extractions are cached
+    await text_cache.put(key, pages)
+
+async def extract_text_async(file_content: bytes, filename: str, file_type: str = "", timeout: float = EXTRACT_TIMEOUT) -> str:
+    """
+    Whole-document text without blocking the event loop (see iter_document_pages).
+    Raises asyncio.TimeoutError if parsing takes longer than `timeout`.
+    """
+    try:
+        return "".join([text async for _, text in iter_document_pages(file_content, filename, file_type, timeout)])
+    except asyncio.TimeoutError:
+        raise
+    except Exception as e:
+        print(f"Error reading {detect_file_kind(filename, file_type).upper()} {filename}: {e}")
+        return ""
+
 async def process_uploaded_files_api(uploaded_files: List[UploadFile]) -> List[DocumentInfo]:
     """Process uploaded files and extract text content for API"""
     processed_docs = []
@@ -72,18 +241,8 @@ async def process_uploaded_files_api(uploaded_files: List[UploadFile]) -> List[D
                 file_extension = file.filename.split('.')[-1].lower() if '.' in file.filename else 'txt'
                 file_id = str(uuid.uuid4())
                 
-                # Extract text based on file type
-                text = ""
-                if file_extension == 'pdf':
-                    text = extract_text_from_pdf(file_content)
-                elif file_extension == 'docx':
-                    text = extract_text_from_docx(file_content)
-                elif file_extension == 'txt':
-                    text = extract_text_from_txt(file_content)
-                elif file_extension == 'json':
-                    text = extract_text_from_json(file_content)
-                else:
-                    text = extract_text_from_txt(file_content)  # Default fallback
+                # Extract text based on file type (off the event loop)
+                text = await extract_text_async(file_content, file.filename)
                 
                 if text.strip():
                     # Create DocumentInfo object with correct fields
@@ -117,18 +276,8 @@ async def process_knowledge_base_files(uploaded_files: List[UploadFile]) -> List
                 file_extension = file.filename.split('.')[-1].lower() if '.' in file.filename else 'txt'
                 file_id = str(uuid.uuid4())
                 
-                # Extract text based on file type
-                text = ""
-                if file_extension == 'pdf':
-                    text = extract_text_from_pdf(file_content)
-                elif file_extension == 'docx':
-                    text = extract_text_from_docx(file_content)
-                elif file_extension == 'txt':
-                    text = extract_text_from_txt(file_content)
-                elif file_extension == 'json':
-                    text = extract_text_from_json(file_content)
-                else:
-                    text = extract_text_from_txt(file_content)  # Default fallback
+                # Extract text based on file type (off the event loop)
+                text = await extract_text_async(file_content, file.filename)
                 
                 if text.strip():
                     # Create DocumentInfo object with correct fields
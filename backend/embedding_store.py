@@ -0,0 +1,198 @@
+# embedding_store.py
+import os
+import sqlite3
+import hashlib
+import threading
+import time
+import asyncio
+from array import array
+from typing import Any, Dict, List, Sequence
+
+EMBEDDING_STORE_PATH = os.getenv("EMBEDDING_STORE_PATH", "local_storage/embeddings.db")
+EMBEDDING_STORE_MAX_BYTES = int(os.getenv("EMBEDDING_STORE_MAX_BYTES", str(512 * 1024 * 1024)))
+# Evict down to this fraction of the budget so we don't evict on every insert
+EMBEDDING_STORE_LOW_WATERMARK = 0.9
+_SQLITE_MAX_VARS = 500
+
+
+def text_hash(text: str) -> str:
+    """Stable content hash used as the embedding key for a chunk of text."""
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def _pack(vector: Sequence[float]) -> bytes:
+    return array("f", vector).tobytes()
+
+
+def _unpack(blob: bytes) -> List[float]:
+    vec = array("f")
+    vec.frombytes(blob)
+    return vec.tolist()
+
+
+class EmbeddingStore:
+    """
+    Disk-backed, content-addressed embedding store.
+
+    Vectors are keyed by (model, sha256(chunk text)) so the same chunk is only
+    ever embedded once per model, across sessions, re-uploads and restarts.
+    When the stored vectors exceed `max_bytes`, least-recently-used rows are
+    evicted and the freed pages are returned to the filesystem.
+    """
+
+    def __init__(self, path: str = EMBEDDING_STORE_PATH, max_bytes: int = EMBEDDING_STORE_MAX_BYTES):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        # auto_vacuum must be set before the first table is created
+        self._conn.execute("PRAGMA auto_vacuum=INCREMENTAL")
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS embeddings (
+                model TEXT NOT NULL,
+                text_hash TEXT NOT NULL,
+                vector BLOB NOT NULL,
+                nbytes INTEGER NOT NULL,
+                last_used REAL NOT NULL,
+                PRIMARY KEY (model, text_hash)
+            )
+            """
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_embeddings_last_used ON embeddings(last_used)")
+        self._conn.commit()
+        row = self._conn.execute("SELECT COALESCE(SUM(nbytes), 0), COUNT(*) FROM embeddings").fetchone()
+        self._total_bytes = row[0]
+        self._entries = row[1]
+        print(f"[EmbeddingStore] Opened {path} ({self._entries} vectors, {self._total_bytes} bytes)")
+
+    def get_many(self, model: str, hashes: Sequence[str]) -> Dict[str, List[float]]:
+        """Return the cached vectors for the given hashes and mark them as recently used."""
+        found: Dict[str, List[float]] = {}
+        if not hashes:
+            return found
+        now = time.time()
+        with self._lock:
+            for i in range(0, len(hashes), _SQLITE_MAX_VARS):
+                batch = list(hashes[i:i + _SQLITE_MAX_VARS])
+                placeholders = ",".join("?" * len(batch))
+                rows = self._conn.execute(
+                    f"SELECT text_hash, vector FROM embeddings WHERE model = ? AND text_hash IN ({placeholders})",
+                    [model, *batch],
+                ).fetchall()
+                for h, blob in rows:
+                    found[h] = _unpack(blob)
+                if rows:
+                    hit_hashes = [h for h, _ in rows]
+                    self._conn.execute(
+                        f"UPDATE embeddings SET last_used = ? WHERE model = ? AND text_hash IN ({','.join('?' * len(hit_hashes))})",
+                        [now, model, *hit_hashes],
+                    )
+            self._conn.commit()
+        return found
+
+    def put_many(self, model: str, vectors: Dict[str, Sequence[float]]):
+        """Store vectors for the given hashes, evicting old entries if over budget."""
+        if not vectors:
+            return
+        now = time.time()
+        rows = []
+        for h, vec in vectors.items():
+            blob = _pack(vec)
+            rows.append((model, h, blob, len(blob), now))
+        with self._lock:
+            # Account for rows being replaced so the byte total stays exact
+            replaced_bytes = 0
+            replaced_rows = 0
+            for i in range(0, len(rows), _SQLITE_MAX_VARS):
+                batch = [r[1] for r in rows[i:i + _SQLITE_MAX_VARS]]
+                nbytes, count = self._conn.execute(
+                    f"SELECT COALESCE(SUM(nbytes), 0), COUNT(*) FROM embeddings WHERE model = ? AND text_hash IN ({','.join('?' * len(batch))})",
+                    [model, *batch],
+                ).fetchone()
+                replaced_bytes += nbytes
+                replaced_rows += count
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO embeddings (model, text_hash, vector, nbytes, last_used) VALUES (?, ?, ?, ?, ?)",
+                rows,
+            )
+            self._conn.commit()
+            self._total_bytes += sum(r[3] for r in rows) - replaced_bytes
+            self._entries += len(rows) - replaced_rows
+            if self._total_bytes > self.max_bytes:
+                self._evict_locked()
+
+    def _evict_locked(self):
+        target = int(self.max_bytes * EMBEDDING_STORE_LOW_WATERMARK)
+        evicted = 0
+        while self._total_bytes > target:
+            rows = self._conn.execute(
+                "SELECT model, text_hash, nbytes FROM embeddings ORDER BY last_used ASC LIMIT 1000"
+            ).fetchall()
+            if not rows:
+                break
+            freed = 0
+            doomed = []
+            for model, h, nbytes in rows:
+                doomed.append((model, h))
+                freed += nbytes
+                if self._total_bytes - freed <= target:
+                    break
+            self._conn.executemany("DELETE FROM embeddings WHERE model = ? AND text_hash = ?", doomed)
+            self._total_bytes -= freed
+            self._entries -= len(doomed)
+            evicted += len(doomed)
+        self._conn.commit()
+        self._conn.execute("PRAGMA incremental_vacuum")
+        self.evictions += evicted
+        print(f"[EmbeddingStore] Evicted {evicted} vectors, {self._total_bytes} bytes remain")
+
+    async def aembed_documents(self, embedder: Any, model: str, texts: List[str]) -> List[List[float]]:
+        """
+        Drop-in replacement for `embedder.aembed_documents(texts)` that only
+        sends chunks missing from the store to the embedding API.
+        """
+        if not texts:
+            return []
+        hashes = [text_hash(t) for t in texts]
+        unique = list(dict.fromkeys(hashes))
+        cached = await asyncio.to_thread(self.get_many, model, unique)
+
+        missing = [h for h in unique if h not in cached]
+        self.hits += len(unique) - len(missing)
+        self.misses += len(missing)
+
+        if missing:
+            text_by_hash = dict(zip(hashes, texts))
+            new_vectors = await embedder.aembed_documents([text_by_hash[h] for h in missing])
+            fresh = dict(zip(missing, new_vectors))
+            cached.update(fresh)
+            await asyncio.to_thread(self.put_many, model, fresh)
+
+        print(f"[EmbeddingStore] {len(unique) - len(missing)} hits, {len(missing)} misses for {len(texts)} chunks")
+        return [cached[h] for h in hashes]
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            "entries": self._entries,
+            "bytes": self._total_bytes,
+            "max_bytes": self.max_bytes,
+            "evictions": self.evictions,
+        }
+
+
+# Global embedding store instance
+embedding_store = EmbeddingStore()
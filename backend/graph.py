@@ -1,7 +1,8 @@
 from langgraph.graph import StateGraph, END
 from graph_type import GraphState
 from observality import trace_node
-from Orchestrator.Orchestrator import orchestrator, route_decision
+from Orchestrator.Orchestrator import orchestrator, route_decision, normalize_route
+from Orchestrator.parallel_steps import run_parallel_steps
 from Basic_llm.basic_llm import SimpleLLm
 from Rag.Rag import Rag
 from WebSearch.websearch import run_web_search
@@ -17,6 +18,12 @@ from DeepResearch import (
 )
 from DeepResearch.human_approval import human_approval_node
 
+# Plan steps that may run side by side inside the ParallelSteps node
+PARALLEL_NODES = {"RAG": Rag, "WebSearch": run_web_search}
+
+async def parallel_steps(state: GraphState) -> GraphState:
+    return await run_parallel_steps(state, PARALLEL_NODES, normalize_route)
+
 def create_graph():
     g = StateGraph(GraphState)
     g.add_node("orchestrator", trace_node(orchestrator, "orchestrator"))
@@ -24,6 +31,7 @@ def create_graph():
     g.add_node("RAG", trace_node(Rag, "RAG"))
     g.add_node("WebSearch", trace_node(run_web_search, "WebSearch"))
     g.add_node("image", trace_node(generate_image, "image"))
+    g.add_node("ParallelSteps", trace_node(parallel_steps, "ParallelSteps"))
     g.add_node("initialize_deep_research", trace_node(initialize_deep_research, "initialize_deep_research"))
     g.add_node("plan_research", trace_node(plan_research_node, "plan_research"))
     g.add_node("human_approval", human_approval_node)  
@@ -40,6 +48,7 @@ def create_graph():
             "SimpleLLM": "SimpleLLM",
             "WebSearch": "WebSearch",
             "image": "image",
+            "ParallelSteps": "ParallelSteps",
             "deepResearch": "initialize_deep_research",
             "AnswerSynthesizer": "AnswerSynthesizer",
             "END": END
@@ -49,6 +58,7 @@ def create_graph():
     g.add_edge("RAG", "orchestrator")
     g.add_edge("WebSearch", "orchestrator")
     g.add_edge("image", "orchestrator")
+    g.add_edge("ParallelSteps", "orchestrator")
     g.add_edge("initialize_deep_research", "plan_research")
     g.add_edge("AnswerSynthesizer", END)
     
@@ -29,8 +29,11 @@ class GraphState(TypedDict, total=False):
     task_index: Optional[int]
     resolved_query: Optional[str]
     active_docs: Optional[Dict[str, Any]]
-    resolved_queries: Optional[List[Dict[str, Any]]]
+    resolved_queries: Optional[List[Dict[str, Any]]]  # per-step queries of the plan steps run in parallel
+    task_groups: Optional[List[List[int]]]  # plan step indices that may run together, in plan order
+    task_dependencies: Optional[Dict[str, List[str]]]  # analyzer's depends_on: step -> steps whose output it needs
     _chunk_callback: Optional[Callable] 
+    _pending_rewrite: Optional[Any]  # rewrite of the next plan step, computed while the current step runs
     deep_research_state: Optional[Dict[str, Any]]  
     deep_research_query: Optional[str]
     img_urls: Optional[List[str]]  # Add this line for image URLs
@@ -0,0 +1,128 @@
+# http_client.py
+import os
+import asyncio
+from typing import Any, Awaitable, Callable, List, Optional, Sequence
+from urllib.parse import urlparse, unquote
+
+import httpx
+
+HTTP_MAX_CONNECTIONS = int(os.getenv("HTTP_MAX_CONNECTIONS", "100"))
+HTTP_MAX_KEEPALIVE = int(os.getenv("HTTP_MAX_KEEPALIVE", "20"))
+HTTP_KEEPALIVE_EXPIRY = float(os.getenv("HTTP_KEEPALIVE_EXPIRY", "30"))
+HTTP_TIMEOUT = float(os.getenv("HTTP_TIMEOUT", "30"))
+HTTP_HTTP2 = os.getenv("HTTP_HTTP2", "true").lower() == "true"
+
+DOWNLOAD_MAX_BYTES = int(os.getenv("DOWNLOAD_MAX_BYTES", str(50 * 1024 * 1024)))
+# Downloads in flight across the whole process / within one request
+DOWNLOAD_GLOBAL_CONCURRENCY = int(os.getenv("DOWNLOAD_GLOBAL_CONCURRENCY", "32"))
+DOWNLOAD_REQUEST_CONCURRENCY = int(os.getenv("DOWNLOAD_REQUEST_CONCURRENCY", "8"))
+# file:// URLs are only served from inside the local storage fallback directory
+LOCAL_STORAGE_ROOT = os.path.realpath(os.getenv("LOCAL_STORAGE_ROOT", "local_storage"))
+
+_client: Optional[httpx.AsyncClient] = None
+_download_semaphore: Optional[asyncio.Semaphore] = None
+
+
+class DownloadTooLarge(Exception):
+    """Raised when a download exceeds the configured size limit."""
+
+
+class ForbiddenLocalPath(Exception):
+    """Raised when a file:// URL points outside the local storage directory."""
+
+
+def _http2_available() -> bool:
+    if not HTTP_HTTP2:
+        return False
+    try:
+        import h2  # noqa: F401  (httpx[http2])
+        return True
+    except ImportError:
+        print("[HTTP] h2 not installed, falling back to HTTP/1.1")
+        return False
+
+
+def get_http_client() -> httpx.AsyncClient:
+    """Process-wide pooled client (keep-alive, HTTP/2 when available)."""
+    global _client
+    if _client is None or _client.is_closed:
+        _client = httpx.AsyncClient(
+            http2=_http2_available(),
+            limits=httpx.Limits(
+                max_connections=HTTP_MAX_CONNECTIONS,
+                max_keepalive_connections=HTTP_MAX_KEEPALIVE,
+                keepalive_expiry=HTTP_KEEPALIVE_EXPIRY,
+            ),
+            timeout=HTTP_TIMEOUT,
+            follow_redirects=True,
+        )
+    return _client
+
+
+async def close_http_client():
+    global _client
+    if _client is not None:
+        await _client.aclose()
+        _client = None
+
+
+def _global_semaphore() -> asyncio.Semaphore:
+    global _download_semaphore
+    if _download_semaphore is None:
+        _download_semaphore = asyncio.Semaphore(DOWNLOAD_GLOBAL_CONCURRENCY)
+    return _download_semaphore
+
+
+def _local_storage_path(path: str) -> str:
+    # Resolve symlinks and ".." first, so only files really under the storage root are readable
+    real = os.path.realpath(path)
+    if os.path.commonpath([real, LOCAL_STORAGE_ROOT]) != LOCAL_STORAGE_ROOT:
+        raise ForbiddenLocalPath(f"{path} is outside local storage")
+    return real
+
+
+def _read_local_file(path: str, max_bytes: int) -> bytes:
+    path = _local_storage_path(path)
+    if os.path.getsize(path) > max_bytes:
+        raise DownloadTooLarge(f"{path} exceeds {max_bytes} bytes")
+    with open(path, "rb") as f:
+        return f.read()
+
+
+async def download(url: str, max_bytes: int = DOWNLOAD_MAX_BYTES) -> bytes:
+    """
+    Stream `url` into memory through the shared client, aborting as soon as
+    the body exceeds `max_bytes`. `file://` URLs (local storage fallback) are
+    read from disk, but only from inside LOCAL_STORAGE_ROOT.
+    """
+    async with _global_semaphore():
+        parsed = urlparse(url)
+        if parsed.scheme == "file":
+            return await asyncio.to_thread(_read_local_file, unquote(parsed.path), max_bytes)
+
+        async with get_http_client().stream("GET", url) as response:
+            response.raise_for_status()
+            declared = response.headers.get("content-length")
+            if declared and declared.isdigit() and int(declared) > max_bytes:
+                raise DownloadTooLarge(f"{url} is {declared} bytes (limit {max_bytes})")
+            body = bytearray()
+            async for chunk in response.aiter_bytes():
+                body.extend(chunk)
+                if len(body) > max_bytes:
+                    raise DownloadTooLarge(f"{url} exceeds {max_bytes} bytes")
+            return bytes(body)
+
+
+async def gather_bounded(
+    items: Sequence[Any],
+    fn: Callable[[Any], Awaitable[Any]],
+    limit: int = DOWNLOAD_REQUEST_CONCURRENCY,
+) -> List[Any]:
+    """Run `fn` over `items` with at most `limit` in flight; results keep input order."""
+    semaphore = asyncio.Semaphore(max(1, limit))
+
+    async def _run(item):
+        async with semaphore:
+            return await fn(item)
+
+    return await asyncio.gather(*(_run(item) for item in items))
@@ -0,0 +1,303 @@
+# ingest_jobs.py
+import os
+import json
+import time
+import uuid
+import asyncio
+from datetime import datetime
+from typing import Any, Awaitable, Callable, Dict, Iterable, List, Optional
+
+INGEST_WORKERS = int(os.getenv("INGEST_WORKERS", "4"))
+INGEST_QUEUE_BACKEND = os.getenv("INGEST_QUEUE_BACKEND", "memory")  # "memory" or "redis"
+INGEST_REDIS_URL = os.getenv("INGEST_REDIS_URL", os.getenv("REDIS_URL", "redis://localhost:6379/0"))
+# Finished jobs are kept this long so clients can still poll their final status
+INGEST_JOB_TTL = int(os.getenv("INGEST_JOB_TTL", "3600"))
+INGEST_POLL_INTERVAL = 0.25
+# How long a chat that needs pending documents waits for their ingestion
+INGEST_CHAT_WAIT_TIMEOUT = float(os.getenv("INGEST_CHAT_WAIT_TIMEOUT", "120"))
+
+# Job statuses
+QUEUED = "queued"
+RUNNING = "running"
+COMPLETED = "completed"
+FAILED = "failed"
+FINISHED = (COMPLETED, FAILED)
+
+# Per-document stages
+STAGE_QUEUED = "queued"
+STAGE_DOWNLOADING = "downloading"
+STAGE_PARSING = "parsing"
+STAGE_EMBEDDING = "embedding"
+STAGE_READY = "ready"
+STAGE_SKIPPED = "skipped"
+STAGE_FAILED = "failed"
+
+
+def _now() -> str:
+    return datetime.now().isoformat()
+
+
+class InMemoryJobBackend:
+    """In-process queue and job table. Jobs are lost on restart."""
+
+    def __init__(self):
+        self._queue: asyncio.Queue = asyncio.Queue()
+        self._jobs: Dict[str, Dict[str, Any]] = {}
+        self._by_session: Dict[str, List[str]] = {}
+
+    async def enqueue(self, job: Dict[str, Any]):
+        await self.save(job)
+        self._by_session.setdefault(job["session_id"], []).append(job["job_id"])
+        await self._queue.put(job["job_id"])
+
+    async def dequeue(self) -> Optional[Dict[str, Any]]:
+        job_id = await self._queue.get()
+        return self._jobs.get(job_id)
+
+    async def save(self, job: Dict[str, Any]):
+        self._jobs[job["job_id"]] = job
+        self._prune()
+
+    async def load(self, job_id: str) -> Optional[Dict[str, Any]]:
+        return self._jobs.get(job_id)
+
+    async def session_jobs(self, session_id: str) -> List[Dict[str, Any]]:
+        return [self._jobs[j] for j in self._by_session.get(session_id, []) if j in self._jobs]
+
+    def _prune(self):
+        cutoff = time.time() - INGEST_JOB_TTL
+        expired = [
+            job_id for job_id, job in self._jobs.items()
+            if job["status"] in FINISHED and job.get("finished_ts", 0) < cutoff
+        ]
+        for job_id in expired:
+            job = self._jobs.pop(job_id)
+            ids = self._by_session.get(job["session_id"], [])
+            if job_id in ids:
+                ids.remove(job_id)
+            if not ids:
+                self._by_session.pop(job["session_id"], None)
+
+
+class RedisJobBackend:
+    """
+    Redis-backed queue and job table (list + JSON records), usable with a
+    local Redis or any wire-compatible stand-in. Workers still run in-process.
+    """
+
+    def __init__(self, url: str = INGEST_REDIS_URL, prefix: str = "ingest"):
+        import redis.asyncio as redis  # optional dependency
+        self._redis = redis.from_url(url, decode_responses=True)
+        self._prefix = prefix
+
+    def _key(self, *parts: str) -> str:
+        return ":".join((self._prefix, *parts))
+
+    async def enqueue(self, job: Dict[str, Any]):
+        await self.save(job)
+        session_key = self._key("session", job["session_id"])
+        await self._redis.sadd(session_key, job["job_id"])
+        await self._redis.expire(session_key, INGEST_JOB_TTL)
+        await self._redis.rpush(self._key("queue"), job["job_id"])
+
+    async def dequeue(self) -> Optional[Dict[str, Any]]:
+        _, job_id = await self._redis.blpop(self._key("queue"))
+        return await self.load(job_id)
+
+    async def save(self, job: Dict[str, Any]):
+        await self._redis.set(self._key("job", job["job_id"]), json.dumps(job), ex=INGEST_JOB_TTL)
+
+    async def load(self, job_id: str) -> Optional[Dict[str, Any]]:
+        raw = await self._redis.get(self._key("job", job_id))
+        return json.loads(raw) if raw else None
+
+    async def session_jobs(self, session_id: str) -> List[Dict[str, Any]]:
+        job_ids = await self._redis.smembers(self._key("session", session_id))
+        jobs = [await self.load(job_id) for job_id in job_ids]
+        return [job for job in jobs if job]
+
+    async def close(self):
+        await self._redis.aclose()
+
+
+def _create_backend():
+    if INGEST_QUEUE_BACKEND == "redis":
+        try:
+            backend = RedisJobBackend()
+            print(f"[Ingest] Using Redis job backend at {INGEST_REDIS_URL}")
+            return backend
+        except ImportError:
+            print("[Ingest] redis package not installed, falling back to in-memory job backend")
+    return InMemoryJobBackend()
+
+
+JobHandler = Callable[[Dict[str, Any]], Awaitable[None]]
+
+
+class IngestJobManager:
+    """
+    Background document ingestion (download → parse → embed → index).
+
+    `submit` records a job and returns immediately; a pool of asyncio workers
+    runs the registered handler, which reports per-document progress through
+    `set_stage`. Chat requests can `wait_for` a session's pending jobs when
+    they need the documents being ingested.
+
+    Jobs of one session run in submission order only among the workers of one
+    process: with the Redis backend, workers in different processes can take
+    jobs of the same session at the same time.
+    """
+
+    def __init__(self, backend=None, workers: int = INGEST_WORKERS):
+        self.backend = backend or _create_backend()
+        self.workers = workers
+        self._handler: Optional[JobHandler] = None
+        self._tasks: List[asyncio.Task] = []
+        self._done: Dict[str, asyncio.Event] = {}
+        # Jobs of one session run in submission order within this process (a newer user upload replaces an older one)
+        self._session_locks: Dict[str, asyncio.Lock] = {}
+        self._session_lock_users: Dict[str, int] = {}
+
+    def set_handler(self, handler: JobHandler):
+        self._handler = handler
+
+    async def start(self):
+        if self._tasks:
+            return
+        self._tasks = [asyncio.create_task(self._worker(i)) for i in range(self.workers)]
+        print(f"[Ingest] Started {self.workers} ingestion workers")
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        if hasattr(self.backend, "close"):
+            await self.backend.close()
+
+    async def submit(self, session_id: str, doc_type: str, documents: List[Dict[str, Any]]) -> Dict[str, Any]:
+        job_id = str(uuid.uuid4())
+        job = {
+            "job_id": job_id,
+            "session_id": session_id,
+            "doc_type": doc_type,
+            "status": QUEUED,
+            "error": None,
+            "created_at": _now(),
+            "updated_at": _now(),
+            "documents": [
+                {
+                    "id": doc.get("id"),
+                    "filename": doc.get("filename"),
+                    "stage": STAGE_QUEUED,
+                    "chars": None,
+                    "error": None,
+                }
+                for doc in documents
+            ],
+            "payload": documents,
+        }
+        self._done[job_id] = asyncio.Event()
+        await self.backend.enqueue(job)
+        print(f"[Ingest] Queued job {job_id} ({len(documents)} {doc_type} docs) for session {session_id}")
+        return job
+
+    async def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        return await self.backend.load(job_id)
+
+    @staticmethod
+    def public_view(job: Dict[str, Any]) -> Dict[str, Any]:
+        """Job status without the raw request payload."""
+        return {k: v for k, v in job.items() if k not in ("payload", "finished_ts")}
+
+    async def set_stage(self, job: Dict[str, Any], doc_id: Any, stage: str, **fields: Any):
+        for entry in job["documents"]:
+            if entry["id"] == doc_id:
+                entry["stage"] = stage
+                entry.update(fields)
+        job["updated_at"] = _now()
+        await self.backend.save(job)
+
+    async def pending(self, session_id: str, doc_types: Optional[Iterable[str]] = None) -> List[Dict[str, Any]]:
+        """Unfinished jobs of the session, optionally only those of the given document types."""
+        doc_types = None if doc_types is None else set(doc_types)
+        jobs = await self.backend.session_jobs(session_id)
+        for job in jobs:
+            # A worker in another process finished it; release anyone waiting on it here
+            if job["status"] in FINISHED:
+                event = self._done.pop(job["job_id"], None)
+                if event:
+                    event.set()
+        return [
+            job for job in jobs
+            if job["status"] not in FINISHED and (doc_types is None or job["doc_type"] in doc_types)
+        ]
+
+    async def wait_for(self, session_id: str, doc_types: Optional[Iterable[str]], timeout: float) -> bool:
+        """
+        Wait until the session has no unfinished jobs of the given types
+        (any type when `doc_types` is None). Returns False if the timeout
+        expired first.
+        """
+        doc_types = None if doc_types is None else list(doc_types)
+        deadline = time.monotonic() + timeout
+        while True:
+            jobs = await self.pending(session_id, doc_types)
+            if not jobs:
+                return True
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return False
+            # Local workers set the events; a job run by another process only shows up in the
+            # backend, so wake up every poll interval to re-check it
+            events = [self._done.get(job["job_id"]) for job in jobs]
+            slice_timeout = min(INGEST_POLL_INTERVAL, remaining)
+            if all(events):
+                try:
+                    await asyncio.wait_for(asyncio.gather(*(event.wait() for event in events)), slice_timeout)
+                except asyncio.TimeoutError:
+                    pass
+            else:
+                await asyncio.sleep(slice_timeout)
+
+    async def _worker(self, n: int):
+        while True:
+            job = await self.backend.dequeue()
+            if job is None:
+                continue
+            job["status"] = RUNNING
+            job["updated_at"] = _now()
+            await self.backend.save(job)
+            session_id = job["session_id"]
+            lock = self._session_locks.setdefault(session_id, asyncio.Lock())
+            self._session_lock_users[session_id] = self._session_lock_users.get(session_id, 0) + 1
+            try:
+                async with lock:
+                    await self._handler(job)
+                job["status"] = COMPLETED
+            except asyncio.CancelledError:
+                job["status"] = FAILED
+                job["error"] = "cancelled"
+                raise
+            except Exception as e:
+                print(f"[Ingest] Job {job['job_id']} failed: {e}")
+                import traceback
+                traceback.print_exc()
+                job["status"] = FAILED
+                job["error"] = str(e)
+            finally:
+                job["updated_at"] = _now()
+                job["finished_ts"] = time.time()
+                await self.backend.save(job)
+                self._session_lock_users[session_id] -= 1
+                if not self._session_lock_users[session_id]:
+                    del self._session_lock_users[session_id]
+                    del self._session_locks[session_id]
+                event = self._done.pop(job["job_id"], None)
+                if event:
+                    event.set()
+            print(f"[Ingest] Worker {n} finished job {job['job_id']} ({job['status']})")
+
+
+# Global ingestion job manager
+ingest_jobs = IngestJobManager()
@@ -1,42 +1,162 @@
 # llm.py
 import os
+import json
+import asyncio
+import threading
+from typing import Any, Callable, Dict, Tuple
+
+import httpx
 from langchain_openai import ChatOpenAI
 
-def get_reasoning_llm(temperature: float = 0.2):
-    """
-    Returns a ChatOpenAI instance configured to use DeepSeek via OpenRouter.
-    """
+OPENROUTER_BASE_URL = "https://openrouter.ai/api/v1"
+DEFAULT_GEMINI_MODEL = "gemini-2.5-flash-lite"
+LLM_TIMEOUT = float(os.getenv("LLM_TIMEOUT", "120"))
+LLM_MAX_CONNECTIONS = int(os.getenv("LLM_MAX_CONNECTIONS", "100"))
+LLM_MAX_KEEPALIVE = int(os.getenv("LLM_MAX_KEEPALIVE", "20"))
+# Open connections to the providers at startup so the first turns skip the TLS handshake
+LLM_WARMUP = os.getenv("LLM_WARMUP", "true").lower() == "true"
+
+# Clients keyed by (provider, model, temperature, params); every OpenRouter
+# client shares one connection pool
+_CLIENTS: Dict[Tuple[str, str, float, str], Any] = {}
+_CLIENTS_LOCK = threading.Lock()
+_openrouter_http_client = None
+
+
+def _openrouter_headers() -> Dict[str, str]:
+    return {
+        "HTTP-Referer": os.getenv("APP_URL", "http://localhost"),
+        "X-Title": os.getenv("APP_NAME", "My LangGraph App")
+    }
+
+
+def _shared_http_client() -> httpx.AsyncClient:
+    global _openrouter_http_client
+    if _openrouter_http_client is None or _openrouter_http_client.is_closed:
+        _openrouter_http_client = httpx.AsyncClient(
+            limits=httpx.Limits(max_connections=LLM_MAX_CONNECTIONS, max_keepalive_connections=LLM_MAX_KEEPALIVE),
+            timeout=httpx.Timeout(LLM_TIMEOUT, connect=10.0),
+        )
+    return _openrouter_http_client
+
+
+def _build_openrouter(model: str, temperature: float, **params) -> ChatOpenAI:
     return ChatOpenAI(
-        model="deepseek/deepseek-v3.2-exp",   
-        openai_api_base="https://openrouter.ai/api/v1",
+        model=model,  # Pass model name directly to OpenRouter
+        openai_api_base=OPENROUTER_BASE_URL,
         openai_api_key=os.getenv("OPENROUTER_API_KEY"),
         temperature=temperature,
-        max_tokens=6000,
-        default_headers={
-            "HTTP-Referer": os.getenv("APP_URL", "http://localhost"),
-            "X-Title": os.getenv("APP_NAME", "My LangGraph App")
-        }
+        default_headers=_openrouter_headers(),
+        http_async_client=_shared_http_client(),
+        **params
     )
 
+
+def _build_openai(model: str, temperature: float, **params) -> ChatOpenAI:
+    return ChatOpenAI(model=model, temperature=temperature, **params)
+
+
+def _build_google(model: str, temperature: float, **params):
+    from langchain_google_genai import ChatGoogleGenerativeAI
+    return ChatGoogleGenerativeAI(
+        model=model,
+        temperature=temperature,
+        google_api_key=os.getenv("GOOGLE_API_KEY", ""),
+        **params
+    )
+
+
+def _build_groq(model: str, temperature: float, **params):
+    from langchain_groq import ChatGroq
+    return ChatGroq(
+        model=model,
+        temperature=temperature,
+        groq_api_key=os.getenv("GROQ_API_KEY"),
+        **params
+    )
+
+
+_FACTORIES: Dict[str, Callable[..., Any]] = {
+    "openrouter": _build_openrouter,
+    "openai": _build_openai,
+    "google": _build_google,
+    "groq": _build_groq,
+}
+
+
+def get_chat_model(provider: str, model: str, temperature: float, **params):
+    """
+    Shared chat model for (provider, model, temperature, params).
+
+    Instances are created once and reused across requests, so their HTTP
+    clients and connection pools are reused too. Instances are only used
+    through their invoke/stream methods and must not be mutated by callers.
+    """
+    key = (provider, model, float(temperature), json.dumps(params, sort_keys=True, default=str))
+    client = _CLIENTS.get(key)
+    if client is None:
+        with _CLIENTS_LOCK:
+            client = _CLIENTS.get(key)
+            if client is None:
+                client = _CLIENTS[key] = _FACTORIES[provider](model, temperature, **params)
+    return client
+
+
+def get_reasoning_llm(temperature: float = 0.2):
+    """
+    Returns a ChatOpenAI instance configured to use DeepSeek via OpenRouter.
+    """
+    return get_chat_model("openrouter", "deepseek/deepseek-v3.2-exp", temperature, max_tokens=6000)
+
+
 def get_llm(model_name: str, temperature: float = 0.3):
     """
     Get a ChatOpenAI instance for any model via OpenRouter.
-    
+
     Args:
         model_name: Model name from frontend (e.g., 'gpt-4o', 'gpt-5-mini', 'gemini-2.0-flash')
         temperature: Temperature for response generation
-    
+
     Returns:
         ChatOpenAI instance configured for the specified model
     """
-    
-    return ChatOpenAI(
-        model=model_name,  # Pass model name directly to OpenRouter
-        openai_api_base="https://openrouter.ai/api/v1",
-        openai_api_key=os.getenv("OPENROUTER_API_KEY"),
-        temperature=temperature,
-        default_headers={
-            "HTTP-Referer": os.getenv("APP_URL", "http://localhost"),
-            "X-Title": os.getenv("APP_NAME", "My LangGraph App")
-        }
-    )
\ No newline at end of file
+    return get_chat_model("openrouter", model_name, temperature)
+
+
+def get_gemini_llm(temperature: float = 0.3, model: str = DEFAULT_GEMINI_MODEL):
+    """Shared Gemini chat model (used by the orchestrator, web search, synthesis and SimpleLLM)."""
+    return get_chat_model("google", model, temperature)
+
+
+async def warm_up_llm_clients():
+    """Create the clients every turn uses and open the provider connections ahead of the first request."""
+    for build in (lambda: get_gemini_llm(0.3), lambda: get_gemini_llm(0.7), get_reasoning_llm):
+        try:
+            build()
+        except Exception as e:
+            print(f"[LLM] Could not pre-create client: {e}")
+    if not LLM_WARMUP:
+        return
+    tasks = []
+    if os.getenv("OPENROUTER_API_KEY"):
+        tasks.append(_shared_http_client().get(f"{OPENROUTER_BASE_URL}/models", headers=_openrouter_headers()))
+    results = await asyncio.gather(*tasks, return_exceptions=True)
+    for result in results:
+        if isinstance(result, Exception):
+            print(f"[LLM] Warm-up request failed: {result}")
+    print(f"[LLM] Warmed up {len(_CLIENTS)} shared LLM clients")
+
+
+async def close_llm_clients():
+    global _openrouter_http_client
+    _CLIENTS.clear()
+    if _openrouter_http_client is not None:
+        await _openrouter_http_client.aclose()
+        _openrouter_http_client = None
+
+
+def llm_client_stats() -> Dict[str, Any]:
+    return {
+        "clients": len(_CLIENTS),
+        "providers": sorted({key[0] for key in _CLIENTS}),
+    }
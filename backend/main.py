@@ -1,17 +1,26 @@
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Request
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.responses import JSONResponse, StreamingResponse
 from pydantic import BaseModel
 from typing import List, Dict, Any, Optional, Callable
 import asyncio
+from contextlib import aclosing
 import os
 import uuid
 from datetime import datetime
 import json
-import httpx
-from document_processor import extract_text_from_pdf, extract_text_from_docx, extract_text_from_txt, extract_text_from_json
+from http_client import download, gather_bounded, close_http_client
+from document_processor import iter_document_pages, extract_text_from_txt, detect_file_kind, shutdown_extraction_pool
 from graph import graph
 from graph_type import GraphState
+from session_store import session_store, StoredSession
+from session_reaper import session_reaper
+from conversation_summary import conversation_summarizer
+from stream_output import coalesce_chunks, cancel_on_disconnect
+from chat_admission import chat_admission, ChatLease, Overloaded
+from llm import warm_up_llm_clients, close_llm_clients, llm_client_stats
+from prompt_cache import response_cache
+from ingest_jobs import ingest_jobs, INGEST_CHAT_WAIT_TIMEOUT, STAGE_DOWNLOADING, STAGE_PARSING, STAGE_EMBEDDING, STAGE_READY, STAGE_SKIPPED, STAGE_FAILED
 # Remove this import
 # from streaming_graph import StreamingGraph
 
@@ -46,18 +55,39 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# In-memory storage for sessions
-sessions: Dict[str, Dict[str, Any]] = {}
+# Sessions live in the configured session store (SQLite by default, shared by all workers)
+
+@app.on_event("startup")
+async def startup():
+    from Rag.Rag import init_qdrant
+    await init_qdrant()
+    await ingest_jobs.start()
+    await session_reaper.start()
+    await warm_up_llm_clients()
+
+@app.on_event("shutdown")
+async def shutdown():
+    from Rag.Rag import close_qdrant
+    await session_reaper.stop()
+    await conversation_summarizer.stop()
+    await ingest_jobs.stop()
+    await close_qdrant()
+    await close_http_client()
+    await close_llm_clients()
+    shutdown_extraction_pool()
+    session_store.close()
 
 # Initialize streaming graph
 # Remove this line
 # streaming_graph = StreamingGraph()
 
 class SessionManager:
+    """Session access for request handlers; store I/O runs in a worker thread, off the event loop."""
+
     @staticmethod
-    def create_session() -> str:
+    async def create_session() -> str:
         session_id = str(uuid.uuid4())
-        sessions[session_id] = {
+        await asyncio.to_thread(session_store.create, {
             "session_id": session_id,
             "messages": [],
             "uploaded_docs": [],
@@ -65,37 +95,43 @@ class SessionManager:
             "kb": [],
             "gpt_config": None,
             "created_at": datetime.now().isoformat()
-        }
+        })
         return session_id
     
     @staticmethod
-    def get_session(session_id: str) -> Dict[str, Any]:
-        if session_id not in sessions:
+    async def get_session(session_id: str) -> Dict[str, Any]:
+        session = await asyncio.to_thread(session_store.load, session_id)
+        if session is None:
             raise HTTPException(status_code=404, detail="Session not found")
-        return sessions[session_id]
+        session_reaper.touch(session_id)
+        return session
     
     @staticmethod
-    def update_session(session_id: str, updates: Dict[str, Any]):
-        if session_id not in sessions:
-            raise HTTPException(status_code=404, detail="Session not found")
-        sessions[session_id].update(updates)
+    async def update_session(session_id: str, updates: Dict[str, Any]):
+        session = await SessionManager.get_session(session_id)
+        if isinstance(updates, StoredSession):
+            # A session loaded earlier in this request: persist its own changes only
+            session = updates
+        elif updates is not session:
+            session.update(updates)
+        await asyncio.to_thread(session_store.save, session_id, session)
+    
+    @staticmethod
+    async def delete_session(session_id: str) -> bool:
+        session_reaper.forget(session_id)
+        return await asyncio.to_thread(session_store.delete, session_id)
 
 async def fetch_document_content(url: str) -> str:
     """Fetch document content from URL"""
     try:
-        async with httpx.AsyncClient() as client:
-            response = await client.get(url, timeout=30.0)
-            response.raise_for_status()
-            return response.text
+        return extract_text_from_txt(await download(url))
     except Exception as e:
         print(f"Error fetching document from {url}: {e}")
         return ""
 
 async def process_documents_from_urls(documents: List[DocumentInfo]) -> List[Dict[str, Any]]:
-    """Process documents by fetching content from URLs"""
-    processed_docs = []
-    
-    for doc in documents:
+    """Process documents by fetching content from URLs (concurrently, in input order)"""
+    async def process_one(doc: DocumentInfo) -> Optional[Dict[str, Any]]:
         try:
             print(f"Fetching document: {doc.filename} from {doc.file_url}")
             content = await fetch_document_content(doc.file_url)
@@ -110,15 +146,15 @@ async def process_documents_from_urls(documents: List[DocumentInfo]) -> List[Dic
                     "size": doc.size,
                     "doc_type": doc.doc_type
                 }
-                processed_docs.append(processed_doc)
                 print(f"Successfully processed {doc.filename} ({len(content)} chars)")
-            else:
-                print(f"Failed to fetch content for {doc.filename}")
-                
+                return processed_doc
+            print(f"Failed to fetch content for {doc.filename}")
         except Exception as e:
             print(f"Error processing document {doc.filename}: {e}")
+        return None
     
-    return processed_docs
+    results = await gather_bounded(documents, process_one)
+    return [doc for doc in results if doc]
 
 @app.get("/")
 async def root():
@@ -127,18 +163,18 @@ async def root():
 @app.post("/api/sessions", response_model=SessionInfo)
 async def create_session():
     """Create a new chat session"""
-    session_id = SessionManager.create_session()
-    return SessionInfo(session_id=session_id, created_at=sessions[session_id]["created_at"])
+    session_id = await SessionManager.create_session()
+    return SessionInfo(session_id=session_id, created_at=(await SessionManager.get_session(session_id))["created_at"])
 
 @app.get("/api/sessions/{session_id}", response_model=Dict[str, Any])
 async def get_session(session_id: str):
     """Get session information"""
-    return SessionManager.get_session(session_id)
+    return await SessionManager.get_session(session_id)
 
 @app.post("/api/sessions/{session_id}/gpt-config")
 async def set_gpt_config(session_id: str, gpt_config: dict):
     """Set GPT configuration for a session"""
-    session = SessionManager.get_session(session_id)
+    session = await SessionManager.get_session(session_id)
     session["gpt_config"] = gpt_config
     print(f"gpt config..........." , gpt_config)
     
@@ -151,7 +187,8 @@ async def set_gpt_config(session_id: str, gpt_config: dict):
             await preprocess_kb_documents(
                 session["kb"], 
                 session_id, 
-                is_hybrid=hybrid_rag
+                is_hybrid=hybrid_rag,
+                gpt_id=gpt_config.get("gpt_id")
             )
             print(f"✅ [MAIN] Pre-processed KB documents with embeddings")
         except Exception as e:
@@ -159,150 +196,234 @@ async def set_gpt_config(session_id: str, gpt_config: dict):
             import traceback
             traceback.print_exc()
     
-    SessionManager.update_session(session_id, session)
+    await SessionManager.update_session(session_id, session)
     return {"message": "GPT configuration updated", "gpt_config": gpt_config}
 
+async def _ingest_document(job: Dict[str, Any], doc: Dict[str, Any], upload: Optional[Dict[str, Any]] = None) -> Optional[Dict[str, Any]]:
+    """
+    Download and parse one document, reporting its stage on the job. With a
+    streamed `upload`, pages are chunked and embedded as soon as they are parsed.
+    """
+    file_url = doc["file_url"]
+    file_type = doc.get("file_type", "")
+    filename = doc["filename"]
+    try:
+        await ingest_jobs.set_stage(job, doc["id"], STAGE_DOWNLOADING)
+        print(f"Fetching content from URL: {file_url}")
+        file_content = await download(file_url)
+        print(f"Downloaded {len(file_content)} bytes")
+
+        await ingest_jobs.set_stage(job, doc["id"], STAGE_PARSING)
+        kind = detect_file_kind(filename, file_type)
+        print(f"[Document Processor] Processing {kind.upper()}: {filename}")
+        # aclosing: stop parsing (and free the pool) promptly if indexing fails midway
+        async with aclosing(iter_document_pages(file_content, filename, file_type)) as pages:
+            if upload is not None:
+                from Rag.Rag import index_document_pages
+                await ingest_jobs.set_stage(job, doc["id"], STAGE_EMBEDDING)
+                content = await index_document_pages(upload, pages)
+            else:
+                content = "".join([text async for _, text in pages])
+
+        if not content.strip():  # Only add documents with actual content
+            print(f"❌ Skipping document {filename}: No readable content extracted")
+            await ingest_jobs.set_stage(job, doc["id"], STAGE_SKIPPED, error="No readable content extracted")
+            return None
+
+        await ingest_jobs.set_stage(job, doc["id"], STAGE_EMBEDDING, chars=len(content))
+        print(f"✅ Successfully processed document: {filename} ({len(content)} chars)")
+        return {
+            "id": doc["id"],
+            "filename": doc["filename"],
+            "content": content,
+            "file_type": doc["file_type"],
+            "file_url": doc["file_url"],
+            "size": doc["size"]
+        }
+    except asyncio.TimeoutError:
+        print(f"❌ Timed out extracting {filename}")
+        await ingest_jobs.set_stage(job, doc["id"], STAGE_FAILED, error="Text extraction timed out")
+        return None
+    except Exception as e:
+        print(f"❌ Error fetching {filename}: {e}")
+        import traceback
+        traceback.print_exc()
+        await ingest_jobs.set_stage(job, doc["id"], STAGE_FAILED, error=str(e))
+        return None
+
+async def run_ingest_job(job: Dict[str, Any]):
+    """Ingestion worker: download, parse, embed and index a job's documents, then attach them to the session"""
+    with session_reaper.hold(job["session_id"]):
+        await _run_ingest_job(job)
+
+async def _run_ingest_job(job: Dict[str, Any]):
+    session_id = job["session_id"]
+    doc_type = job["doc_type"]
+    documents = job["payload"]
+
+    session = await SessionManager.get_session(session_id)
+    gpt_config = session.get("gpt_config") or {}
+    hybrid_rag = gpt_config.get("hybridRag", False)
+
+    # User documents stream straight from the parser into a fresh index that replaces the old one at the end
+    upload = None
+    if doc_type == "user":
+        from Rag.Rag import begin_user_document_stream
+        upload = await begin_user_document_stream(session_id, is_hybrid=hybrid_rag)
+
+    # Fetch concurrently (bounded per job and globally); results keep upload order
+    try:
+        results = await gather_bounded(documents, lambda doc: _ingest_document(job, doc, upload))
+        processed_docs = [doc for doc in results if doc]
+        print(f"Total processed documents: {len(processed_docs)}")
+        # The session may have been deleted while we were downloading
+        session = await SessionManager.get_session(session_id)
+    except BaseException:
+        if upload is not None:
+            from Rag.Rag import abort_user_document_stream
+            await abort_user_document_stream(upload)
+        raise
+
+    # Embed before attaching, so chats never see documents that are not indexed yet
+    index_error = None
+    try:
+        if doc_type == "user":
+            from Rag.Rag import finish_user_document_stream
+            await finish_user_document_stream(upload, len(processed_docs))
+            print(f"✅ [MAIN] Pre-processed {len(processed_docs)} user documents with embeddings")
+        elif doc_type == "kb":
+            from Rag.Rag import preprocess_kb_documents
+            kb = session["kb"] + processed_docs
+            print(f"[MAIN] Pre-processing KB with {len(kb)} documents for session {session_id}")
+            await preprocess_kb_documents(
+                kb, 
+                session_id, 
+                is_hybrid=hybrid_rag,
+                gpt_id=gpt_config.get("gpt_id")
+            )
+            print(f"✅ [MAIN] Pre-processed KB documents with embeddings")
+    except Exception as e:
+        print(f"⚠️ [MAIN] Warning: Failed to pre-process {doc_type} documents: {e}")
+        import traceback
+        traceback.print_exc()
+        index_error = e
+
+    # Add to session
+    if doc_type == "user":
+        # REPLACE old documents instead of extending
+        session["uploaded_docs"] = processed_docs
+        session["new_uploaded_docs"] = processed_docs
+        print(f"Replaced uploaded_docs with {len(processed_docs)} documents")
+    else:
+        session["kb"].extend(processed_docs)
+        print(f"Added {len(processed_docs)} documents to kb")
+    await SessionManager.update_session(session_id, session)
+    print(f"Session KB docs count after update: {len(session.get('kb', []))}")
+
+    for doc in processed_docs:
+        if index_error:
+            await ingest_jobs.set_stage(job, doc["id"], STAGE_FAILED, error=f"Indexing failed: {index_error}")
+        else:
+            await ingest_jobs.set_stage(job, doc["id"], STAGE_READY)
+    if index_error:
+        raise index_error
+
+ingest_jobs.set_handler(run_ingest_job)
+
 @app.post("/api/sessions/{session_id}/add-documents")
 async def add_documents_by_url(session_id: str, request: dict):
-    """Add documents by URL"""
+    """Queue documents for background ingestion; poll the returned job for progress"""
     print(f"=== ADD DOCUMENTS ENDPOINT CALLED ===")
     print(f"Session ID: {session_id}")
     print(f"Request: {request}")
     
-    session = SessionManager.get_session(session_id)
+    await SessionManager.get_session(session_id)
     
     documents = request.get("documents", [])
     doc_type = request.get("doc_type", "user")
+    if doc_type not in ("user", "kb"):
+        raise HTTPException(status_code=400, detail=f"Unknown doc_type: {doc_type}")
     
     print(f"Documents to process: {len(documents)}")
     print(f"Document type: {doc_type}")
     
-    processed_docs = []
-    for i, doc in enumerate(documents):
-        print(f"Processing document {i+1}: {doc}")
-        file_url = doc["file_url"]
-        file_type = doc.get("file_type", "")
-        filename = doc["filename"]
-    
-        print(f"Fetching content from URL: {file_url}")
-        print(f"File type: {file_type}")
-        # Fetch content from URL
-        try:
-            async with httpx.AsyncClient() as client:
-                print(f"Fetching content from URL: {doc['file_url']}")
-                response = await client.get(doc["file_url"], timeout=30.0)
-                response.raise_for_status()
-                file_content = response.content
-                print(f"Downloaded {len(file_content)} bytes")
-        
-                if file_type == "application/pdf" or filename.lower().endswith('.pdf'):
-                    print(f"[Document Processor] Processing PDF: {filename}")
-                    content = extract_text_from_pdf(file_content)
-                    if not content.strip():
-                        print(f"⚠️ Warning: PDF {filename} appears to be empty or unreadable")
-                elif file_type == "application/vnd.openxmlformats-officedocument.wordprocessingml.document" or filename.lower().endswith('.docx'):
-                    print(f"[Document Processor] Processing DOCX: {filename}")
-                    content = extract_text_from_docx(file_content)
-                    if not content.strip():
-                        print(f"⚠️ Warning: DOCX {filename} appears to be empty or unreadable")
-                elif file_type == "application/json" or filename.lower().endswith('.json'):
-                    print(f"[Document Processor] Processing JSON: {filename}")
-                    content = extract_text_from_json(file_content)
-                    if not content.strip():
-                        print(f"⚠️ Warning: JSON {filename} appears to be empty or unreadable")
-                else:
-                    print(f"[Document Processor] Processing as text: {filename}")
-                    content = extract_text_from_txt(file_content)
-                    if not content.strip():
-                        print(f"⚠️ Warning: Text file {filename} appears to be empty or unreadable")
-                
-                if content.strip():  # Only add documents with actual content
-                    processed_doc = {
-                        "id": doc["id"],
-                        "filename": doc["filename"],
-                        "content": content,
-                        "file_type": doc["file_type"],
-                        "file_url": doc["file_url"],
-                        "size": doc["size"]
-                    }
-                    processed_docs.append(processed_doc)
-                    print(f"✅ Successfully processed document: {doc['filename']} ({len(content)} chars)")
-                else:
-                    print(f"❌ Skipping document {doc['filename']}: No readable content extracted")
-        except Exception as e:
-            print(f"❌ Error fetching {doc['filename']}: {e}")
-            import traceback
-            traceback.print_exc()
-    
-    print(f"Total processed documents: {len(processed_docs)}")
-    
-    # Add to session
-    if doc_type == "user":
-        # REPLACE old documents instead of extending
-        session["uploaded_docs"] = processed_docs
-        session["new_uploaded_docs"] = processed_docs
-        print(f"Replaced uploaded_docs with {len(processed_docs)} documents")
-        
-        # Pre-process embeddings immediately after upload
-        try:
-            from Rag.Rag import preprocess_user_documents, clear_user_doc_cache
-            
-            # Clear old embeddings first
-            clear_user_doc_cache(session_id)
-            print(f"[MAIN] Cleared old user document cache for session {session_id}")
-            
-            # Process only NEW documents
-            hybrid_rag = session.get("gpt_config", {}).get("hybridRag", False)
-            await preprocess_user_documents(
-                processed_docs, 
-                session_id, 
-                is_hybrid=hybrid_rag,
-                is_new_upload=True  # Clear and replace
-            )
-            print(f"✅ [MAIN] Pre-processed {len(processed_docs)} user documents with embeddings")
-        except Exception as e:
-            print(f"⚠️ [MAIN] Warning: Failed to pre-process user documents: {e}")
-            import traceback
-            traceback.print_exc()
-            
-    elif doc_type == "kb":
-        session["kb"].extend(processed_docs)
-        print(f"Added {len(processed_docs)} documents to kb")
-        
-        # Pre-process KB embeddings immediately after upload
-        try:
-            from Rag.Rag import preprocess_kb_documents
-            hybrid_rag = session.get("gpt_config", {}).get("hybridRag", False)
-            print(f"[MAIN] Pre-processing KB with {len(session['kb'])} documents for session {session_id}")
-            await preprocess_kb_documents(
-                session["kb"], 
-                session_id, 
-                is_hybrid=hybrid_rag
-            )
-            print(f"✅ [MAIN] Pre-processed KB documents with embeddings")
-        except Exception as e:
-            print(f"⚠️ [MAIN] Warning: Failed to pre-process KB documents: {e}")
-            import traceback
-            traceback.print_exc()
-    
-    SessionManager.update_session(session_id, session)
-    
-    print(f"Session KB docs count after update: {len(session.get('kb', []))}")
-    
-    return {"message": f"Added {len(processed_docs)} documents", "documents": processed_docs}
+    job = await ingest_jobs.submit(session_id, doc_type, documents)
+    return JSONResponse(
+        status_code=202,
+        content={
+            "message": f"Queued {len(documents)} documents for ingestion",
+            "job_id": job["job_id"],
+            "status": job["status"],
+            "status_url": f"/api/sessions/{session_id}/ingest/{job['job_id']}",
+            "documents": job["documents"]
+        }
+    )
+
+@app.get("/api/sessions/{session_id}/ingest/{job_id}")
+async def get_ingest_job(session_id: str, job_id: str):
+    """Ingestion job status with per-document stages"""
+    job = await ingest_jobs.get(job_id)
+    if not job or job["session_id"] != session_id:
+        raise HTTPException(status_code=404, detail="Ingestion job not found")
+    return ingest_jobs.public_view(job)
 
 @app.get("/api/sessions/{session_id}/documents")
 async def get_documents(session_id: str):
     """Get all documents for a session"""
-    session = SessionManager.get_session(session_id)
+    session = await SessionManager.get_session(session_id)
     return {
         "uploaded_docs": session["uploaded_docs"],
         "kb": session["kb"]
     }
 
+@app.delete("/api/sessions/{session_id}/documents/{doc_id}")
+async def remove_kb_document(session_id: str, doc_id: str):
+    """Remove a KB document and drop only its points from the KB index"""
+    session = await SessionManager.get_session(session_id)
+    remaining = [doc for doc in session["kb"] if doc.get("id") != doc_id]
+    if len(remaining) == len(session["kb"]):
+        raise HTTPException(status_code=404, detail="Document not found")
+    session["kb"] = remaining
+    
+    try:
+        from Rag.Rag import preprocess_kb_documents, release_kb_collection
+        gpt_config = session.get("gpt_config") or {}
+        if remaining:
+            await preprocess_kb_documents(
+                remaining,
+                session_id,
+                is_hybrid=gpt_config.get("hybridRag", False),
+                gpt_id=gpt_config.get("gpt_id")
+            )
+        else:
+            await release_kb_collection(session_id)
+    except Exception as e:
+        print(f"⚠️ [MAIN] Warning: Failed to update KB index after removal: {e}")
+        import traceback
+        traceback.print_exc()
+    
+    await SessionManager.update_session(session_id, session)
+    return {"message": f"Removed document {doc_id}", "kb_count": len(remaining)}
+
 @app.post("/api/sessions/{session_id}/chat/stream")
-async def stream_chat(session_id: str, request: ChatRequest):
+async def stream_chat(session_id: str, request: ChatRequest, http_request: Request):
     """Stream chat response"""
+    # One request per session at a time, and a bounded number of graphs overall
+    try:
+        lease = await chat_admission.admit(session_id)
+    except Overloaded as e:
+        raise HTTPException(
+            status_code=429,
+            detail=f"Server busy: {e.reason}",
+            headers={"Retry-After": str(e.retry_after)}
+        )
+    try:
+        return await _stream_chat(session_id, request, http_request, lease)
+    except BaseException:
+        lease.release()
+        raise
+
+async def _stream_chat(session_id: str, request: ChatRequest, http_request: Request, lease: ChatLease):
     print("=== STREAMING CHAT ENDPOINT CALLED ===")
     print(f"Session ID: {session_id}")
     print(f"Request message: {request.message}")
@@ -311,9 +432,28 @@ async def stream_chat(session_id: str, request: ChatRequest):
     print(f"Deep search enabled: {request.deep_search}")
     print(f"Uploaded doc: {request.uploaded_doc}")
     
-    session = SessionManager.get_session(session_id)
+    session = await SessionManager.get_session(session_id)
     print(f"Previous last_route in session: {session.get('last_route')}")  # <--- ADD THIS LINE
     
+    # Any turn may be routed to RAG, so wait for whatever the session is still ingesting
+    # (the request's rag flag only mirrors hybridRag and says nothing about the KB)
+    pending_jobs = await ingest_jobs.pending(session_id)
+    if pending_jobs:
+        print(f"[MAIN] Waiting for {len(pending_jobs)} pending ingestion jobs of session {session_id}")
+        if not await ingest_jobs.wait_for(session_id, None, INGEST_CHAT_WAIT_TIMEOUT):
+            print(f"⚠️ [MAIN] Ingestion still running after {INGEST_CHAT_WAIT_TIMEOUT}s, answering with indexed documents only")
+    # Indexes may have been evicted while the session was idle (or built by another worker).
+    # Follow-up turns send uploaded_doc=false and rag=hybridRag, so go by what the session holds;
+    # indexes that are already loaded are skipped.
+    restore_doc_types = [t for t, key in (("user", "uploaded_docs"), ("kb", "kb")) if session.get(key)]
+    if restore_doc_types:
+        try:
+            from Rag.Rag import restore_session_indexes
+            with session_reaper.hold(session_id):
+                await restore_session_indexes(session, restore_doc_types)
+        except Exception as e:
+            print(f"⚠️ [MAIN] Warning: Failed to restore RAG indexes for session {session_id}: {e}")
+    
     # Add user message to session
     session["messages"].append({"role": "user", "content": request.message})
     print(f"Added user message to session. Total messages: {len(session['messages'])}")
@@ -330,7 +470,7 @@ async def stream_chat(session_id: str, request: ChatRequest):
             "instruction": "You are a helpful AI assistant."
         }
         session["gpt_config"] = gpt_config
-        SessionManager.update_session(session_id, session)
+        await SessionManager.update_session(session_id, session)
     
     llm_model = gpt_config.get("model", "gpt-4o-mini")
     print(f"=== GPT CONFIG ===")
@@ -348,23 +488,18 @@ async def stream_chat(session_id: str, request: ChatRequest):
                 if isinstance(doc, dict) and doc.get("content"):
                     uploaded_docs_content.append(doc["content"])
         
+        # KB content is searched through the pre-built index; pass the stored documents
+        # as-is so their (lazily loaded) content is not read on every chat
         kb_docs_structured = []
         if session.get("kb"):
             for doc in session["kb"]:
-                if isinstance(doc, dict) and doc.get("content"):
-                    kb_docs_structured.append({
-                        "id": doc.get("id"),
-                        "filename": doc.get("filename"),
-                        "content": doc["content"],
-                        "file_type": doc.get("file_type"),
-                        "size": doc.get("size")
-                    })
+                if isinstance(doc, dict) and "content" in doc:
+                    kb_docs_structured.append(doc)
         
         print(f"=== DOCUMENT CONTENT ===")
         print(f"Uploaded docs count: {len(uploaded_docs_content)}")
         print(f"KB docs count: {len(kb_docs_structured)}")
         print(f"Uploaded docs content length: {sum(len(doc) for doc in uploaded_docs_content)}")
-        print(f"KB docs content length: {sum(len(doc) for doc in kb_docs_structured)}")
         new_uploaded_docs_content = []
         if session.get("new_uploaded_docs"):
             for doc in session["new_uploaded_docs"]:
@@ -374,23 +509,14 @@ async def stream_chat(session_id: str, request: ChatRequest):
         # Create the chunk callback first
         queue = asyncio.Queue()
         full_response = ""
+        response_parts: List[str] = []
+        delta_protocol = (request.stream_protocol or 1) >= 2
         
         async def chunk_callback(chunk_content: str):
-            nonlocal full_response
-            full_response += chunk_content
+            response_parts.append(chunk_content)
             # print(f"🔥 DIRECT CHUNK CALLBACK: {chunk_content[:50]}...")
-            
-            # Add a small delay to make streaming smoother
-            await asyncio.sleep(0.05)  # 50ms delay between chunks
-            
-            await queue.put({
-                "type": "content",
-                "data": {
-                    "content": chunk_content,
-                    "full_response": full_response,
-                    "is_complete": False
-                }
-            })
+            # Frames are paced by coalesce_chunks on the way out, not here
+            await queue.put({"type": "content", "data": {"content": chunk_content, "is_complete": False}})
         
         # Create the state with the chunk callback already set
         state = GraphState(
@@ -429,7 +555,27 @@ async def stream_chat(session_id: str, request: ChatRequest):
         print(f"Deep search: {state.get('deep_search', False)}")
         print(f"Last route: {state.get('last_route')}")  # <--- ADD THIS LINE
         
+        seq = 0
+
+        def sse_frame(payload: Dict[str, Any]) -> str:
+            # Protocol 2 numbers every frame so clients can detect gaps
+            nonlocal seq
+            if delta_protocol:
+                seq += 1
+                payload = {"seq": seq, **payload}
+            return f"data: {json.dumps(payload)}\n\n"
+        
+        def record_run(status: str):
+            session["last_run"] = {
+                "status": status,
+                "finished_at": datetime.now().isoformat(),
+                "response_chars": sum(len(part) for part in response_parts)
+            }
+        
         async def generate_stream():
+            nonlocal full_response
+            graph_task = None
+            disconnect_watcher = None
             try:
                 print("=== STARTING DIRECT GRAPH STREAMING ===")
                 
@@ -444,6 +590,15 @@ async def stream_chat(session_id: str, request: ChatRequest):
                             print(f"🔥 NODE RESULT: {list(node_result.keys())}")
                             # Capture the final state from the last node result
                             final_state = node_result
+                    except asyncio.CancelledError:
+                        # Cancellation reaches every node task, LLM stream and HTTP call awaited below us
+                        print(f"[MAIN] Graph cancelled for session {session_id}: client disconnected")
+                        record_run("cancelled")
+                        try:
+                            await SessionManager.update_session(session_id, session)
+                        except HTTPException:
+                            pass  # session deleted meanwhile
+                        raise
                     except Exception as e:
                         print(f"--- ERROR in direct graph execution: {e}")
                         await queue.put({
@@ -455,22 +610,27 @@ async def stream_chat(session_id: str, request: ChatRequest):
                         await queue.put(None)  # Signal completion
                 
                 async def consume_and_yield():
-                    while True:
-                        item = await queue.get()
-                        if item is None:
-                            break
+                    streamed = ""
+                    async for item in coalesce_chunks(queue):
                         if item.get("type") == "error":
                             raise Exception(item["data"]["error"])
+                        if item.get("type") == "content" and not delta_protocol:
+                            # Protocol 1 repeats the accumulated text in every frame
+                            streamed += item["data"]["content"]
+                            item["data"]["full_response"] = streamed
                         
                         # print(f"🔥 YIELDING DIRECT CHUNK: {item.get('data', {}).get('content', '')[:50]}...")
                         yield item
                 
                 graph_task = asyncio.create_task(run_graph())
+                disconnect_watcher = asyncio.create_task(cancel_on_disconnect(http_request, graph_task))
                 async for chunk in consume_and_yield():
-                    chunk_data = json.dumps(chunk)
-                    yield f"data: {chunk_data}\n\n"
+                    yield sse_frame(chunk)
                 
-                await graph_task
+                await asyncio.wait([graph_task])
+                if graph_task.cancelled():
+                    return  # nobody is listening anymore
+                full_response = "".join(response_parts)
                 
                 # Use the final state from graph execution instead of the original state
                 if final_state:
@@ -498,8 +658,9 @@ async def stream_chat(session_id: str, request: ChatRequest):
                 }
                 
                 print(f"🔥 Final chunk img_urls: {final_chunk['data']['img_urls']}")
-                yield f"data: {json.dumps(final_chunk)}\n\n"
+                yield sse_frame(final_chunk)
                 
+                record_run("completed")
                 if full_response:
                     session["messages"].append({"role": "assistant", "content": full_response})
                     
@@ -507,36 +668,46 @@ async def stream_chat(session_id: str, request: ChatRequest):
                     if state.get("img_urls"):
                         session["img_urls"] = state.get("img_urls", [])
                     
-                    SessionManager.update_session(session_id, session)
-                if state.get("context", {}).get("session", {}).get("summary"):
-                    session["summary"] = state["context"]["session"]["summary"]
-
+                    await SessionManager.update_session(session_id, session)
                 if state.get("context", {}).get("session", {}).get("last_route"):
                     session["last_route"] = state["context"]["session"]["last_route"]
 
                 # Update session with context data
                 if state.get("context", {}).get("session"):
-                    SessionManager.update_session(session_id, session)
+                    await SessionManager.update_session(session_id, session)
                 # Always update last_route, even if response is empty
                 if state.get("route"):
                     session["last_route"] = state["route"]
-                    SessionManager.update_session(session_id, session)
+                    await SessionManager.update_session(session_id, session)
+                # Fold older turns into the summary without holding up the response
+                conversation_summarizer.schedule(session_id, session)
                 
-                yield f"data: {json.dumps({'type': 'done', 'data': {'session_id': session_id}})}\n\n"
+                yield sse_frame({'type': 'done', 'data': {'session_id': session_id}})
                 
             except Exception as e:
                 print(f"=== ERROR IN DIRECT STREAM GENERATION ===")
                 print(f"Error: {str(e)}")
                 import traceback
                 traceback.print_exc()
-                error_chunk = json.dumps({
+                record_run("failed")
+                try:
+                    await SessionManager.update_session(session_id, session)
+                except HTTPException:
+                    pass
+                yield sse_frame({
                     "type": "error",
                     "data": {"error": str(e)}
                 })
-                yield f"data: {error_chunk}\n\n"
+            finally:
+                # Also reached when the server closes or cancels the stream after a disconnect
+                if disconnect_watcher is not None:
+                    disconnect_watcher.cancel()
+                if graph_task is not None and not graph_task.done():
+                    graph_task.cancel()
+                lease.release()
         
         return StreamingResponse(
-            generate_stream(),
+            session_reaper.held_stream(session_id, generate_stream()),
             
             
             media_type="text/event-stream", 
@@ -546,6 +717,7 @@ async def stream_chat(session_id: str, request: ChatRequest):
                 "Connection": "keep-alive",
                 "Access-Control-Allow-Origin": "*",
                 "Access-Control-Allow-Headers": "*",
+                "X-Stream-Protocol": "2" if delta_protocol else "1",
             }
         )
     except Exception as e:
@@ -558,9 +730,13 @@ async def stream_chat(session_id: str, request: ChatRequest):
 @app.delete("/api/sessions/{session_id}")
 async def delete_session(session_id: str):
     """Delete a session"""
-    if session_id not in sessions:
+    if not await SessionManager.delete_session(session_id):
         raise HTTPException(status_code=404, detail="Session not found")
-    del sessions[session_id]
+    try:
+        from Rag.Rag import release_session_indexes
+        await release_session_indexes(session_id)
+    except Exception as e:
+        print(f"⚠️ [MAIN] Warning: Failed to release RAG resources for session {session_id}: {e}")
     return {"message": "Session deleted successfully"}
 
 @app.get("/api/health")
@@ -572,6 +748,29 @@ async def health_check():
         "timestamp": datetime.now().isoformat()
     }
 
+@app.get("/api/metrics")
+async def metrics():
+    """Cache and pipeline metrics"""
+    from embedding_store import embedding_store
+    from query_embedding_cache import query_embedding_cache
+    from text_cache import text_cache
+    from answer_cache import answer_cache
+    from Orchestrator.router import tiered_router
+    return {
+        "embedding_store": embedding_store.stats(),
+        "query_embedding_cache": query_embedding_cache.stats(),
+        "extracted_text_cache": text_cache.stats(),
+        "session_store": session_store.stats(),
+        "memory": await session_reaper.stats(),
+        "chat_admission": chat_admission.stats(),
+        "llm_clients": llm_client_stats(),
+        "llm_response_cache": response_cache.stats(),
+        "answer_cache": answer_cache.stats(),
+        "router": tiered_router.stats(),
+        "conversation_summary": conversation_summarizer.stats(),
+        "timestamp": datetime.now().isoformat()
+    }
+
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run(app, host="0.0.0.0", port=8000)
\ No newline at end of file
@@ -13,6 +13,8 @@ class ChatRequest(BaseModel):
     rag: Optional[bool] = False  # Add RAG toggle
     deep_search: Optional[bool] = False  # Add deep search toggle
     uploaded_doc: Optional[bool] = False  # Add uploaded doc indicator
+    # 1: every frame repeats the full text so far; 2: delta-only frames with "seq", full text in the completion frame
+    stream_protocol: Optional[int] = 1
 
 class ChatResponse(BaseModel):
     message: str
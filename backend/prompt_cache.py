@@ -1,6 +1,20 @@
 # prompt_cache.py
+import os
+import time
+import asyncio
 import hashlib
-from typing import List
+from collections import OrderedDict
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from langchain_core.messages import AIMessage, BaseMessage
+
+LLM_RESPONSE_CACHE_SIZE = int(os.getenv("LLM_RESPONSE_CACHE_SIZE", "4096"))
+LLM_RESPONSE_CACHE_TTL = float(os.getenv("LLM_RESPONSE_CACHE_TTL", "600"))
+# Nodes whose LLM calls may be answered from the cache (comma-separated; empty disables it)
+LLM_RESPONSE_CACHE_NODES = {
+    n.strip() for n in os.getenv("LLM_RESPONSE_CACHE_NODES", "router,query_rewrite,source_selection,followup_judge").split(",")
+    if n.strip()
+}
 
 def normalize_prefix(parts: List[str]) -> str:
     """Joins multiple static prompt parts and cleans whitespace for stable caching."""
@@ -11,3 +25,98 @@ def normalize_prefix(parts: List[str]) -> str:
 def cache_key(model: str, prefix: str) -> str:
     """Creates a stable hash key for a given model + system prefix."""
     return f"{model}:{hashlib.sha256(prefix.encode('utf-8')).hexdigest()[:16]}"
+
+def prompt_key(model: str, messages: List[BaseMessage]) -> str:
+    """Cache key for a whole prompt: model plus every message's role and normalized text."""
+    return cache_key(model, normalize_prefix([f"[{m.type}]\n{m.content}" for m in messages]))
+
+
+class ResponseCache:
+    """
+    Exact-match LRU/TTL cache of LLM responses, keyed by model and the
+    normalized prompt. Meant for deterministic classification-style calls
+    (routing, query rewriting, source selection), which are opted in per node
+    through LLM_RESPONSE_CACHE_NODES. Concurrent identical calls share one
+    request, like QueryEmbeddingCache.
+    """
+
+    def __init__(self, max_entries: int = LLM_RESPONSE_CACHE_SIZE, ttl_seconds: float = LLM_RESPONSE_CACHE_TTL, nodes=None):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.nodes = set(LLM_RESPONSE_CACHE_NODES if nodes is None else nodes)
+        self.hits: Dict[str, int] = {}
+        self.misses: Dict[str, int] = {}
+        self.coalesced = 0
+        self._entries: "OrderedDict[str, Tuple[float, str]]" = OrderedDict()
+        self._inflight: Dict[str, asyncio.Task] = {}
+
+    def _get(self, key: str) -> Optional[str]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        expires_at, content = entry
+        if expires_at < time.monotonic():
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return content
+
+    def _put(self, key: str, content: str):
+        self._entries[key] = (time.monotonic() + self.ttl_seconds, content)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    async def _fetch(self, llm: Any, messages: List[BaseMessage], key: str, validate: Optional[Callable[[str], bool]]) -> str:
+        try:
+            result = await llm.ainvoke(messages)
+            content = result.content if isinstance(result.content, str) else str(result.content)
+            # Empty or unusable answers are not worth replaying
+            if content.strip() and (validate is None or validate(content)):
+                self._put(key, content)
+            return content
+        finally:
+            self._inflight.pop(key, None)
+
+    async def ainvoke(self, node: str, model: str, llm: Any, messages: List[BaseMessage],
+                      validate: Optional[Callable[[str], bool]] = None) -> AIMessage:
+        """
+        `llm.ainvoke(messages)` through the cache when `node` is opted in.
+        `model` should identify everything that changes the answer besides
+        the prompt (model name, temperature). Only responses that pass
+        `validate` are cached.
+        """
+        if node not in self.nodes:
+            return await llm.ainvoke(messages)
+        key = prompt_key(model, messages)
+        content = self._get(key)
+        if content is not None:
+            self.hits[node] = self.hits.get(node, 0) + 1
+            return AIMessage(content=content)
+        task = self._inflight.get(key)
+        if task is None:
+            self.misses[node] = self.misses.get(node, 0) + 1
+            task = self._inflight[key] = asyncio.create_task(self._fetch(llm, messages, key, validate))
+        else:
+            self.coalesced += 1
+        return AIMessage(content=await asyncio.shield(task))
+
+    def stats(self) -> Dict[str, Any]:
+        hits = sum(self.hits.values())
+        lookups = hits + sum(self.misses.values())
+        return {
+            "entries": len(self._entries),
+            "hits": hits,
+            "misses": lookups - hits,
+            "hit_rate": round(hits / lookups, 4) if lookups else 0.0,
+            "coalesced": self.coalesced,
+            "by_node": {
+                node: {"hits": self.hits.get(node, 0), "misses": self.misses.get(node, 0)}
+                for node in sorted(set(self.hits) | set(self.misses))
+            },
+            "nodes": sorted(self.nodes),
+        }
+
+
+# Global LLM response cache instance
+response_cache = ResponseCache()
@@ -0,0 +1,92 @@
+# query_embedding_cache.py
+import os
+import time
+import asyncio
+from collections import OrderedDict
+from typing import Any, Dict, List, Tuple
+
+QUERY_EMBEDDING_CACHE_SIZE = int(os.getenv("QUERY_EMBEDDING_CACHE_SIZE", "2048"))
+QUERY_EMBEDDING_CACHE_TTL = float(os.getenv("QUERY_EMBEDDING_CACHE_TTL", "3600"))
+
+
+class QueryEmbeddingCache:
+    """
+    Process-wide LRU/TTL cache for query embeddings.
+
+    Concurrent requests for the same (model, query) share a single embedding
+    call: the first caller starts it and everyone else awaits the same task.
+    The task is shielded, so a cancelled caller does not cancel the others.
+    """
+
+    def __init__(self, max_entries: int = QUERY_EMBEDDING_CACHE_SIZE, ttl_seconds: float = QUERY_EMBEDDING_CACHE_TTL):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self._entries: "OrderedDict[Tuple[str, str], Tuple[float, List[float]]]" = OrderedDict()
+        self._inflight: Dict[Tuple[str, str], asyncio.Task] = {}
+
+    def _get(self, key: Tuple[str, str]):
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        expires_at, vector = entry
+        if expires_at < time.monotonic():
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return vector
+
+    def _put(self, key: Tuple[str, str], vector: List[float]):
+        self._entries[key] = (time.monotonic() + self.ttl_seconds, vector)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    async def _fetch(self, embedder: Any, key: Tuple[str, str]) -> List[float]:
+        try:
+            vector = await embedder.aembed_query(key[1])
+            self._put(key, vector)
+            return vector
+        finally:
+            self._inflight.pop(key, None)
+
+    async def aembed_query(self, embedder: Any, model: str, query: str) -> List[float]:
+        """Cached, coalesced replacement for `embedder.aembed_query(query)`."""
+        key = (model, query.strip())
+        vector = self._get(key)
+        if vector is not None:
+            self.hits += 1
+            return vector
+
+        task = self._inflight.get(key)
+        if task is not None:
+            self.coalesced += 1
+        else:
+            self.misses += 1
+            task = asyncio.create_task(self._fetch(embedder, key))
+            # Consume the exception if every waiter was cancelled
+            task.add_done_callback(lambda t: t.cancelled() or t.exception())
+            self._inflight[key] = task
+        return await asyncio.shield(task)
+
+    def clear(self):
+        self._entries.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses + self.coalesced
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "coalesced": self.coalesced,
+            "hit_rate": round((self.hits + self.coalesced) / lookups, 4) if lookups else 0.0,
+            "entries": len(self._entries),
+            "inflight": len(self._inflight),
+            "max_entries": self.max_entries,
+            "ttl_seconds": self.ttl_seconds,
+        }
+
+
+# Global query embedding cache instance
+query_embedding_cache = QueryEmbeddingCache()
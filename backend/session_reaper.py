@@ -0,0 +1,168 @@
+# session_reaper.py
+import os
+import time
+import asyncio
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Any, AsyncIterator, Dict, Optional
+
+from session_store import session_store, session_nbytes
+
+# Sessions untouched for this long are evicted from memory
+SESSION_IDLE_TTL = float(os.getenv("SESSION_IDLE_TTL", "3600"))
+# Budget for loaded sessions plus their RAG indexes; least recently used sessions go first
+MEMORY_BUDGET_BYTES = int(os.getenv("MEMORY_BUDGET_BYTES", str(2 * 1024 * 1024 * 1024)))
+REAPER_INTERVAL = float(os.getenv("REAPER_INTERVAL", "60"))
+
+
+class SessionReaper:
+    """
+    Background eviction of idle and least-recently-used sessions.
+
+    Every REAPER_INTERVAL seconds, sessions idle for longer than the TTL are
+    evicted, then LRU sessions are evicted until the estimated memory of
+    loaded sessions and RAG indexes fits the budget. Evicting a session drops
+    its user-document collection, detaches it from its shared KB collection
+    (collected once unused), removes its BM25 indexes and unloads it from the
+    session store. With the SQLite store the session itself survives and its
+    indexes are rebuilt on the next chat that needs them.
+
+    Sessions with a chat stream or ingestion job in flight are never evicted.
+    """
+
+    def __init__(self, idle_ttl: float = SESSION_IDLE_TTL, memory_budget: int = MEMORY_BUDGET_BYTES, interval: float = REAPER_INTERVAL):
+        self.idle_ttl = idle_ttl
+        self.memory_budget = memory_budget
+        self.interval = interval
+        self._last_access: "OrderedDict[str, float]" = OrderedDict()
+        self._active: Dict[str, int] = {}
+        self._task: Optional[asyncio.Task] = None
+        self._reap_lock = asyncio.Lock()
+        self.evicted_idle = 0
+        self.evicted_budget = 0
+        self.runs = 0
+
+    def touch(self, session_id: str):
+        self._last_access[session_id] = time.monotonic()
+        self._last_access.move_to_end(session_id)
+
+    def forget(self, session_id: str):
+        self._last_access.pop(session_id, None)
+
+    @contextmanager
+    def hold(self, session_id: str):
+        """Keep a session from being evicted while work on it is in flight."""
+        self.touch(session_id)
+        self._active[session_id] = self._active.get(session_id, 0) + 1
+        try:
+            yield
+        finally:
+            self._active[session_id] -= 1
+            if not self._active[session_id]:
+                del self._active[session_id]
+            self.touch(session_id)
+
+    async def held_stream(self, session_id: str, stream: AsyncIterator[Any]) -> AsyncIterator[Any]:
+        """Wrap a response stream so its session is held until the stream ends."""
+        with self.hold(session_id):
+            try:
+                async for item in stream:
+                    yield item
+            finally:
+                await stream.aclose()
+
+    async def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._loop())
+            print(f"[Reaper] Started (idle TTL {self.idle_ttl:.0f}s, budget {self.memory_budget} bytes, every {self.interval:.0f}s)")
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    async def _loop(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.reap()
+            except Exception as e:
+                print(f"[Reaper] Reap failed: {e}")
+
+    async def _usage(self) -> Dict[str, Any]:
+        from Rag.Rag import rag_memory_usage
+        rag = await rag_memory_usage()
+        resident = session_store.resident()
+        session_bytes = {sid: session_nbytes(session) for sid, session in resident.items()}
+        per_session = dict(rag["sessions"])
+        for sid, nbytes in session_bytes.items():
+            per_session[sid] = per_session.get(sid, 0) + nbytes
+        caches = {"sessions": {"count": len(session_bytes), "bytes": sum(session_bytes.values())}}
+        caches.update(rag["caches"])
+        return {
+            "caches": caches,
+            "per_session": per_session,
+            "total_bytes": caches["sessions"]["bytes"] + rag["total_bytes"],
+        }
+
+    async def evict(self, session_id: str, reason: str):
+        from Rag.Rag import release_session_indexes
+        try:
+            await release_session_indexes(session_id)
+        except Exception as e:
+            print(f"[Reaper] Failed to release indexes of session {session_id}: {e}")
+        session_store.evict(session_id)
+        self.forget(session_id)
+        print(f"[Reaper] Evicted session {session_id} ({reason})")
+
+    async def reap(self) -> Dict[str, Any]:
+        async with self._reap_lock:
+            self.runs += 1
+            usage = await self._usage()
+            now = time.monotonic()
+            # Sessions loaded or indexed without going through SessionManager start their clock now
+            for sid in usage["per_session"]:
+                if sid not in self._last_access:
+                    self._last_access[sid] = now
+
+            idle = [
+                sid for sid, last in self._last_access.items()
+                if now - last > self.idle_ttl and sid not in self._active
+            ]
+            for sid in idle:
+                await self.evict(sid, "idle")
+                self.evicted_idle += 1
+
+            total = usage["total_bytes"] - sum(usage["per_session"].get(sid, 0) for sid in idle)
+            if total > self.memory_budget:
+                for sid in list(self._last_access):
+                    if total <= self.memory_budget:
+                        break
+                    nbytes = usage["per_session"].get(sid, 0)
+                    if not nbytes or sid in self._active:
+                        continue
+                    total -= nbytes
+                    await self.evict(sid, "memory budget")
+                    self.evicted_budget += 1
+            if total > self.memory_budget:
+                print(f"[Reaper] Still over budget after eviction ({total} > {self.memory_budget} bytes)")
+            return {"evicted_idle": len(idle), "estimated_bytes": total}
+
+    async def stats(self) -> Dict[str, Any]:
+        usage = await self._usage()
+        return {
+            "caches": usage["caches"],
+            "total_bytes": usage["total_bytes"],
+            "memory_budget": self.memory_budget,
+            "idle_ttl": self.idle_ttl,
+            "tracked_sessions": len(self._last_access),
+            "active_sessions": len(self._active),
+            "evicted_idle": self.evicted_idle,
+            "evicted_budget": self.evicted_budget,
+            "runs": self.runs,
+        }
+
+
+# Global session reaper instance
+session_reaper = SessionReaper()
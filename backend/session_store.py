@@ -0,0 +1,531 @@
+# session_store.py
+import os
+import json
+import time
+import hashlib
+import sqlite3
+import threading
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from embedding_store import text_hash
+
+SESSION_BACKEND = os.getenv("SESSION_BACKEND", "sqlite")  # "sqlite" or "memory"
+SESSION_DB_PATH = os.getenv("SESSION_DB_PATH", "local_storage/sessions.db")
+# Message appends are written behind, at most this many seconds after the request
+SESSION_FLUSH_INTERVAL = float(os.getenv("SESSION_FLUSH_INTERVAL", "0.5"))
+SESSION_FLUSH_MAX_PENDING = int(os.getenv("SESSION_FLUSH_MAX_PENDING", "500"))
+
+MESSAGES = "messages"
+DOC_LISTS = ("uploaded_docs", "new_uploaded_docs", "kb")
+
+
+def _dumps(value: Any) -> str:
+    return json.dumps(value, sort_keys=True, default=str)
+
+
+def _messages_digest(encoded: List[str]) -> str:
+    """Signature of a run of encoded messages, used to tell an append from a rewrite."""
+    digest = hashlib.sha256()
+    for message in encoded:
+        digest.update(message.encode("utf-8"))
+        digest.update(b"\0")
+    return digest.hexdigest()
+
+
+class LazyDocument(dict):
+    """
+    A session document whose "content" is only read from the store when it
+    is first accessed. Everything else (id, filename, ...) is loaded eagerly.
+    """
+
+    def __init__(self, meta: Dict[str, Any], content_hash: str, loader: Optional[Callable[[str], str]] = None, content: Optional[str] = None):
+        super().__init__(meta)
+        self.content_hash = content_hash
+        self._loader = loader
+        if content is not None:
+            dict.__setitem__(self, "content", content)
+
+    @property
+    def loaded(self) -> bool:
+        return dict.__contains__(self, "content")
+
+    def _load(self):
+        if not self.loaded and self._loader is not None:
+            dict.__setitem__(self, "content", self._loader(self.content_hash))
+
+    def __getitem__(self, key):
+        if key == "content":
+            self._load()
+        return super().__getitem__(key)
+
+    def get(self, key, default=None):
+        if key == "content":
+            self._load()
+        return super().get(key, default)
+
+    def __contains__(self, key):
+        return key == "content" or super().__contains__(key)
+
+    def __len__(self):
+        return super().__len__() + (0 if self.loaded else 1)
+
+    def __iter__(self):
+        self._load()
+        return super().__iter__()
+
+    def keys(self):
+        self._load()
+        return super().keys()
+
+    def items(self):
+        self._load()
+        return super().items()
+
+    def values(self):
+        self._load()
+        return super().values()
+
+    def copy(self):
+        self._load()
+        return dict(super().items())
+
+    def meta(self) -> Dict[str, Any]:
+        return {k: v for k, v in super().items() if k != "content"}
+
+
+def session_nbytes(session: Dict[str, Any]) -> int:
+    """Approximate memory held by a session: message text plus loaded document content."""
+    total = len(_dumps({k: v for k, v in session.items() if k != MESSAGES and k not in DOC_LISTS}))
+    for message in session.get(MESSAGES) or []:
+        total += len(str(message.get("content", ""))) if isinstance(message, dict) else len(str(message))
+    seen = set()
+    for list_name in DOC_LISTS:
+        for doc in session.get(list_name) or []:
+            # The same document objects may appear in several lists
+            if id(doc) in seen or not isinstance(doc, dict):
+                continue
+            seen.add(id(doc))
+            # dict.get never triggers a LazyDocument load
+            total += len(dict.get(doc, "content") or "")
+    return total
+
+
+class StoredSession(dict):
+    """Session dict that remembers what was last persisted, so saves only write what changed."""
+
+    def __init__(self, data: Dict[str, Any], version: int = 0):
+        super().__init__(data)
+        self.version = version
+        self.baseline: Dict[str, str] = {}
+        self.persisted_messages = 0
+        self.persisted_digest = _messages_digest([])
+
+
+class SessionBackend:
+    """Storage interface behind SessionManager."""
+
+    def create(self, session: Dict[str, Any]) -> Dict[str, Any]:
+        raise NotImplementedError
+
+    def load(self, session_id: str) -> Optional[Dict[str, Any]]:
+        raise NotImplementedError
+
+    def save(self, session_id: str, session: Dict[str, Any]):
+        raise NotImplementedError
+
+    def delete(self, session_id: str) -> bool:
+        raise NotImplementedError
+
+    def exists(self, session_id: str) -> bool:
+        return self.load(session_id) is not None
+
+    def resident(self) -> Dict[str, Dict[str, Any]]:
+        """Sessions currently held in this process's memory."""
+        return {}
+
+    def evict(self, session_id: str) -> bool:
+        """Drop a session from this process's memory."""
+        return False
+
+    def flush(self):
+        """Write out any buffered changes."""
+
+    def close(self):
+        self.flush()
+
+    def stats(self) -> Dict[str, Any]:
+        return {}
+
+
+class InMemorySessionBackend(SessionBackend):
+    """Process-local sessions (lost on restart; single worker only)."""
+
+    def __init__(self):
+        self._sessions: Dict[str, Dict[str, Any]] = {}
+
+    def create(self, session: Dict[str, Any]) -> Dict[str, Any]:
+        self._sessions[session["session_id"]] = session
+        return session
+
+    def load(self, session_id: str) -> Optional[Dict[str, Any]]:
+        return self._sessions.get(session_id)
+
+    def save(self, session_id: str, session: Dict[str, Any]):
+        self._sessions[session_id] = session
+
+    def delete(self, session_id: str) -> bool:
+        return self._sessions.pop(session_id, None) is not None
+
+    def resident(self) -> Dict[str, Dict[str, Any]]:
+        return dict(self._sessions)
+
+    def evict(self, session_id: str) -> bool:
+        # There is no other copy: evicting an in-memory session deletes it
+        return self.delete(session_id)
+
+    def stats(self) -> Dict[str, Any]:
+        return {"backend": "memory", "sessions": len(self._sessions)}
+
+
+class SQLiteSessionBackend(SessionBackend):
+    """
+    SQLite (WAL) session store shared by every worker process.
+
+    - Scalar fields live in one JSON row per session; only keys that changed
+      since the session was loaded are written, so workers updating different
+      fields do not overwrite each other.
+    - Documents are stored as metadata rows plus content deduplicated by hash,
+      and are loaded as LazyDocument, so content is only read when used.
+    - Message appends are buffered and written in batches by a background
+      thread (write-behind), at most SESSION_FLUSH_INTERVAL seconds later.
+    - Loaded sessions are kept in a per-process identity map and reused while
+      their row version is unchanged.
+    """
+
+    def __init__(self, path: str = SESSION_DB_PATH, flush_interval: float = SESSION_FLUSH_INTERVAL):
+        self.path = path
+        self.flush_interval = flush_interval
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        # Autocommit mode: multi-statement writes use explicit BEGIN IMMEDIATE transactions
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=30, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS sessions (
+                session_id TEXT PRIMARY KEY,
+                data TEXT NOT NULL,
+                version INTEGER NOT NULL,
+                updated_at REAL NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS documents (
+                session_id TEXT NOT NULL,
+                list_name TEXT NOT NULL,
+                position INTEGER NOT NULL,
+                meta TEXT NOT NULL,
+                content_hash TEXT NOT NULL,
+                PRIMARY KEY (session_id, list_name, position)
+            );
+            CREATE INDEX IF NOT EXISTS idx_documents_hash ON documents(content_hash);
+            CREATE TABLE IF NOT EXISTS contents (
+                content_hash TEXT PRIMARY KEY,
+                content TEXT NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS messages (
+                session_id TEXT NOT NULL,
+                seq INTEGER NOT NULL,
+                data TEXT NOT NULL,
+                PRIMARY KEY (session_id, seq)
+            );
+            """
+        )
+        self._lock = threading.RLock()
+        self._cache: Dict[str, StoredSession] = {}
+        self._pending: List[Tuple[str, int, str]] = []
+        self.flushes = 0
+        self.flushed_messages = 0
+        self._stop = threading.Event()
+        self._wakeup = threading.Event()
+        self._flusher = threading.Thread(target=self._flush_loop, name="session-store-flush", daemon=True)
+        self._flusher.start()
+        count = self._conn.execute("SELECT COUNT(*) FROM sessions").fetchone()[0]
+        print(f"[SessionStore] Opened {path} ({count} sessions)")
+
+    # ---- helpers -----------------------------------------------------------
+
+    def _load_content(self, content_hash: str) -> str:
+        with self._lock:
+            row = self._conn.execute("SELECT content FROM contents WHERE content_hash = ?", (content_hash,)).fetchone()
+        return row[0] if row else ""
+
+    @staticmethod
+    def _scalar_fields(session: Dict[str, Any]) -> Dict[str, Any]:
+        return {k: v for k, v in session.items() if k != MESSAGES and k not in DOC_LISTS}
+
+    def _as_lazy(self, doc: Any) -> Any:
+        """Wrap a plain document dict so its content hash is computed once."""
+        if isinstance(doc, LazyDocument) or not isinstance(doc, dict):
+            return doc
+        content = doc.get("content") or ""
+        meta = {k: v for k, v in doc.items() if k != "content"}
+        return LazyDocument(meta, text_hash(content), self._load_content, content=content)
+
+    @staticmethod
+    def _doc_signature(docs: List[Any]) -> str:
+        return _dumps([
+            [doc.meta(), doc.content_hash] if isinstance(doc, LazyDocument) else doc
+            for doc in docs
+        ])
+
+    def _baseline_for(self, session: Dict[str, Any]) -> Dict[str, str]:
+        baseline = {k: _dumps(v) for k, v in self._scalar_fields(session).items()}
+        for list_name in DOC_LISTS:
+            baseline[list_name] = self._doc_signature(session.get(list_name) or [])
+        return baseline
+
+    # ---- interface ---------------------------------------------------------
+
+    def create(self, session: Dict[str, Any]) -> Dict[str, Any]:
+        stored = StoredSession(session)
+        self.save(session["session_id"], stored)
+        return stored
+
+    def load(self, session_id: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            row = self._conn.execute("SELECT version FROM sessions WHERE session_id = ?", (session_id,)).fetchone()
+            if row is None:
+                self._cache.pop(session_id, None)
+                return None
+            cached = self._cache.get(session_id)
+            if cached is not None and cached.version == row[0]:
+                return cached
+
+            # Another worker changed it: make sure our own buffered messages are in first
+            self._flush_locked()
+            data, version = self._conn.execute(
+                "SELECT data, version FROM sessions WHERE session_id = ?", (session_id,)
+            ).fetchone()
+            session = StoredSession(json.loads(data), version)
+            for list_name in DOC_LISTS:
+                session[list_name] = []
+            for list_name, meta, content_hash in self._conn.execute(
+                "SELECT list_name, meta, content_hash FROM documents WHERE session_id = ? ORDER BY list_name, position",
+                (session_id,),
+            ):
+                session.setdefault(list_name, []).append(LazyDocument(json.loads(meta), content_hash, self._load_content))
+            session[MESSAGES] = [
+                json.loads(m) for (m,) in self._conn.execute(
+                    "SELECT data FROM messages WHERE session_id = ? ORDER BY seq", (session_id,)
+                )
+            ]
+            session.persisted_messages = len(session[MESSAGES])
+            session.persisted_digest = _messages_digest([_dumps(m) for m in session[MESSAGES]])
+            session.baseline = self._baseline_for(session)
+            self._cache[session_id] = session
+            return session
+
+    def save(self, session_id: str, session: Dict[str, Any]):
+        stored = session if isinstance(session, StoredSession) else StoredSession(session)
+        with self._lock:
+            for list_name in DOC_LISTS:
+                docs = stored.get(list_name)
+                if docs:
+                    docs[:] = [self._as_lazy(doc) for doc in docs]
+
+            scalars = self._scalar_fields(stored)
+            changed = {k: v for k, v in scalars.items() if stored.baseline.get(k) != _dumps(v)}
+            removed = [k for k in stored.baseline if k not in scalars and k not in DOC_LISTS]
+            changed_lists = [
+                list_name for list_name in DOC_LISTS
+                if stored.baseline.get(list_name) != self._doc_signature(stored.get(list_name) or [])
+            ]
+
+            encoded = [_dumps(m) for m in stored.get(MESSAGES) or []]
+            persisted = stored.persisted_messages
+            if len(encoded) < persisted or _messages_digest(encoded[:persisted]) != stored.persisted_digest:
+                # History was rewritten (trimmed, edited) rather than appended to
+                self._rewrite_messages_locked(session_id, stored, encoded)
+            else:
+                for seq in range(persisted, len(encoded)):
+                    self._pending.append((session_id, seq, encoded[seq]))
+            stored.persisted_messages = len(encoded)
+            stored.persisted_digest = _messages_digest(encoded)
+
+            if changed or removed or changed_lists or stored.version == 0:
+                self._write_locked(session_id, stored, changed, removed, changed_lists)
+            self._cache[session_id] = stored
+            if len(self._pending) >= SESSION_FLUSH_MAX_PENDING:
+                self._wakeup.set()
+
+    def _write_locked(self, session_id: str, stored: StoredSession, changed: Dict[str, Any], removed: List[str], changed_lists: List[str]):
+        conn = self._conn
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute("SELECT data, version FROM sessions WHERE session_id = ?", (session_id,)).fetchone()
+            data, version = (json.loads(row[0]), row[1]) if row else ({}, 0)
+            # Someone else wrote since we loaded: their list/message changes need a reload
+            stale = row is not None and version != stored.version
+            # Merge only our changes into whatever other workers wrote meanwhile
+            data.update(changed)
+            for key in removed:
+                data.pop(key, None)
+            version += 1
+            conn.execute(
+                "INSERT OR REPLACE INTO sessions (session_id, data, version, updated_at) VALUES (?, ?, ?, ?)",
+                (session_id, _dumps(data), version, time.time()),
+            )
+            for list_name in changed_lists:
+                docs = stored.get(list_name) or []
+                conn.execute("DELETE FROM documents WHERE session_id = ? AND list_name = ?", (session_id, list_name))
+                conn.executemany(
+                    "INSERT OR IGNORE INTO contents (content_hash, content) VALUES (?, ?)",
+                    [(doc.content_hash, dict.__getitem__(doc, "content")) for doc in docs if isinstance(doc, LazyDocument) and doc.loaded],
+                )
+                conn.executemany(
+                    "INSERT INTO documents (session_id, list_name, position, meta, content_hash) VALUES (?, ?, ?, ?, ?)",
+                    [
+                        (session_id, list_name, i, _dumps(doc.meta()), doc.content_hash)
+                        for i, doc in enumerate(docs) if isinstance(doc, LazyDocument)
+                    ],
+                )
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        # Other fields may have been changed by another worker; pick them up
+        for key, value in data.items():
+            if key not in changed and key != "session_id":
+                dict.__setitem__(stored, key, value)
+        stored.version = -1 if stale else version
+        stored.baseline = self._baseline_for(stored)
+
+    def _rewrite_messages_locked(self, session_id: str, stored: StoredSession, encoded: List[str]):
+        """Replace every stored message of a session in one transaction."""
+        self._flush_locked()
+        conn = self._conn
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.execute("DELETE FROM messages WHERE session_id = ?", (session_id,))
+            conn.executemany(
+                "INSERT INTO messages (session_id, seq, data) VALUES (?, ?, ?)",
+                [(session_id, seq, data) for seq, data in enumerate(encoded)],
+            )
+            conn.execute("UPDATE sessions SET version = version + 1, updated_at = ? WHERE session_id = ?", (time.time(), session_id))
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        if stored.version > 0:
+            stored.version += 1
+        cached = self._cache.get(session_id)
+        if cached is not None and cached is not stored:
+            cached.version += 1
+
+    def delete(self, session_id: str) -> bool:
+        with self._lock:
+            self._flush_locked()
+            self._cache.pop(session_id, None)
+            conn = self._conn
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                hashes = [h for (h,) in conn.execute("SELECT DISTINCT content_hash FROM documents WHERE session_id = ?", (session_id,))]
+                existed = conn.execute("DELETE FROM sessions WHERE session_id = ?", (session_id,)).rowcount > 0
+                conn.execute("DELETE FROM documents WHERE session_id = ?", (session_id,))
+                conn.execute("DELETE FROM messages WHERE session_id = ?", (session_id,))
+                # Content is shared between sessions; drop only what nobody references anymore
+                conn.executemany(
+                    "DELETE FROM contents WHERE content_hash = ? AND NOT EXISTS (SELECT 1 FROM documents WHERE content_hash = ?)",
+                    [(h, h) for h in hashes],
+                )
+                conn.execute("COMMIT")
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+            return existed
+
+    def exists(self, session_id: str) -> bool:
+        with self._lock:
+            return self._conn.execute("SELECT 1 FROM sessions WHERE session_id = ?", (session_id,)).fetchone() is not None
+
+    def resident(self) -> Dict[str, Dict[str, Any]]:
+        with self._lock:
+            return dict(self._cache)
+
+    def evict(self, session_id: str) -> bool:
+        # Buffered messages stay queued; the next load flushes them before reading
+        with self._lock:
+            return self._cache.pop(session_id, None) is not None
+
+    # ---- write-behind ------------------------------------------------------
+
+    def _flush_locked(self):
+        if not self._pending:
+            return
+        pending, self._pending = self._pending, []
+        conn = self._conn
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.executemany("INSERT OR REPLACE INTO messages (session_id, seq, data) VALUES (?, ?, ?)", pending)
+            session_ids = sorted({p[0] for p in pending})
+            # Bump versions so other workers reload the new messages
+            conn.executemany(
+                "UPDATE sessions SET version = version + 1, updated_at = ? WHERE session_id = ?",
+                [(time.time(), sid) for sid in session_ids],
+            )
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            self._pending = pending + self._pending
+            raise
+        for sid in session_ids:
+            cached = self._cache.get(sid)
+            if cached is not None:
+                cached.version += 1
+        self.flushes += 1
+        self.flushed_messages += len(pending)
+
+    def flush(self):
+        with self._lock:
+            self._flush_locked()
+
+    def _flush_loop(self):
+        while not self._stop.is_set():
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            try:
+                self.flush()
+            except Exception as e:
+                print(f"[SessionStore] Flush failed, will retry: {e}")
+
+    def close(self):
+        self._stop.set()
+        self._wakeup.set()
+        self._flusher.join(timeout=5)
+        self.flush()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            sessions = self._conn.execute("SELECT COUNT(*) FROM sessions").fetchone()[0]
+            contents = self._conn.execute("SELECT COUNT(*), COALESCE(SUM(LENGTH(content)), 0) FROM contents").fetchone()
+            return {
+                "backend": "sqlite",
+                "sessions": sessions,
+                "cached_sessions": len(self._cache),
+                "stored_documents": contents[0],
+                "stored_content_chars": contents[1],
+                "pending_messages": len(self._pending),
+                "flushes": self.flushes,
+                "flushed_messages": self.flushed_messages,
+            }
+
+
+def _create_backend() -> SessionBackend:
+    if SESSION_BACKEND == "memory":
+        return InMemorySessionBackend()
+    return SQLiteSessionBackend()
+
+
+# Global session store instance
+session_store = _create_backend()
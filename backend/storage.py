@@ -113,6 +113,17 @@ class CloudflareR2Storage:
         except Exception:
             return None
 
+    def put_file_bytes(self, key: str, file_data: bytes) -> bool:
+        """Store raw bytes under an exact key in the bucket (no local fallback)."""
+        if self.use_local_fallback or not self.r2:
+            return False
+        try:
+            self.r2.upload_fileobj(BytesIO(file_data), self.bucket_name, key)
+            return True
+        except Exception as e:
+            logger.warning(f"R2 put failed for {key}: {e}")
+            return False
+
     def download_file(self, key: str, local_download_path: str) -> bool:
         is_user = key.startswith("user_docs/")
         if not self.use_local_fallback and self.r2:
@@ -0,0 +1,77 @@
+# stream_output.py
+import os
+import asyncio
+from typing import Any, AsyncIterator, Dict, List, Optional
+
+from starlette.requests import Request
+
+# Content chunks are merged into one SSE frame until the window elapses or the frame is big enough
+STREAM_FLUSH_INTERVAL_MS = float(os.getenv("STREAM_FLUSH_INTERVAL_MS", "30"))
+STREAM_FLUSH_BYTES = int(os.getenv("STREAM_FLUSH_BYTES", "1024"))
+
+
+def _content_frame(parts: List[str]) -> Dict[str, Any]:
+    return {"type": "content", "data": {"content": "".join(parts), "is_complete": False}}
+
+
+async def coalesce_chunks(
+    queue: asyncio.Queue,
+    flush_interval_ms: float = STREAM_FLUSH_INTERVAL_MS,
+    flush_bytes: int = STREAM_FLUSH_BYTES,
+) -> AsyncIterator[Dict[str, Any]]:
+    """
+    Read stream items from `queue` until the `None` sentinel, merging
+    consecutive "content" items into one frame. A frame is flushed
+    `flush_interval_ms` after its first chunk arrived or once it holds
+    `flush_bytes`, whichever comes first, so frame rate is bounded without
+    delaying fast models. Any other item flushes pending content first and
+    is passed through unchanged. An interval of 0 disables coalescing.
+    """
+    loop = asyncio.get_running_loop()
+    interval = flush_interval_ms / 1000
+    pending: List[str] = []
+    pending_bytes = 0
+    deadline: Optional[float] = None
+
+    while True:
+        if pending:
+            try:
+                item = await asyncio.wait_for(queue.get(), max(0.0, deadline - loop.time()))
+            except asyncio.TimeoutError:
+                yield _content_frame(pending)
+                pending, pending_bytes = [], 0
+                continue
+        else:
+            item = await queue.get()
+
+        if item is not None and item.get("type") == "content":
+            content = item["data"].get("content", "")
+            if not pending:
+                deadline = loop.time() + interval
+            pending.append(content)
+            pending_bytes += len(content.encode("utf-8"))
+            if pending_bytes >= flush_bytes or interval <= 0:
+                yield _content_frame(pending)
+                pending, pending_bytes = [], 0
+            continue
+
+        if pending:
+            yield _content_frame(pending)
+            pending, pending_bytes = [], 0
+        if item is None:
+            return
+        yield item
+
+
+async def cancel_on_disconnect(request: Request, task: asyncio.Task):
+    """
+    Cancel `task` as soon as the client of `request` disconnects. The request
+    body must already have been read, so the next ASGI message is the
+    disconnect. Without this a disconnect is only noticed on the next write.
+    """
+    while not task.done():
+        message = await request.receive()
+        if message["type"] == "http.disconnect":
+            if not task.done():
+                task.cancel()
+            return
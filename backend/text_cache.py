@@ -0,0 +1,168 @@
+# text_cache.py
+import os
+import gzip
+import json
+import hashlib
+import asyncio
+import threading
+from typing import Any, Dict, List, Optional
+
+EXTRACTED_TEXT_CACHE_DIR = os.getenv("EXTRACTED_TEXT_CACHE_DIR", "local_storage/extracted_text")
+EXTRACTED_TEXT_CACHE_MAX_BYTES = int(os.getenv("EXTRACTED_TEXT_CACHE_MAX_BYTES", str(1024 * 1024 * 1024)))
+# Also keep entries in the R2 bucket so other instances and restarts on fresh disks can reuse them
+EXTRACTED_TEXT_CACHE_R2 = os.getenv("EXTRACTED_TEXT_CACHE_R2", "false").lower() == "true"
+R2_PREFIX = "extracted_text/"
+# Bump when extraction output changes so stale entries are not served
+EXTRACTOR_VERSION = "1"
+
+
+def file_content_hash(file_content: bytes) -> str:
+    return hashlib.sha256(file_content).hexdigest()
+
+
+class ExtractedTextCache:
+    """
+    Extracted page texts keyed by (sha256 of the file bytes, file kind,
+    extractor version), stored as gzipped JSON on local disk and optionally
+    in the R2 bucket. The local directory is trimmed to `max_bytes` by
+    evicting the least recently used files.
+    """
+
+    def __init__(self, directory: str = EXTRACTED_TEXT_CACHE_DIR, max_bytes: int = EXTRACTED_TEXT_CACHE_MAX_BYTES, use_r2: bool = EXTRACTED_TEXT_CACHE_R2):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.use_r2 = use_r2
+        self.local_hits = 0
+        self.remote_hits = 0
+        self.misses = 0
+        self.writes = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+        self._total_bytes: Optional[int] = None
+
+    @staticmethod
+    def key(file_content: bytes, kind: str) -> str:
+        return f"{file_content_hash(file_content)}-{kind}-v{EXTRACTOR_VERSION}"
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, key[:2], f"{key}.json.gz")
+
+    def _storage(self):
+        # Imported lazily: creating the R2 client talks to the network
+        from storage import storage
+        return storage
+
+    def _read_local(self, key: str) -> Optional[bytes]:
+        path = self._path(key)
+        try:
+            with open(path, "rb") as f:
+                blob = f.read()
+            os.utime(path)  # mark as recently used
+            return blob
+        except FileNotFoundError:
+            return None
+
+    def _write_local(self, key: str, blob: bytes):
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = f"{path}.{threading.get_ident()}.tmp"
+        with open(tmp, "wb") as f:
+            f.write(blob)
+        with self._lock:
+            # Overwriting an entry replaces its bytes rather than adding to them
+            try:
+                old_size = os.path.getsize(path)
+            except FileNotFoundError:
+                old_size = 0
+            os.replace(tmp, path)
+            if self._total_bytes is None:
+                self._total_bytes = self._scan_bytes()
+            else:
+                self._total_bytes += len(blob) - old_size
+            if self._total_bytes > self.max_bytes:
+                self._evict_locked()
+
+    def _files(self):
+        for root, _, names in os.walk(self.directory):
+            for name in names:
+                if name.endswith(".json.gz"):
+                    path = os.path.join(root, name)
+                    try:
+                        st = os.stat(path)
+                    except FileNotFoundError:
+                        continue
+                    yield path, st.st_size, st.st_mtime
+
+    def _scan_bytes(self) -> int:
+        return sum(size for _, size, _ in self._files())
+
+    def _evict_locked(self):
+        target = int(self.max_bytes * 0.9)
+        for path, size, _ in sorted(self._files(), key=lambda f: f[2]):
+            if self._total_bytes <= target:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                continue
+            self._total_bytes -= size
+            self.evictions += 1
+
+    def _get_blocking(self, key: str) -> Optional[List[str]]:
+        blob = self._read_local(key)
+        if blob is not None:
+            self.local_hits += 1
+        elif self.use_r2:
+            blob = self._storage().get_file_content_bytes(f"{R2_PREFIX}{key}.json.gz")
+            if blob is not None:
+                self.remote_hits += 1
+                self._write_local(key, blob)
+        if blob is None:
+            self.misses += 1
+            return None
+        try:
+            return json.loads(gzip.decompress(blob))
+        except Exception as e:
+            print(f"[TextCache] Dropping unreadable entry {key}: {e}")
+            return None
+
+    def _put_blocking(self, key: str, pages: List[str]):
+        blob = gzip.compress(json.dumps(pages).encode("utf-8"), compresslevel=5)
+        self._write_local(key, blob)
+        if self.use_r2:
+            self._storage().put_file_bytes(f"{R2_PREFIX}{key}.json.gz", blob)
+        self.writes += 1
+
+    async def get(self, key: str) -> Optional[List[str]]:
+        """Cached page texts for a file, or None."""
+        try:
+            return await asyncio.to_thread(self._get_blocking, key)
+        except Exception as e:
+            print(f"[TextCache] Lookup failed for {key}: {e}")
+            return None
+
+    async def put(self, key: str, pages: List[str]):
+        try:
+            await asyncio.to_thread(self._put_blocking, key, pages)
+        except Exception as e:
+            print(f"[TextCache] Failed to store {key}: {e}")
+
+    def stats(self) -> Dict[str, Any]:
+        hits = self.local_hits + self.remote_hits
+        lookups = hits + self.misses
+        return {
+            "hits": hits,
+            "local_hits": self.local_hits,
+            "remote_hits": self.remote_hits,
+            "misses": self.misses,
+            "hit_rate": round(hits / lookups, 4) if lookups else 0.0,
+            "writes": self.writes,
+            "evictions": self.evictions,
+            "bytes": self._total_bytes,
+            "max_bytes": self.max_bytes,
+            "r2_enabled": self.use_r2,
+        }
+
+
+# Global extracted-text cache instance
+text_cache = ExtractedTextCache()
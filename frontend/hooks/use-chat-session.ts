@@ -14,6 +14,30 @@ interface ChatSessionHook {
   updateGPTConfig: (model: string) => Promise<void>;
 }
 
+const INGEST_POLL_INTERVAL_MS = 1000;
+const INGEST_POLL_TIMEOUT_MS = 5 * 60 * 1000;
+
+// add-documents answers 202 right away; poll the returned job until the documents are indexed
+async function waitForIngestJob(statusUrl: string): Promise<string> {
+  const deadline = Date.now() + INGEST_POLL_TIMEOUT_MS;
+  while (Date.now() < deadline) {
+    const response = await fetch(`${process.env.NEXT_PUBLIC_BACKEND_URL}${statusUrl}`);
+    if (!response.ok) {
+      throw new Error(`Failed to get ingestion status: ${response.status}`);
+    }
+    const job = await response.json();
+    if (job.status === "completed" || job.status === "failed") {
+      if (job.status === "failed") {
+        console.error("Ingestion job failed:", job.error);
+      }
+      return job.status;
+    }
+    await new Promise((resolve) => setTimeout(resolve, INGEST_POLL_INTERVAL_MS));
+  }
+  console.error("Timed out waiting for ingestion job:", statusUrl);
+  return "timeout";
+}
+
 export function useChatSession(): ChatSessionHook {
   const params = useParams();
   const gptId = params.id as string;
@@ -104,6 +128,7 @@ export function useChatSession(): ChatSessionHook {
         const backendModelName = frontendToBackend(gpt.model);
 
         const gptConfigData = {
+          gpt_id: gptId,
           model: backendModelName,
           webBrowser: gpt.webBrowser,
           hybridRag: gpt.hybridRag,
@@ -176,6 +201,8 @@ export function useChatSession(): ChatSessionHook {
               const errorText = await kbResponse.text();
             } else {
               const responseData = await kbResponse.json();
+              // Keep the session initializing until the knowledge base is attached
+              await waitForIngestJob(responseData.status_url);
             }
           } catch (backendError) {
             // Don't throw here, just log the error and continue
@@ -227,6 +254,7 @@ export function useChatSession(): ChatSessionHook {
         }
 
         const responseData = await response.json();
+        await waitForIngestJob(responseData.status_url);
       } catch (error) {
         throw error;
       }